@@ -0,0 +1,110 @@
+"""
+管理画面の Basic 認証
+
+認証情報（settings.BASIC_AUTH_USERS）は設定ごとに一度だけ読み込み、以降のリクエストでは
+Authorization ヘッダーの検証だけを行う。
+
+- パスワードは平文、または Django のパスワードハッシュ（make_password の出力）で設定できる
+- 平文の比較は hmac.compare_digest で行い、一致するまでの時間から内容を推測されないようにする
+- 検証に成功したヘッダーはダイジェスト（SHA-256）だけを BASIC_AUTH_CACHE_SECONDS 秒保持し、
+  その間の同じヘッダーは base64 のデコードとパスワードの照合（ハッシュは特に重い）を省く
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher
+
+# 検証済みヘッダーのキャッシュの最大件数（超えたら一度空にする）
+VERIFIED_CACHE_MAX_ENTRIES = 1024
+
+
+class BasicAuthenticator:
+    """ユーザー名とパスワード（平文またはハッシュ）の組で Authorization ヘッダーを検証する。"""
+
+    def __init__(self, users: dict[str, str], cache_seconds: int = 0):
+        # ユーザー名 -> (照合に使う値, ハッシュかどうか)
+        # パスワードが空のユーザーは、空のパスワードで認証できてしまうため登録しない
+        self._users = {
+            username: (password, _is_password_hash(password))
+            for username, password in users.items()
+            if username and password
+        }
+        self._cache_seconds = cache_seconds
+        # ヘッダーのダイジェスト -> (ユーザー名, 有効期限)
+        self._verified: dict[bytes, tuple[str, float]] = {}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._users)
+
+    def authenticate(self, header: str) -> tuple[str | None, str | None]:
+        """Authorization ヘッダーを検証し、(ユーザー名, エラーメッセージ) を返す。"""
+        if not header.startswith("Basic "):
+            return None, "認証が必要です"
+
+        digest = hashlib.sha256(header.encode()).digest()
+        cached = self._verified.get(digest)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0], None
+
+        try:
+            decoded = base64.b64decode(header[6:], validate=True).decode("utf-8")
+            username, password = decoded.split(":", 1)
+        except (binascii.Error, ValueError, UnicodeDecodeError):
+            return None, "認証情報が無効です"
+
+        if not self._check(username, password):
+            return None, "認証に失敗しました"
+
+        if self._cache_seconds > 0:
+            if len(self._verified) >= VERIFIED_CACHE_MAX_ENTRIES:
+                self._verified.clear()
+            self._verified[digest] = (username, time.monotonic() + self._cache_seconds)
+        return username, None
+
+    def _check(self, username: str, password: str) -> bool:
+        expected, hashed = self._users.get(username, ("", False))
+        if hashed:
+            return check_password(password, expected)
+        # ユーザー名が存在しない場合も同じ比較を行い、応答時間を揃える
+        matched = hmac.compare_digest(password.encode(), expected.encode())
+        return matched and username in self._users
+
+
+def _is_password_hash(value: str) -> bool:
+    try:
+        identify_hasher(value)
+    except ValueError:
+        return False
+    return True
+
+
+_authenticators: dict[tuple, BasicAuthenticator] = {}
+_authenticators_lock = threading.Lock()
+
+
+def get_authenticator() -> BasicAuthenticator:
+    """設定（BASIC_AUTH_USERS / BASIC_AUTH_CACHE_SECONDS）に応じた認証器を返す。"""
+    users = settings.BASIC_AUTH_USERS
+    config = (tuple(sorted(users.items())), settings.BASIC_AUTH_CACHE_SECONDS)
+
+    authenticator = _authenticators.get(config)
+    if authenticator is not None:
+        return authenticator
+
+    with _authenticators_lock:
+        authenticator = _authenticators.get(config)
+        if authenticator is None:
+            # 設定が変わったら古い認証器（検証済みヘッダーのキャッシュ）は使わない
+            _authenticators.clear()
+            authenticator = BasicAuthenticator(
+                dict(users), cache_seconds=settings.BASIC_AUTH_CACHE_SECONDS
+            )
+            _authenticators[config] = authenticator
+    return authenticator
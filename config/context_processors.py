@@ -1,8 +1,7 @@
 from django.conf import settings
-from django.db.models import Sum
 from django.http import HttpRequest
 
-from products.models import Cart
+from products.services.cart import get_badge_quantity
 
 
 def site_constants(request: HttpRequest) -> dict[str, str | int]:
@@ -17,21 +16,15 @@ def cart_badge(request: HttpRequest) -> dict[str, int]:
     """
     ナビゲーションのカートバッジ用に、現在のカート内総数量を返す。
 
-    - セッションが未作成、または Cart が存在しない場合は 0
-    - CartItem の quantity 合計を集計して返す
+    - セッションが未作成、またはカートが空の場合は 0
+    - 在庫がある明細の quantity 合計を返す（在庫の有無は在庫数のキャッシュで判定する）
+    - ビューで集計済み（request.cart_total_quantity）の場合はそれを使う
     """
+    if hasattr(request, "cart_total_quantity"):
+        return {"cart_total_quantity": request.cart_total_quantity}
+
     session_key = request.session.session_key
     if session_key is None:
         return {"cart_total_quantity": 0}
 
-    cart = Cart.objects.filter(session_key=session_key).first()
-    if cart is None:
-        return {"cart_total_quantity": 0}
-
-    total_quantity = (
-        cart.items.filter(product__stock__gt=0)
-        .aggregate(total=Sum("quantity"))
-        .get("total")
-        or 0
-    )
-    return {"cart_total_quantity": total_quantity}
+    return {"cart_total_quantity": get_badge_quantity(session_key)}
@@ -0,0 +1,63 @@
+"""
+読み取り用レプリカへのルーティング
+
+DATABASE_REPLICAS にレプリカの DB エイリアスがある場合、`replica_reads()` の中
+（read_from_replica を付けたビュー）で発行される products アプリの読み取りを
+レプリカに振り分ける。それ以外の読み取りと、すべての書き込みは default に送る。
+
+- セッション・認証などのテーブルは、常に default から読む
+- カートや注文を更新した直後のセッションは、PrimaryStickinessMiddleware が付ける
+  Cookie の有効期間中は default から読む（自分の更新が必ず見える: read-your-writes）
+"""
+
+import random
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import HttpRequest
+
+# 非同期ビューから sync_to_async で呼んだ処理にも引き継がれるよう ContextVar で持つ
+_replica_reads: ContextVar[bool] = ContextVar("replica_reads", default=False)
+
+REPLICA_APP_LABELS = {"products"}
+
+
+@contextmanager
+def replica_reads() -> Iterator[None]:
+    """この中で発行される読み取りをレプリカに振り分ける。"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def is_pinned_to_primary(request: HttpRequest) -> bool:
+    """直前に更新を行ったセッションで、default から読む必要があるかを返す。"""
+    return settings.READ_REPLICA_STICKY_COOKIE in request.COOKIES
+
+
+class ReplicaRouter:
+    """読み取りをレプリカ、書き込みを default に振り分けるルーター。"""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (
+            replicas
+            and _replica_reads.get()
+            and model._meta.app_label in REPLICA_APP_LABELS
+        ):
+            return random.choice(replicas)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカは default の複製なので、どの DB から読んだ行同士も関連付けてよい
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == "default"
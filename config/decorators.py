@@ -2,74 +2,81 @@
 カスタムデコレータ
 """
 
-import base64
-import os
 from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
 from django.http import HttpRequest, HttpResponse
 
+from config.basic_auth import get_authenticator
+from config.db_router import is_pinned_to_primary, replica_reads
+
 
 def basic_auth_required(view_func):
     """
     Basic認証を要求するデコレータ。
 
-    認証情報は環境変数から取得する。
-    - BASIC_AUTH_USER
-    - BASIC_AUTH_PASSWORD
+    認証情報は settings.BASIC_AUTH_USERS（環境変数 BASIC_AUTH_USERS /
+    BASIC_AUTH_USER・BASIC_AUTH_PASSWORD から読み込む）を使う。
+    検証は config.basic_auth.BasicAuthenticator を参照。
     """
 
     @wraps(view_func)
     def _wrapped_view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
-        basic_user = os.getenv("BASIC_AUTH_USER")
-        basic_password = os.getenv("BASIC_AUTH_PASSWORD")
-
-        if not basic_user or not basic_password:
+        authenticator = get_authenticator()
+        if not authenticator.configured:
             return HttpResponse(
                 "Basic認証が未設定です",
                 status=500,
                 content_type="text/plain; charset=utf-8",
             )
 
-        # Authorizationヘッダーを取得
-        auth_header = request.META.get("HTTP_AUTHORIZATION", "")
+        _, error = authenticator.authenticate(
+            request.META.get("HTTP_AUTHORIZATION", "")
+        )
+        if error is not None:
+            return _unauthorized(error)
+        return view_func(request, *args, **kwargs)
 
-        if not auth_header.startswith("Basic "):
-            # Basic認証が提供されていない場合、401を返す
-            response = HttpResponse(
-                "認証が必要です", status=401, content_type="text/plain; charset=utf-8"
-            )
-            response["WWW-Authenticate"] = 'Basic realm="ProductManagement"'
-            response["Cache-Control"] = "no-cache, no-store, must-revalidate"
-            response["Pragma"] = "no-cache"
-            response["Expires"] = "0"
-            return response
-
-        # Basic認証の認証情報をデコード
-        try:
-            auth_decoded = base64.b64decode(auth_header[6:]).decode("utf-8")
-            username, password = auth_decoded.split(":", 1)
-        except (ValueError, UnicodeDecodeError):
-            response = HttpResponse(
-                "認証情報が無効です",
-                status=401,
-                content_type="text/plain; charset=utf-8",
-            )
-            response["WWW-Authenticate"] = 'Basic realm="ProductManagement"'
-            response["Cache-Control"] = "no-cache, no-store, must-revalidate"
-            response["Pragma"] = "no-cache"
-            response["Expires"] = "0"
-            return response
-
-        # 認証情報を検証
-        if username == basic_user and password == basic_password:
-            return view_func(request, *args, **kwargs)
+    return _wrapped_view
 
-        response = HttpResponse(
-            "認証に失敗しました", status=401, content_type="text/plain; charset=utf-8"
-        )
-        response["WWW-Authenticate"] = 'Basic realm="ProductManagement"'
-        response["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response["Pragma"] = "no-cache"
-        response["Expires"] = "0"
-        return response
+
+def _unauthorized(message: str) -> HttpResponse:
+    """認証を求める 401 レスポンスを返す（ブラウザ・プロキシにはキャッシュさせない）。"""
+    response = HttpResponse(
+        message, status=401, content_type="text/plain; charset=utf-8"
+    )
+    response["WWW-Authenticate"] = 'Basic realm="ProductManagement"'
+    response["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response["Pragma"] = "no-cache"
+    response["Expires"] = "0"
+    return response
+
+
+def read_from_replica(view_func):
+    """
+    ビュー内の読み取りを読み取り用レプリカに振り分けるデコレータ（同期・非同期ビューに対応）。
+
+    直前に更新を行ったセッション（READ_REPLICA_STICKY_COOKIE がある場合）は、
+    自分の更新が確実に見えるよう default から読む。
+    """
+    if iscoroutinefunction(view_func):
+
+        @wraps(view_func)
+        async def _wrapped_async_view(
+            request: HttpRequest, *args, **kwargs
+        ) -> HttpResponse:
+            if is_pinned_to_primary(request):
+                return await view_func(request, *args, **kwargs)
+            with replica_reads():
+                return await view_func(request, *args, **kwargs)
+
+        return _wrapped_async_view
+
+    @wraps(view_func)
+    def _wrapped_view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        if is_pinned_to_primary(request):
+            return view_func(request, *args, **kwargs)
+        with replica_reads():
+            return view_func(request, *args, **kwargs)
 
     return _wrapped_view
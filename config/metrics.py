@@ -0,0 +1,76 @@
+"""
+アプリケーションメトリクス（Prometheus 形式）
+
+gunicorn の複数ワーカーで集計する場合は、環境変数 PROMETHEUS_MULTIPROC_DIR に
+書き込み可能なディレクトリを指定して起動する（gunicorn.conf.py を参照）。
+"""
+
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# --- リクエスト ---
+REQUESTS = Counter(
+    "velo_http_requests_total",
+    "ビューごとのリクエスト数",
+    ["view", "method", "status"],
+)
+REQUEST_DURATION = Histogram(
+    "velo_http_request_duration_seconds",
+    "ビューごとのレスポンス時間（秒）",
+    ["view"],
+)
+
+# --- カート ---
+CART_MUTATIONS = Counter(
+    "velo_cart_mutations_total",
+    "カート操作の回数",
+    ["action"],
+)
+PROMOTION_APPLY = Counter(
+    "velo_promotion_apply_total",
+    "プロモーションコード適用の試行回数",
+    ["result"],
+)
+
+# --- 注文 ---
+CHECKOUTS = Counter(
+    "velo_checkouts_total",
+    "注文確定処理の結果ごとの回数",
+    ["result"],
+)
+LOCK_WAIT = Histogram(
+    "velo_checkout_lock_wait_seconds",
+    "注文確定時の select_for_update による行ロック待ち時間（秒）",
+    ["target"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+ORDER_MAIL_DURATION = Histogram(
+    "velo_order_mail_duration_seconds",
+    "注文確認メールの送信時間（秒）",
+    ["result"],
+)
+
+
+def render_latest() -> tuple[bytes, str]:
+    """
+    現在のメトリクスをテキスト形式で返す。
+
+    Returns:
+        (本文, Content-Type) のタプル。
+        PROMETHEUS_MULTIPROC_DIR が設定されている場合は全ワーカー分を集計する。
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
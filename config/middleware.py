@@ -0,0 +1,492 @@
+"""
+カスタムミドルウェア
+"""
+
+import contextvars
+import json
+import logging
+import random
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpRequest, HttpResponse
+from django.template.backends.django import Template as DjangoTemplate
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from config.metrics import REQUEST_DURATION, REQUESTS
+
+try:
+    import brotli
+except ImportError:  # Brotli 未導入の環境では gzip のみで圧縮する
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# レスポンスに CSRF トークンのフィールドが含まれるかどうかの目印（JSON 内の HTML 断片でも一致する）
+CSRF_FIELD_MARKER = b"csrfmiddlewaretoken"
+
+_PLACEHOLDER_RE = re.compile(r"%s|'(?:[^']|'')*'|\b\d+\b")
+_IN_LIST_RE = re.compile(r"\((?:\?, )+\?\)")
+_SAVEPOINT_RE = re.compile(r"^(?:RELEASE )?SAVEPOINT|^ROLLBACK TO SAVEPOINT")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    SQL をパラメータ・リテラルを除いた「形」に正規化する。
+
+    - %s・文字列リテラル・数値は ? に置き換える
+    - IN (?, ?, ...) のような可変長のリストは (...) にまとめる
+    """
+    shape = _PLACEHOLDER_RE.sub("?", sql)
+    return _IN_LIST_RE.sub("(...)", shape)
+
+
+def _find_caller() -> str | None:
+    """SQL を発行したプロジェクト内のコード位置（ファイル:行 (関数名)）を返す。"""
+    base_dir = str(settings.BASE_DIR)
+    this_file = str(Path(__file__).resolve())
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if (
+            not filename.startswith(base_dir)
+            or filename == this_file
+            or "site-packages" in filename
+        ):
+            continue
+        return f"{Path(filename).relative_to(base_dir)}:{frame.lineno} ({frame.name})"
+    return None
+
+
+@dataclass
+class RepeatedQuery:
+    """1リクエスト内で繰り返し発行された同じ形の SQL。"""
+
+    shape: str
+    count: int
+    location: str | None
+
+
+@dataclass
+class RequestMetrics:
+    """1リクエスト分の SQL・テンプレート描画の計測値。"""
+
+    query_count: int = 0
+    sql_time: float = 0.0
+    template_time: float = 0.0
+    # (実行時間, SQL) のリスト
+    queries: list[tuple[float, str]] = field(default_factory=list)
+    # 同じ形の SQL がこの回数に達したら N+1 の疑いとして扱う
+    repeat_threshold: int = 5
+    shape_counts: Counter = field(default_factory=Counter)
+    # 形ごとの、しきい値に達した時点の発行元
+    shape_locations: dict[str, str | None] = field(default_factory=dict)
+
+    def record(self, sql: str, duration: float) -> None:
+        self.query_count += 1
+        self.sql_time += duration
+        self.queries.append((duration, sql))
+
+        if _SAVEPOINT_RE.match(sql):
+            return
+        shape = normalize_sql(sql)
+        self.shape_counts[shape] += 1
+        # スタックの取得は重いため、しきい値に達した1回だけ行う
+        if self.shape_counts[shape] == self.repeat_threshold:
+            self.shape_locations[shape] = _find_caller()
+
+    def slowest_queries(self, limit: int) -> list[tuple[float, str]]:
+        """実行時間の長い順に SQL を返す。"""
+        return sorted(self.queries, key=lambda q: q[0], reverse=True)[:limit]
+
+    def repeated_queries(self) -> list[RepeatedQuery]:
+        """しきい値以上繰り返された SQL を、回数の多い順に返す。"""
+        return [
+            RepeatedQuery(shape, self.shape_counts[shape], location)
+            for shape, location in sorted(
+                self.shape_locations.items(),
+                key=lambda item: self.shape_counts[item[0]],
+                reverse=True,
+            )
+        ]
+
+
+# 計測中のリクエストの計測値（スレッド・非同期タスクごとに分離される）
+_current_metrics: contextvars.ContextVar[RequestMetrics | None] = (
+    contextvars.ContextVar("request_metrics", default=None)
+)
+
+
+def get_current_metrics() -> RequestMetrics | None:
+    """計測中のリクエストの計測値を返す。計測対象外なら None。"""
+    return _current_metrics.get()
+
+
+def _record_query(execute, sql, params, many, context):
+    """DB の execute_wrapper として SQL の件数と実行時間を記録する。"""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record(sql, time.perf_counter() - started)
+
+
+def _install_template_timing() -> None:
+    """
+    DjangoTemplate.render を、描画時間を記録する版に差し替える（モジュールの読み込み時に一度だけ）。
+
+    計測対象は _current_metrics から読むため、計測中でないリクエストでは元の render を呼ぶだけになる。
+    """
+    original_render = DjangoTemplate.render
+    if getattr(original_render, "records_metrics", False):
+        return
+
+    def timed_render(self, context=None, request=None):
+        # include されたテンプレートは呼び出し元の描画時間に含まれる
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return original_render(self, context, request)
+
+        started = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+    timed_render.records_metrics = True
+    DjangoTemplate.render = timed_render
+
+
+_install_template_timing()
+
+
+def _install_query_recording(connection) -> None:
+    """
+    接続に _record_query を常設する（接続ごとに一度だけ）。
+
+    接続はスレッドごとに別のため、計測を始めたスレッドの接続だけに execute_wrapper を
+    付けると、sync_to_async のスレッドで発行された SQL（非同期ビューの ORM）を取りこぼす。
+    計測対象は _current_metrics から読み、sync_to_async はコンテキストをスレッドに引き継ぐ。
+    """
+    if _record_query not in connection.execute_wrappers:
+        # execute_wrapper() は末尾を pop するため、使用中のラッパーより外側（先頭）に入れる
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+def _on_connection_created(sender, connection, **kwargs) -> None:
+    _install_query_recording(connection)
+
+
+connection_created.connect(_on_connection_created)
+
+
+@contextmanager
+def collect_metrics() -> Iterator[RequestMetrics]:
+    """
+    ブロック内で発行された SQL とテンプレート描画時間を計測する。
+
+    ミドルウェアのほか、テストで N+1 を検出する用途でも使う。
+    """
+    # このモジュールの読み込み前に作られた接続にも付ける
+    for connection in connections.all():
+        _install_query_recording(connection)
+
+    metrics = RequestMetrics(repeat_threshold=settings.REPEATED_QUERY_THRESHOLD)
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+class RequestTimingMiddleware:
+    """
+    リクエストごとのクエリ数・SQL時間・テンプレート描画時間を計測するミドルウェア。
+
+    - REQUEST_TIMING_ENABLED が False の場合は読み込まれない
+    - REQUEST_TIMING_SAMPLE_RATE の割合のリクエストのみ計測する
+    - 計測結果は Server-Timing ヘッダーと JSON 形式のログに出力する
+    - 同じ形の SQL が REPEATED_QUERY_THRESHOLD 回以上発行された場合は、
+      発行元のコード位置とあわせて警告ログを出力する
+    - ASGI の非同期ビューでも、sync_to_async のスレッドで発行された SQL を含めて計測する
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING_ENABLED:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_TIMING_SAMPLE_RATE
+        self.slow_query_limit = settings.REQUEST_TIMING_SLOW_QUERY_LIMIT
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with collect_metrics() as metrics:
+            response = self.get_response(request)
+        self._report(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        with collect_metrics() as metrics:
+            response = await self.get_response(request)
+        self._report(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def _report(
+        self,
+        request: HttpRequest,
+        response: HttpResponse,
+        metrics: RequestMetrics,
+        total_time: float,
+    ) -> None:
+        sql_ms = metrics.sql_time * 1000
+        response["Server-Timing"] = ", ".join(
+            [
+                f'sql;dur={sql_ms:.1f};desc="{metrics.query_count} queries"',
+                f"tpl;dur={metrics.template_time * 1000:.1f}",
+                f"total;dur={total_time * 1000:.1f}",
+            ]
+        )
+
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        logger.info(
+            json.dumps(
+                {
+                    "event": "request_timing",
+                    "method": request.method,
+                    "path": request.path,
+                    "view": view_name,
+                    "status": response.status_code,
+                    "total_ms": round(total_time * 1000, 1),
+                    "query_count": metrics.query_count,
+                    "sql_ms": round(sql_ms, 1),
+                    "template_ms": round(metrics.template_time * 1000, 1),
+                    "slowest_queries": [
+                        {"ms": round(duration * 1000, 1), "sql": sql[:500]}
+                        for duration, sql in metrics.slowest_queries(
+                            self.slow_query_limit
+                        )
+                    ],
+                },
+                ensure_ascii=False,
+            )
+        )
+
+        for repeated in metrics.repeated_queries():
+            logger.warning(
+                json.dumps(
+                    {
+                        "event": "repeated_query",
+                        "path": request.path,
+                        "view": view_name,
+                        "count": repeated.count,
+                        "location": repeated.location,
+                        "sql": repeated.shape[:500],
+                    },
+                    ensure_ascii=False,
+                )
+            )
+
+
+class MetricsMiddleware:
+    """
+    ビューごとのリクエスト数とレスポンス時間を Prometheus メトリクスに記録する。
+
+    ASGI で非同期ビューを動かす場合にスレッド切り替えが挟まらないよう、
+    同期・非同期の両方に対応する。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started)
+        return response
+
+    def _record(
+        self, request: HttpRequest, response: HttpResponse, duration: float
+    ) -> None:
+        # URL そのものではなくビュー名をラベルにして、系列数が増えすぎないようにする
+        view_name = (
+            request.resolver_match.view_name if request.resolver_match else "unknown"
+        )
+        REQUESTS.labels(view_name, request.method, response.status_code).inc()
+        REQUEST_DURATION.labels(view_name).observe(duration)
+
+
+def _accepted_encodings(header: str) -> set[str]:
+    """Accept-Encoding ヘッダーから受け入れ可能（q > 0）なエンコーディングを返す。"""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class ResponseCompressionMiddleware:
+    """
+    JSON・HTML断片のレスポンスを Accept-Encoding に応じて圧縮するミドルウェア。
+
+    - RESPONSE_COMPRESSION_MIN_SIZE 以上のレスポンスのみ圧縮する
+    - Brotli を受け入れるクライアントには br、それ以外は gzip で返す
+    - CSRF トークン（フォーム）を含むレスポンスは、HTML でも JSON に埋め込んだ HTML 断片でも、
+      BREACH 対策のランダムなバイトを付与できる gzip で圧縮する（Brotli には付与する場所がない）
+    - 静的ファイルは WhiteNoise が事前圧縮済みのファイルを返すため対象外
+      （ストリーミングレスポンスは圧縮しない）
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._compress(request, self.get_response(request))
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        return self._compress(request, await self.get_response(request))
+
+    def _compress(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE
+        ):
+            return response
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in settings.RESPONSE_COMPRESSION_CONTENT_TYPES:
+            return response
+
+        # 圧縮するかどうかがクライアントによって変わるため、キャッシュに伝える
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        if (
+            brotli is not None
+            and "br" in accepted
+            and CSRF_FIELD_MARKER not in response.content
+        ):
+            encoding = "br"
+            # リクエストごとに圧縮するため、圧縮率より速度を優先した品質にする
+            compressed = brotli.compress(
+                response.content, mode=brotli.MODE_TEXT, quality=4
+            )
+        elif "gzip" in accepted:
+            # Django の gzip 圧縮は BREACH 対策のランダムなバイトを付与する
+            encoding = "gzip"
+            compressed = compress_string(response.content, max_random_bytes=100)
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        # 圧縮でバイト列が変わるため、強い ETag は弱い ETag にする
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
+
+
+class PrimaryStickinessMiddleware:
+    """
+    更新リクエストの後、一定時間そのセッションの読み取りを default に固定するミドルウェア。
+
+    レプリカの反映遅延で、カートや注文の更新直後に古い内容が表示されるのを防ぐ。
+    POST などが成功した（4xx / 5xx 以外の）レスポンスに READ_REPLICA_STICKY_COOKIE を付け、
+    read_from_replica はこの Cookie がある間はレプリカを使わない。
+    レプリカが未設定の場合は何もしない。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self._pin(request, self.get_response(request))
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        return self._pin(request, await self.get_response(request))
+
+    def _pin(self, request: HttpRequest, response: HttpResponse) -> HttpResponse:
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method not in ("GET", "HEAD", "OPTIONS", "TRACE")
+            and response.status_code < 400
+        ):
+            response.set_cookie(
+                settings.READ_REPLICA_STICKY_COOKIE,
+                "1",
+                max_age=settings.READ_REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
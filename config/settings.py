@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 import environ
 from django.contrib.messages import constants as messages
+from django.core.exceptions import ImproperlyConfigured
 
 from pathlib import Path
 
@@ -50,8 +51,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.middleware.MetricsMiddleware",
+    "config.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "config.middleware.ResponseCompressionMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "config.middleware.PrimaryStickinessMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -82,6 +87,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "config.wsgi.application"
 
+# ASGI（uvicorn ワーカー）で動かす場合に True にし、
+# 商品一覧・詳細・カート関連を非同期ビュー（products/async_views.py）に切り替える
+ASYNC_VIEWS_ENABLED = env.bool("ASYNC_VIEWS_ENABLED", default=False)
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -90,6 +99,24 @@ DATABASES = {
     "default": env.db(),
 }
 
+# 読み取り用レプリカ（カンマ区切りで複数指定可）。
+# 商品一覧・詳細と管理画面の一覧系の読み取りをレプリカに振り分ける（config/db_router.py）
+# テスト時はレプリカ用のDBを作らず、default のテスト用DBをそのまま使う
+DATABASE_REPLICAS = []
+for _index, _url in enumerate(env.list("DATABASE_REPLICA_URLS", default=[]), start=1):
+    DATABASES[f"replica{_index}"] = {
+        **env.db_url_config(_url),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{_index}")
+
+DATABASE_ROUTERS = ["config.db_router.ReplicaRouter"]
+
+# カート・注文などを更新した後、このセッションの読み取りを default に固定する秒数
+# （レプリカの反映遅延より長くする）
+READ_REPLICA_STICKY_SECONDS = env.int("READ_REPLICA_STICKY_SECONDS", default=10)
+READ_REPLICA_STICKY_COOKIE = "read_primary"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -130,7 +157,143 @@ STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
 STATIC_ROOT = BASE_DIR / "staticfiles"
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+STATICFILES_STORAGE = "config.storage.BundledManifestStaticFilesStorage"
+
+# collectstatic 時に結合して1ファイルにする静的ファイル（バンドル名: 結合元）
+# ハッシュ付きのファイル名で gzip / Brotli に事前圧縮され、長期キャッシュで配信される
+STATIC_BUNDLES = {
+    "bundle/site.css": ["css/custom.css"],
+    "bundle/site.js": ["js/cart_detail.js"],
+}
+
+
+# ==============================
+# 管理画面の Basic 認証
+# ==============================
+# 「ユーザー名:パスワード」をセミコロン区切りで指定する。パスワードは平文のほか、
+# make_password で作成したハッシュ（例: pbkdf2_sha256$...）も指定できる
+# （Argon2 のハッシュはカンマを含むため、カンマ区切りにはしない）。
+# パスワードが空のエントリは起動時にエラーにする。
+# 従来の BASIC_AUTH_USER / BASIC_AUTH_PASSWORD も1ユーザー分として読み込む
+BASIC_AUTH_USERS = {}
+for _entry in env.str("BASIC_AUTH_USERS", default="").split(";"):
+    if not _entry.strip():
+        continue
+    _username, _, _password = _entry.strip().partition(":")
+    if not _username or not _password:
+        raise ImproperlyConfigured(
+            "BASIC_AUTH_USERS は「ユーザー名:パスワード」をセミコロン区切りで指定してください"
+            "（パスワードは空にできません）。"
+        )
+    BASIC_AUTH_USERS[_username] = _password
+if env("BASIC_AUTH_USER", default="") and env("BASIC_AUTH_PASSWORD", default=""):
+    BASIC_AUTH_USERS.setdefault(env("BASIC_AUTH_USER"), env("BASIC_AUTH_PASSWORD"))
+# 検証に成功した Authorization ヘッダーを覚えておく秒数（0 で無効）
+BASIC_AUTH_CACHE_SECONDS = env.int("BASIC_AUTH_CACHE_SECONDS", default=60)
+
+
+# ==============================
+# カートの保存先
+# ==============================
+# "orm": Cart / CartItem テーブル、"kv": キーバリューストア（注文確定時のみ DB に書き込む）
+CART_STORE_BACKEND = env("CART_STORE_BACKEND", default="orm")
+# kv の場合の Redis の接続先（未設定の場合はプロセス内のメモリに保存する。開発・テスト用）
+CART_STORE_REDIS_URL = env("CART_STORE_REDIS_URL", default="")
+# kv の場合のカートの有効期限（秒）。最後に変更してからこの時間が経つと削除される
+CART_STORE_TTL = env.int("CART_STORE_TTL", default=60 * 60 * 24 * 14)
+
+
+# ==============================
+# 在庫数のキャッシュ
+# ==============================
+# カートバッジなどで在庫の有無を判定するときの在庫数のキャッシュ期間（秒）。
+# 注文確定・商品の保存時に書き込まれるが、他の経路での更新はこの時間まで反映されない
+# （キャッシュは CACHES の default を使う。複数プロセスで共有する場合は共有のキャッシュを設定する）
+STOCK_CACHE_TIMEOUT = env.int("STOCK_CACHE_TIMEOUT", default=30)
+
+
+# ==============================
+# チェックアウト中の在庫の確保
+# ==============================
+# 購入手続きの開始時に確保した在庫を保持する秒数。
+# 期限切れの確保は在庫の計算に含めず、release_expired_holds コマンドで削除する
+STOCK_HOLD_TTL = env.int("STOCK_HOLD_TTL", default=60 * 10)
+
+
+# ==============================
+# 注文確定時の行ロック
+# ==============================
+# 行ロックの待ち方（products.services.checkout_locks を参照）
+#   wait: 解放されるまで待つ / nowait: 待たずに失敗する / timeout: CHECKOUT_LOCK_TIMEOUT_MS まで待つ
+# 失敗した注文は 503 と Retry-After（CHECKOUT_RETRY_AFTER 秒）を返し、カートはそのまま残す
+CHECKOUT_LOCK_POLICY = env("CHECKOUT_LOCK_POLICY", default="wait")
+CHECKOUT_LOCK_TIMEOUT_MS = env.int("CHECKOUT_LOCK_TIMEOUT_MS", default=2000)
+CHECKOUT_RETRY_AFTER = env.int("CHECKOUT_RETRY_AFTER", default=1)
+# 注文確定を同時に処理する数の上限（全体・商品ごと。0 は制限なし）。
+# 上限を超えた注文は待合室のページ（503 と Retry-After）を返し、しばらくして自動で再送信する。
+# 枠は CHECKOUT_ADMISSION_CACHE のキャッシュで数え、CHECKOUT_ADMISSION_LEASE_SECONDS 秒で失効する
+# （既定の LocMemCache では上限はプロセスごと。共有する場合は共有のキャッシュを設定する）
+CHECKOUT_ADMISSION_LIMIT = env.int("CHECKOUT_ADMISSION_LIMIT", default=0)
+CHECKOUT_ADMISSION_PRODUCT_LIMIT = env.int(
+    "CHECKOUT_ADMISSION_PRODUCT_LIMIT", default=0
+)
+CHECKOUT_ADMISSION_LEASE_SECONDS = env.int(
+    "CHECKOUT_ADMISSION_LEASE_SECONDS", default=30
+)
+CHECKOUT_ADMISSION_CACHE = env("CHECKOUT_ADMISSION_CACHE", default="default")
+# 注文確定の冪等性キーを保持する秒数（その間の同じキーの再送信には最初の注文の結果を返す）。
+# 期限切れのキーは purge_idempotency_keys コマンドで削除する
+ORDER_IDEMPOTENCY_TTL = env.int("ORDER_IDEMPOTENCY_TTL", default=60 * 60 * 24)
+
+
+# ==============================
+# 商品管理画面（一覧）
+# ==============================
+# 1ページに表示する商品数と、「在庫わずか」で絞り込むときの在庫数の上限
+MANAGE_PRODUCTS_PER_PAGE = env.int("MANAGE_PRODUCTS_PER_PAGE", default=50)
+MANAGE_LOW_STOCK_THRESHOLD = env.int("MANAGE_LOW_STOCK_THRESHOLD", default=5)
+# 注文一覧の1ページに表示する注文数
+MANAGE_ORDERS_PER_PAGE = env.int("MANAGE_ORDERS_PER_PAGE", default=50)
+
+
+# ==============================
+# 商品の一括登録
+# ==============================
+# 管理画面の一括登録で表示する行ごとのエラーの最大件数（全件はコマンドの出力で確認する）
+PRODUCT_IMPORT_MAX_ERRORS = env.int("PRODUCT_IMPORT_MAX_ERRORS", default=100)
+
+
+# ==============================
+# 在庫数の一括反映（倉庫連携）
+# ==============================
+# 1回の UPDATE で反映する行数と、API の1リクエストで受け付ける最大件数
+# （それより多い場合は API を分けて呼ぶか、sync_stock コマンドを使う）
+STOCK_SYNC_BATCH_SIZE = env.int("STOCK_SYNC_BATCH_SIZE", default=5000)
+STOCK_SYNC_MAX_ITEMS = env.int("STOCK_SYNC_MAX_ITEMS", default=20000)
+
+
+# ==============================
+# 注文のステータスの一括変更
+# ==============================
+# API の1リクエストで受け付ける注文IDの最大件数（それより多い場合は transition_orders コマンドを使う）
+ORDER_STATUS_MAX_ITEMS = env.int("ORDER_STATUS_MAX_ITEMS", default=20000)
+
+
+# ==============================
+# 売上ダッシュボード
+# ==============================
+# 表示する日別集計の日数と、売上上位の商品数（集計テーブルは rollup_sales コマンドで更新する）
+SALES_DASHBOARD_DAYS = env.int("SALES_DASHBOARD_DAYS", default=30)
+SALES_DASHBOARD_TOP_PRODUCTS = env.int("SALES_DASHBOARD_TOP_PRODUCTS", default=20)
+
+
+# ==============================
+# レスポンス圧縮（JSON / HTML断片）
+# ==============================
+# このサイズ（バイト）以上のレスポンスを Accept-Encoding に応じて br / gzip で圧縮する
+RESPONSE_COMPRESSION_MIN_SIZE = env.int("RESPONSE_COMPRESSION_MIN_SIZE", default=1024)
+# 圧縮対象の Content-Type
+RESPONSE_COMPRESSION_CONTENT_TYPES = ("application/json", "text/html")
 
 
 # ==============================
@@ -188,3 +351,31 @@ if EMAIL_HOST and EMAIL_HOST_USER and EMAIL_HOST_PASSWORD:
     EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 else:
     EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+
+
+# ==============================
+# リクエスト計測（クエリ数・SQL時間・テンプレート描画時間）
+# 有効にすると Server-Timing ヘッダーと JSON 形式のログを出力する
+# ==============================
+REQUEST_TIMING_ENABLED = env.bool("REQUEST_TIMING_ENABLED", default=False)
+# 計測するリクエストの割合（0.0〜1.0）
+REQUEST_TIMING_SAMPLE_RATE = env.float("REQUEST_TIMING_SAMPLE_RATE", default=1.0)
+# ログに出力する遅いSQLの件数
+REQUEST_TIMING_SLOW_QUERY_LIMIT = env.int("REQUEST_TIMING_SLOW_QUERY_LIMIT", default=3)
+# 1リクエスト内で同じ形のSQLがこの回数以上発行されたら N+1 の疑いとして警告する
+REPEATED_QUERY_THRESHOLD = env.int("REPEATED_QUERY_THRESHOLD", default=5)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "config.middleware": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
+}
@@ -21,9 +21,13 @@ from django.views.generic.base import TemplateView
 from django.conf import settings
 from django.conf.urls.static import static
 
+from config import views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("hello/", TemplateView.as_view(template_name="hello.html")),
+    # Prometheus 形式のメトリクス（Basic認証）
+    path("metrics", views.metrics, name="metrics"),
     # トップページを商品一覧に（products/urls.py に委譲）
     path("", include("products.urls")),
 ]
@@ -0,0 +1,11 @@
+from django.http import HttpRequest, HttpResponse
+
+from config.decorators import basic_auth_required as auth
+from config.metrics import render_latest
+
+
+@auth
+def metrics(request: HttpRequest) -> HttpResponse:
+    """Prometheus 形式のメトリクスを返すビュー（Basic認証で保護）。"""
+    body, content_type = render_latest()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,26 @@
+"""
+gunicorn の設定ファイル（起動時に自動で読み込まれる）
+
+PROMETHEUS_MULTIPROC_DIR が設定されている場合、ワーカー間でメトリクスを集計する。
+- 起動時に前回のメトリクスファイルを削除する
+- 終了したワーカーのメトリクスを集計対象から外す
+"""
+
+import os
+from pathlib import Path
+
+
+def on_starting(server):
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        path = Path(multiproc_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        for db_file in path.glob("*.db"):
+            db_file.unlink()
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,9 +1,11 @@
 from typing import Any
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.http import HttpRequest
 
-from .models import Product, Order, OrderItem, PromotionCode
+from .models import Product, Order, OrderItem, OrderStatusChange, PromotionCode
+from .services.order_status import TRANSITIONS, transition_orders
+from .services.promotions import refresh_exhausted
 
 
 def get_app_list(
@@ -43,6 +45,7 @@ class ProductAdmin(admin.ModelAdmin):
         "is_active",
         "created_at",
         "updated_at",
+        "deleted_at",
     )
     search_fields = ("name", "sku")
 
@@ -52,6 +55,34 @@ class OrderItemInline(admin.TabularInline):
     extra = 0
 
 
+class OrderStatusChangeInline(admin.TabularInline):
+    model = OrderStatusChange
+    extra = 0
+    can_delete = False
+    readonly_fields = ("from_status", "to_status", "changed_at")
+
+    def has_add_permission(self, request, obj=None) -> bool:
+        return False
+
+
+def _status_action(target: Order.Status):
+    """選択した注文のステータスを target に変更するアクションを作る。"""
+
+    @admin.action(description=f"選択した注文を「{target.label}」にする")
+    def action(modeladmin, request, queryset):
+        result = transition_orders(queryset.values_list("pk", flat=True), target)
+        modeladmin.message_user(
+            request, f"{result.updated}件の注文を「{target.label}」にしました。"
+        )
+        for order_id, error in result.errors:
+            modeladmin.message_user(
+                request, f"注文ID {order_id}: {error}", level=messages.WARNING
+            )
+
+    action.__name__ = f"mark_{target.value}"
+    return action
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = (
@@ -68,7 +99,15 @@ class OrderAdmin(admin.ModelAdmin):
         "updated_at",
     )
     search_fields = ("name", "email", "phone", "postal_code", "address")
+    list_filter = ("status",)
+    # ステータスは遷移のルールと履歴を守るため、アクション（transition_orders）でだけ変更する
+    actions = [
+        _status_action(status)
+        for status in Order.Status
+        if any(status in targets for targets in TRANSITIONS.values())
+    ]
     readonly_fields = (
+        "status",
         "total_amount",
         "promotion_discount_amount",
         "card_number",
@@ -130,7 +169,7 @@ class OrderAdmin(admin.ModelAdmin):
             },
         ),
     )
-    inlines = [OrderItemInline]
+    inlines = [OrderItemInline, OrderStatusChangeInline]
 
 
 @admin.register(OrderItem)
@@ -153,9 +192,22 @@ class PromotionCodeAdmin(admin.ModelAdmin):
         "id",
         "code",
         "discount_amount",
+        "usage_limit",
+        "times_used",
         "is_used",
         "used_at",
         "created_at",
     )
     list_filter = ("is_used",)
     search_fields = ("code",)
+    # 利用回数・使用済みは注文確定時の条件付き UPDATE でだけ更新する
+    readonly_fields = ("times_used", "is_used", "used_at")
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+            return
+        # 利用回数は注文確定と同時に更新され得るため、編集した列だけを保存し、
+        # 使用済みは利用上限の変更に合わせて DB 上の値で判定し直す
+        obj.save(update_fields=form.changed_data)
+        refresh_exhausted(obj.pk)
@@ -0,0 +1,337 @@
+"""
+ASGI（uvicorn ワーカー）向けの非同期ビュー。
+
+ASYNC_VIEWS_ENABLED が True の場合に、商品一覧・商品詳細・カート関連の
+ビューが products/urls.py からこちらに切り替わる。
+
+- DB アクセスは非同期ORM（aget / afirst / aiterator / aaggregate など）で行う
+- カートはストア（products.services.cart）の非同期メソッドで読み書きする
+- Django 4.2 のセッションとフォームのバリデーションは同期APIのみのため、
+  その部分だけ sync_to_async でスレッドに逃がす
+- ナビゲーションのカートバッジはビュー内で集計し、context processor で
+  同期クエリが発行されないようにする
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    HttpResponseNotAllowed,
+    JsonResponse,
+)
+from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
+
+from config.decorators import read_from_replica
+from config.metrics import CART_MUTATIONS, PROMOTION_APPLY
+
+from .forms import PromotionCodeApplyForm
+from .models import CartItem, Product, PromotionCode
+from .services.cart import aget_badge_quantity, get_cart_store
+from .utils import get_quantity_range
+from .views import (
+    _apply_promotion_discount,
+    _build_cart_delta,
+    _build_cart_summary_context,
+    _calc_cart_totals,
+    _wants_cart_delta,
+)
+
+
+async def _aload_session(request: HttpRequest) -> None:
+    """セッションを先に読み込み、以降の参照で同期クエリが発生しないようにする。"""
+    await sync_to_async(request.session.keys)()
+
+
+async def _aget_cart_items(session_key: str | None) -> list[CartItem]:
+    """カート明細を商品と一緒に取得する。"""
+    return await get_cart_store().aget_lines(session_key)
+
+
+async def _aset_cart_badge(request: HttpRequest, total_quantity: int | None = None):
+    """カートバッジ用の合計数量をリクエストに保持する（context processor が参照する）。"""
+    if total_quantity is None:
+        total_quantity = await aget_badge_quantity(request.session.session_key)
+    request.cart_total_quantity = total_quantity
+
+
+async def _aresolve_promotion(
+    request: HttpRequest, cart_total: int
+) -> tuple[PromotionCode | None, int, int]:
+    """`views._resolve_promotion` の非同期版。"""
+    promo_id = request.session.get("promotion_code_id")
+    if not promo_id or cart_total <= 0:
+        request.session.pop("promotion_code_id", None)
+        return None, 0, cart_total
+
+    promotion = await PromotionCode.objects.filter(id=promo_id, is_used=False).afirst()
+    if not promotion:
+        request.session.pop("promotion_code_id", None)
+        return None, 0, cart_total
+
+    return _apply_promotion_discount(promotion, cart_total)
+
+
+async def _abuild_cart_summary_context(
+    request: HttpRequest,
+    items: list[CartItem],
+    promotion_form: PromotionCodeApplyForm | None = None,
+) -> dict:
+    """プロモーションを非同期に解決してから、カートのテンプレート用コンテキストを作る。"""
+    cart_total, total_quantity = _calc_cart_totals(items)
+    resolved_promotion = await _aresolve_promotion(request, cart_total)
+    await _aset_cart_badge(request, total_quantity)
+    return _build_cart_summary_context(
+        request,
+        items,
+        promotion_form=promotion_form,
+        resolved_promotion=resolved_promotion,
+    )
+
+
+async def _aget_cart_delta(request: HttpRequest, session_key: str | None) -> dict:
+    """`views._get_cart_delta` の非同期版。"""
+    totals = await get_cart_store().atotals(session_key)
+    resolved_promotion = await _aresolve_promotion(request, totals["cart_total"])
+    return _build_cart_delta(totals, resolved_promotion)
+
+
+@read_from_replica
+async def product_list(request: HttpRequest) -> HttpResponse:
+    """公開中の商品一覧ページを表示するビュー（非同期版）。"""
+    await _aload_session(request)
+    products = [
+        product
+        async for product in Product.objects.live()
+        .filter(is_active=True)
+        .order_by("-created_at")
+        .aiterator()
+    ]
+    await _aset_cart_badge(request)
+
+    return render(request, "products/product_list.html", {"products": products})
+
+
+@read_from_replica
+async def product_detail(request: HttpRequest, pk: int) -> HttpResponse:
+    """商品詳細ページを表示するビュー（非同期版）。"""
+    await _aload_session(request)
+    try:
+        product = await Product.objects.live().aget(pk=pk, is_active=True)
+    except Product.DoesNotExist:
+        raise Http404
+
+    # 自分自身（pk）が含まれないように除外し、新しい順に4件取得
+    related_products = [
+        p
+        async for p in Product.objects.live()
+        .filter(is_active=True)
+        .exclude(pk=pk)
+        .order_by("-created_at")[:4]
+    ]
+    await _aset_cart_badge(request)
+
+    context = {
+        "product": product,
+        "related_products": related_products,
+        "quantity_range": get_quantity_range(product),
+    }
+    return render(request, "products/product_detail.html", context)
+
+
+async def cart_detail(request: HttpRequest) -> HttpResponse:
+    """カートの中身を表示するビュー（非同期版）。"""
+    await _aload_session(request)
+    items = await _aget_cart_items(request.session.session_key)
+
+    context = await _abuild_cart_summary_context(request, items)
+    return render(request, "cart/cart_detail.html", context)
+
+
+async def cart_item_update(request: HttpRequest, item_id: int) -> HttpResponse:
+    """カート内商品の数量を更新するビュー（非同期版）。"""
+    # Django 4.2 の require_POST は非同期ビューに対応していないため、ここで判定する
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    await _aload_session(request)
+    session_key = request.session.session_key
+    if session_key is None:
+        return JsonResponse({"ok": False}, status=400)
+
+    store = get_cart_store()
+    item = await store.aget_line(session_key, item_id)
+    if item is None:
+        raise Http404
+
+    raw_quantity = request.POST.get("quantity", "")
+    try:
+        quantity = int(raw_quantity)
+    except (TypeError, ValueError):
+        return JsonResponse({"ok": False}, status=400)
+
+    # 0以下は無効なのでそのまま戻す
+    if quantity <= 0:
+        return JsonResponse({"ok": False}, status=400)
+
+    # 在庫が0の場合は更新不可
+    max_quantity = item.product.stock
+    if max_quantity <= 0:
+        return JsonResponse({"ok": False}, status=409)
+    if quantity > max_quantity:
+        quantity = max_quantity
+
+    await store.aset_quantity(session_key, item, quantity)
+    CART_MUTATIONS.labels("update").inc()
+
+    if _wants_cart_delta(request):
+        return JsonResponse(
+            {
+                "ok": True,
+                "item": {
+                    "id": item.id,
+                    "quantity": quantity,
+                    "line_total": item.product.price * quantity,
+                },
+                "cart": await _aget_cart_delta(request, session_key),
+            }
+        )
+
+    items = await _aget_cart_items(session_key)
+    context = await _abuild_cart_summary_context(request, items)
+    html = render_to_string("cart/_cart_summary.html", context, request=request)
+
+    return JsonResponse(
+        {
+            "ok": True,
+            "html": html,
+            "item_id": item_id,
+            "quantity": quantity,
+            "total_quantity": context["total_quantity"],
+        }
+    )
+
+
+async def cart_item_delete(request: HttpRequest, item_id: int) -> HttpResponse:
+    """カート内の商品を1件削除するビュー（非同期版）。"""
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    is_ajax = request.headers.get("x-requested-with") == "XMLHttpRequest"
+
+    await _aload_session(request)
+    session_key = request.session.session_key
+    if session_key is None:
+        if is_ajax:
+            return JsonResponse({"ok": False}, status=400)
+        return redirect("products:cart_detail")
+
+    if not await get_cart_store().aremove(session_key, item_id):
+        raise Http404
+    CART_MUTATIONS.labels("delete").inc()
+
+    if _wants_cart_delta(request):
+        return JsonResponse(
+            {
+                "ok": True,
+                "removed_item_id": item_id,
+                "cart": await _aget_cart_delta(request, session_key),
+            }
+        )
+
+    if is_ajax:
+        items = await _aget_cart_items(session_key)
+        context = await _abuild_cart_summary_context(request, items)
+
+        html = render_to_string("cart/_cart_summary.html", context, request=request)
+        return JsonResponse(
+            {
+                "ok": True,
+                "html": html,
+                "total_quantity": context["total_quantity"],
+            }
+        )
+
+    return redirect("products:cart_detail")
+
+
+async def cart_promotion_apply(request: HttpRequest) -> HttpResponse:
+    """プロモーションコードを適用するビュー（非同期版）。"""
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    await _aload_session(request)
+    if not request.session.session_key:
+        await sync_to_async(request.session.create)()
+
+    form = PromotionCodeApplyForm(request.POST)
+    # clean_promotion_code が DB を参照するため、バリデーションはスレッドで行う
+    is_valid = await sync_to_async(form.is_valid)()
+    if is_valid and form.promotion is not None:
+        request.session["promotion_code_id"] = form.promotion.id
+        PROMOTION_APPLY.labels("success").inc()
+    else:
+        PROMOTION_APPLY.labels("failure").inc()
+
+    session_key = request.session.session_key
+    if _wants_cart_delta(request):
+        errors = form.errors.get("promotion_code")
+        return JsonResponse(
+            {
+                "ok": is_valid,
+                "error": errors[0] if errors else None,
+                "cart": await _aget_cart_delta(request, session_key),
+            }
+        )
+
+    items = await _aget_cart_items(session_key)
+
+    context = await _abuild_cart_summary_context(request, items, promotion_form=form)
+
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        html = render_to_string("cart/_cart_summary.html", context, request=request)
+        return JsonResponse(
+            {
+                "ok": is_valid,
+                "html": html,
+                "total_quantity": context["total_quantity"],
+            }
+        )
+
+    return render(request, "cart/cart_detail.html", context)
+
+
+async def cart_promotion_remove(request: HttpRequest) -> HttpResponse:
+    """適用中のプロモーションコードを解除するビュー（非同期版）。"""
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    await _aload_session(request)
+    request.session.pop("promotion_code_id", None)
+
+    if not request.session.session_key:
+        await sync_to_async(request.session.create)()
+
+    session_key = request.session.session_key
+    if _wants_cart_delta(request):
+        return JsonResponse(
+            {"ok": True, "cart": await _aget_cart_delta(request, session_key)}
+        )
+
+    items = await _aget_cart_items(session_key)
+
+    form = PromotionCodeApplyForm()
+    context = await _abuild_cart_summary_context(request, items, promotion_form=form)
+
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        html = render_to_string("cart/_cart_summary.html", context, request=request)
+        return JsonResponse(
+            {
+                "ok": True,
+                "html": html,
+                "total_quantity": context["total_quantity"],
+            }
+        )
+
+    return render(request, "cart/cart_detail.html", context)
@@ -1,6 +1,9 @@
 import unicodedata
+from urllib.parse import urlencode
 
 from django import forms
+from django.conf import settings
+from django.db.models import Q, QuerySet
 from django.utils import timezone
 
 from .models import Product, Order, PromotionCode
@@ -30,6 +33,164 @@ class ProductForm(forms.ModelForm):
             "is_active": forms.CheckboxInput(attrs={"class": "form-check-input"}),
         }
 
+    def clean_sku(self) -> str:
+        sku = self.cleaned_data["sku"]
+        # 削除済みの商品も品番を持ち続けるため、一意性のエラーより先に元に戻す方法を案内する
+        archived = Product.objects.archived().filter(sku=sku)
+        if self.instance.pk:
+            archived = archived.exclude(pk=self.instance.pk)
+        if archived.exists():
+            raise forms.ValidationError(
+                "削除済みの商品の品番です。一括登録でこの品番を登録すると、"
+                "削除済みの商品を元に戻して更新します。"
+            )
+        return sku
+
+
+class ProductImportForm(ProductForm):
+    """
+    一括登録（CSV / JSONL）の行を検証するフォーム。
+
+    ProductForm と同じフィールド（必須・桁数・0以上などのルール）で検証する。
+    数万行を検証するため、行ごとにフォームを作らず、1つのインスタンスの
+    clean_row() で各行を検証する。品番の重複は upsert で更新として扱うため、
+    一意性チェック（1行ごとのクエリ）は行わない。
+    """
+
+    class Meta(ProductForm.Meta):
+        fields = ["sku", "name", "description", "price", "stock", "is_active"]
+
+    def clean_row(self, data: dict) -> tuple[dict, dict[str, list[str]]]:
+        """1行を検証し、(検証済みの値, フィールドごとのエラー) を返す。"""
+        cleaned_data = {}
+        errors = {}
+        for name, field in self.fields.items():
+            # ウィジェットを通さずに行の値をそのまま渡す（CheckboxInput は "0" を True にするが、
+            # BooleanField.clean は "0" / "false" を False として扱う）
+            try:
+                cleaned_data[name] = field.clean(data.get(name))
+            except forms.ValidationError as e:
+                errors[name] = e.messages
+        return cleaned_data, errors
+
+
+class ProductImportUploadForm(forms.Form):
+    """商品の一括登録ファイルのアップロードフォーム"""
+
+    file = forms.FileField(
+        label="ファイル（CSV / JSONL）",
+        widget=forms.ClearableFileInput(attrs={"class": "form-control"}),
+    )
+
+
+class ProductListFilterForm(forms.Form):
+    """
+    商品管理画面（一覧）の絞り込み・並び替えフォーム（GET パラメータ）。
+
+    一括操作で「絞り込み結果のすべて」を対象にするときも、同じ条件で商品を選ぶ。
+    """
+
+    STATUS_CHOICES = [
+        ("", "すべて"),
+        ("inactive", "非公開"),
+        ("out_of_stock", "在庫切れ"),
+        ("low_stock", "在庫わずか"),
+    ]
+    SORT_CHOICES = [
+        ("-created_at", "作成日（新しい順）"),
+        ("created_at", "作成日（古い順）"),
+        ("-updated_at", "更新日（新しい順）"),
+        ("sku", "品番"),
+        ("name", "商品名"),
+        ("price", "価格（安い順）"),
+        ("-price", "価格（高い順）"),
+        ("stock", "在庫（少ない順）"),
+        ("-stock", "在庫（多い順）"),
+    ]
+
+    q = forms.CharField(
+        label="品番・商品名",
+        required=False,
+        widget=forms.TextInput(attrs={"class": "form-control"}),
+    )
+    status = forms.ChoiceField(
+        label="状態",
+        choices=STATUS_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={"class": "form-select"}),
+    )
+    sort = forms.ChoiceField(
+        label="並び順",
+        choices=SORT_CHOICES,
+        required=False,
+        widget=forms.Select(attrs={"class": "form-select"}),
+    )
+
+    def filter(self, queryset: QuerySet[Product]) -> QuerySet[Product]:
+        """条件で絞り込み・並び替えたクエリセットを返す（不正な値の条件は無視する）。"""
+        data = self.cleaned_data if self.is_valid() else {}
+
+        if q := (data.get("q") or "").strip():
+            queryset = queryset.filter(Q(sku__istartswith=q) | Q(name__icontains=q))
+
+        status = data.get("status")
+        if status == "inactive":
+            queryset = queryset.filter(is_active=False)
+        elif status == "out_of_stock":
+            queryset = queryset.filter(stock=0)
+        elif status == "low_stock":
+            queryset = queryset.filter(
+                stock__gt=0, stock__lte=settings.MANAGE_LOW_STOCK_THRESHOLD
+            )
+
+        # ページをまたいで順序がぶれないよう、最後に主キーで並べる
+        return queryset.order_by(data.get("sort") or "-created_at", "-pk")
+
+    def querystring(self) -> str:
+        """現在の条件を GET パラメータの文字列にする（ページ番号を除く）。"""
+        data = self.cleaned_data if self.is_valid() else {}
+        return urlencode({name: value for name, value in data.items() if value})
+
+
+class ProductIdsField(forms.Field):
+    """チェックボックスで選んだ商品IDのリスト（存在の確認は行わない）"""
+
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value) -> list[int]:
+        try:
+            return sorted({int(v) for v in value or []})
+        except (TypeError, ValueError):
+            raise forms.ValidationError("商品の指定が正しくありません。")
+
+
+class ProductBulkActionForm(forms.Form):
+    """商品管理画面（一覧）の一括操作フォーム"""
+
+    ACTION_CHOICES = [
+        ("activate", "公開にする"),
+        ("deactivate", "非公開にする"),
+        ("set_stock", "在庫数を設定する"),
+        ("delete", "削除する"),
+    ]
+
+    action = forms.ChoiceField(choices=ACTION_CHOICES)
+    product_ids = ProductIdsField(required=False)
+    # 選んだ商品ではなく、絞り込み結果のすべて（全ページ）を対象にする
+    all_matching = forms.BooleanField(required=False)
+    stock = forms.IntegerField(min_value=0, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get("all_matching") and not cleaned_data.get("product_ids"):
+            raise forms.ValidationError("対象の商品を選択してください。")
+        if (
+            cleaned_data.get("action") == "set_stock"
+            and cleaned_data.get("stock") is None
+        ):
+            self.add_error("stock", "在庫数を入力してください。")
+        return cleaned_data
+
 
 class OrderCreateForm(forms.ModelForm):
     """
@@ -0,0 +1,101 @@
+"""負荷計測コマンド（checkout_benchmark / server_benchmark）の共通処理。"""
+
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from products.models import Product
+
+BENCH_SKU_PREFIX = "BENCH-"
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """リダイレクトを追わず、各エンドポイント単体のレイテンシを計測する。"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpClient:
+    """仮想ユーザー1人分の HTTP クライアント（Cookie でセッションを維持する）。"""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), NoRedirectHandler()
+        )
+
+    def _csrf_token(self) -> str:
+        for cookie in self.cookies:
+            if cookie.name == "csrftoken":
+                return cookie.value
+        return ""
+
+    def request(
+        self,
+        path: str,
+        data: dict | None = None,
+        ajax: bool = False,
+    ) -> tuple[int, str]:
+        status, _headers, body = self._open(path, data, ajax)
+        return status, body
+
+    def post_redirect(self, path: str, data: dict) -> tuple[int, str]:
+        """POST してステータスとリダイレクト先のパス（Location）を返す。"""
+        status, headers, _body = self._open(path, data)
+        location = headers.get("Location", "")
+        return status, urllib.parse.urlsplit(location).path
+
+    def _open(self, path: str, data: dict | None = None, ajax: bool = False):
+        headers = {}
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            headers["X-CSRFToken"] = self._csrf_token()
+        if ajax:
+            headers["X-Requested-With"] = "XMLHttpRequest"
+
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as res:
+                return res.status, res.headers, res.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as e:
+            # リダイレクト（3xx）を追わないため、3xx もここでレスポンスとして返る
+            return e.code, e.headers, e.read().decode("utf-8", "replace")
+
+
+def seed_products(count: int, stock: int) -> list[int]:
+    """ベンチマーク用の商品を一括投入し、ID の一覧を返す。"""
+    Product.objects.bulk_create(
+        (
+            Product(
+                sku=f"{BENCH_SKU_PREFIX}{i:06d}",
+                name=f"ベンチマーク商品{i}",
+                price=1000 + i % 50 * 100,
+                stock=stock,
+            )
+            for i in range(count)
+        ),
+        batch_size=1000,
+    )
+    return list(
+        Product.objects.filter(sku__startswith=BENCH_SKU_PREFIX)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+def cleanup_products() -> None:
+    """ベンチマーク用の商品を削除する。"""
+    Product.objects.filter(sku__startswith=BENCH_SKU_PREFIX).delete()
+
+
+def percentile(sorted_values: list[float], percent: int) -> float:
+    """ソート済みの値から nearest-rank 法でパーセンタイル値を返す。"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[rank - 1]
@@ -0,0 +1,325 @@
+"""購入フロー（一覧 → カート追加 → 数量変更 → クーポン適用 → 注文確定）の負荷計測コマンド。
+
+ベンチマーク用の商品・プロモーションコードを投入し、仮想ユーザーを並列に走らせて
+エンドポイントごとのレイテンシ（p50/p95/p99）とスループットを出力する。
+
+使い方:
+    python manage.py checkout_benchmark                       # ローカルにサーバーを起動して計測
+    python manage.py checkout_benchmark --users 200 --concurrency 20
+    python manage.py checkout_benchmark --products 5000 --cart-lines 5
+    python manage.py checkout_benchmark --url http://localhost:8000  # 起動済みサーバーを計測
+    python manage.py checkout_benchmark --seed-only --keep-data       # データ投入のみ
+
+※ 設定中のデータベース（SQLite / PostgreSQL）にデータを投入するため、本番DBでは実行しないこと。
+※ SQLite は書き込みが直列化されるため、同時実行数を上げるとロック待ちのエラーが計上される。
+※ ローカルサーバーは DEBUG=False の設定で動くため、事前に collectstatic を実行しておくこと。
+"""
+
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from products.models import Order, PromotionCode
+
+from ._benchmark import HttpClient, cleanup_products, percentile, seed_products
+
+# promotion_code_generate は "0" を使わない（O と見分けづらいため）ので、生成されるコードと重ならない
+BENCH_PROMOTION_PREFIX = "0"
+BENCH_PROMOTION_PATTERN = rf"^{BENCH_PROMOTION_PREFIX}[0-9]{{6}}$"
+BENCH_EMAIL_DOMAIN = "bench.velo-station.local"
+
+FUNNEL_STEPS = [
+    "product_list",
+    "add_to_cart",
+    "cart_detail",
+    "cart_item_update",
+    "cart_promotion_apply",
+    "order_create",
+]
+
+ORDER_FORM_DATA = {
+    "name": "負荷 太郎",
+    "phone": "09012345678",
+    "postal_code": "1000001",
+    "prefecture": "東京都",
+    "city": "千代田区",
+    "street": "1-1-1",
+    "card_number": "4111111111111111",
+    "card_expire": "12/99",
+    "card_cvv": "123",
+    "card_holder": "FUKA TARO",
+}
+
+ITEM_ID_PATTERN = re.compile(r'data-item-id="(\d+)"')
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """リクエストごとのアクセスログを出さないハンドラ。"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = "購入フローを並列に実行し、エンドポイントごとのレイテンシとスループットを計測します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=50,
+            help="購入フローを実行する仮想ユーザー数（デフォルト: 50）",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=10,
+            help="同時実行する仮想ユーザー数（デフォルト: 10）",
+        )
+        parser.add_argument(
+            "--products",
+            type=int,
+            default=100,
+            help="投入するベンチマーク用商品の数（デフォルト: 100）",
+        )
+        parser.add_argument(
+            "--cart-lines",
+            type=int,
+            default=3,
+            help="1ユーザーがカートに追加する商品の種類数（デフォルト: 3）",
+        )
+        parser.add_argument(
+            "--url",
+            default=None,
+            help="起動済みサーバーのURL。省略時はローカルにサーバーを起動する",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=30.0,
+            help="1リクエストあたりのタイムアウト秒数（デフォルト: 30）",
+        )
+        parser.add_argument(
+            "--seed-only",
+            action="store_true",
+            help="データ投入のみ行い、計測は行わない",
+        )
+        parser.add_argument(
+            "--keep-data",
+            action="store_true",
+            help="計測後にベンチマーク用データを削除しない",
+        )
+
+    def handle(self, *args, **options):
+        users: int = options["users"]
+        concurrency: int = options["concurrency"]
+        product_count: int = options["products"]
+        cart_lines: int = options["cart_lines"]
+
+        if min(users, concurrency, product_count, cart_lines) <= 0:
+            raise CommandError(
+                "--users / --concurrency / --products / --cart-lines は1以上で指定してください。"
+            )
+        if cart_lines > product_count:
+            raise CommandError("--cart-lines は --products 以下で指定してください。")
+
+        self._cleanup()
+        product_ids, promotion_codes = self._seed(product_count, users)
+        self.stdout.write(
+            f"商品 {product_count}件 / プロモーションコード {users}件を投入しました。"
+        )
+
+        if options["seed_only"]:
+            return
+
+        try:
+            if options["url"]:
+                results, elapsed = self._run(
+                    options["url"],
+                    users,
+                    concurrency,
+                    product_ids,
+                    promotion_codes,
+                    cart_lines,
+                    options["timeout"],
+                )
+            else:
+                results, elapsed = self._run_with_local_server(
+                    users,
+                    concurrency,
+                    product_ids,
+                    promotion_codes,
+                    cart_lines,
+                    options["timeout"],
+                )
+            self._report(results, elapsed, users, concurrency)
+        finally:
+            if not options["keep_data"]:
+                self._cleanup()
+
+    def _seed(self, product_count: int, users: int) -> tuple[list[int], list[str]]:
+        """ベンチマーク用の商品とプロモーションコードを一括投入する。"""
+        # 全ユーザーが購入しても在庫切れにならない数を用意する
+        product_ids = seed_products(product_count, stock=users * 10)
+
+        # 1ユーザー1コード（使い切り）で用意する
+        promotion_codes = [f"{BENCH_PROMOTION_PREFIX}{i:06d}" for i in range(users)]
+        PromotionCode.objects.bulk_create(
+            (PromotionCode(code=code, discount_amount=100) for code in promotion_codes),
+            batch_size=1000,
+        )
+        return product_ids, promotion_codes
+
+    def _cleanup(self) -> None:
+        """前回・今回の実行で投入したベンチマーク用データを削除する。"""
+        Order.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}").delete()
+        # 実際の顧客のコードを消さないよう、ベンチマーク用の形式に完全一致するものだけを削除する
+        PromotionCode.objects.filter(code__regex=BENCH_PROMOTION_PATTERN).delete()
+        cleanup_products()
+
+    def _run_with_local_server(self, *args) -> tuple[dict, float]:
+        """ローカルに WSGI サーバーを起動し、そのサーバーに対して計測する。"""
+        with override_settings(ALLOWED_HOSTS=["127.0.0.1"]):
+            server = ThreadedWSGIServer(
+                ("127.0.0.1", 0), _QuietRequestHandler, allow_reuse_address=False
+            )
+            server.set_app(get_wsgi_application())
+            server.daemon_threads = True
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                host, port = server.server_address
+                return self._run(f"http://{host}:{port}", *args)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    def _run(
+        self,
+        base_url: str,
+        users: int,
+        concurrency: int,
+        product_ids: list[int],
+        promotion_codes: list[str],
+        cart_lines: int,
+        timeout: float,
+    ) -> tuple[dict, float]:
+        """仮想ユーザーを並列に実行し、ステップごとの計測結果を返す。"""
+        results: dict[str, list[tuple[float, bool]]] = defaultdict(list)
+        lock = threading.Lock()
+        cart_url = reverse("products:cart_detail")
+        order_complete_url = reverse("products:order_complete")
+
+        def record(step: str, started: float, ok: bool) -> None:
+            latency = time.perf_counter() - started
+            with lock:
+                results[step].append((latency, ok))
+
+        def run_user(index: int) -> None:
+            client = HttpClient(base_url, timeout)
+
+            started = time.perf_counter()
+            status, _ = client.request("/")
+            record("product_list", started, status == 200)
+
+            for line in range(cart_lines):
+                product_id = product_ids[(index * cart_lines + line) % len(product_ids)]
+                started = time.perf_counter()
+                status, location = client.post_redirect(
+                    f"/cart/add/{product_id}/", data={"quantity": 1}
+                )
+                # 在庫切れなどで追加できなかった場合は、元のページにリダイレクトされる
+                record("add_to_cart", started, (status, location) == (302, cart_url))
+
+            started = time.perf_counter()
+            status, body = client.request("/cart/")
+            record("cart_detail", started, status == 200)
+            item_ids = ITEM_ID_PATTERN.findall(body)
+
+            for item_id in item_ids:
+                started = time.perf_counter()
+                status, _ = client.request(
+                    f"/cart/update/{item_id}/", data={"quantity": 2}, ajax=True
+                )
+                record("cart_item_update", started, status == 200)
+
+            started = time.perf_counter()
+            status, body = client.request(
+                "/cart/promotion/apply/",
+                data={"promotion_code": promotion_codes[index]},
+                ajax=True,
+            )
+            record("cart_promotion_apply", started, status == 200)
+
+            started = time.perf_counter()
+            status, location = client.post_redirect(
+                "/order/create/",
+                data={
+                    **ORDER_FORM_DATA,
+                    "email": f"user{index}@{BENCH_EMAIL_DOMAIN}",
+                },
+            )
+            # 割引コードの使用済みなどで確定できなかった場合は、カートにリダイレクトされる
+            record(
+                "order_create",
+                started,
+                (status, location) == (302, order_complete_url),
+            )
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(run_user, i) for i in range(users)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        return results, elapsed
+
+    def _report(
+        self, results: dict, elapsed: float, users: int, concurrency: int
+    ) -> None:
+        """エンドポイントごとのレイテンシ・スループットを表形式で出力する。"""
+        self.stdout.write("")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"計測結果（ユーザー {users}人 / 同時実行 {concurrency} / {elapsed:.2f}秒）："
+            )
+        )
+        self.stdout.write(
+            "| endpoint | requests | errors | p50 (ms) | p95 (ms) | p99 (ms) | req/s |"
+        )
+        self.stdout.write("| --- | ---: | ---: | ---: | ---: | ---: | ---: |")
+        for step in FUNNEL_STEPS:
+            samples = results.get(step, [])
+            if not samples:
+                continue
+            latencies = sorted(latency for latency, _ok in samples)
+            errors = sum(1 for _latency, ok in samples if not ok)
+            self.stdout.write(
+                f"| {step} | {len(samples)} | {errors} "
+                f"| {percentile(latencies, 50) * 1000:.1f} "
+                f"| {percentile(latencies, 95) * 1000:.1f} "
+                f"| {percentile(latencies, 99) * 1000:.1f} "
+                f"| {len(samples) / elapsed:.1f} |"
+            )
+
+        completed = sum(1 for _latency, ok in results.get("order_create", []) if ok)
+        self.stdout.write("")
+        self.stdout.write(
+            f"注文確定 {completed}/{users}件（{completed / elapsed:.1f} checkouts/s）"
+        )
+        # レスポンスだけでなく、DB に作成された注文の数とも突き合わせる
+        created = Order.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}").count()
+        if created != completed:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"作成された注文は {created}件で、完了ページへのリダイレクト数と一致しません。"
+                )
+            )
@@ -0,0 +1,55 @@
+"""CSV / JSONL ファイルから商品を一括登録・更新する管理コマンド。
+
+品番（sku）が既存の商品は更新し、ない商品は作成する。
+必須の列: sku, name, price, stock / 任意の列: description, is_active
+
+使い方:
+    python manage.py import_products products.csv
+    python manage.py import_products feed.jsonl --chunk-size 5000
+    python manage.py import_products feed.txt --format jsonl
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.services.catalog_import import FORMATS, detect_format, import_products
+
+
+class Command(BaseCommand):
+    help = "CSV / JSONL ファイルから商品を品番をキーに一括登録・更新します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="読み込むファイルのパス")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="ファイルの形式（省略時は拡張子から判定）",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="1回の upsert で反映する行数（デフォルト: 1000）",
+        )
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] <= 0:
+            raise CommandError("--chunk-size は1以上で指定してください。")
+
+        try:
+            fmt = options["format"] or detect_format(options["path"])
+            with open(options["path"], "rb") as f:
+                result = import_products(f, fmt, options["chunk_size"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e)) from e
+
+        for line_no, error in result.errors:
+            self.stderr.write(f"{line_no}行目: {error}")
+
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(
+            style(
+                f"{result.total_rows}行中 {result.applied}行を反映しました"
+                f"（うち削除済みから元に戻した商品 {result.revived}件、エラー {len(result.errors)}行、{result.elapsed:.2f}秒、"
+                f"{result.rows_per_second:.0f}行/秒）。"
+            )
+        )
@@ -3,6 +3,7 @@
 使い方:
     python manage.py promotion_code_generate          # 10件生成（デフォルト）
     python manage.py promotion_code_generate --count 20  # 20件生成
+    python manage.py promotion_code_generate --count 1 --usage-limit 5000  # キャンペーン用（5000回まで使える）
 """
 
 import random
@@ -24,6 +25,12 @@ class Command(BaseCommand):
             default=10,
             help="生成するプロモーションコードの数（デフォルト: 10）",
         )
+        parser.add_argument(
+            "--usage-limit",
+            type=int,
+            default=1,
+            help="1つのコードを使える注文の数（デフォルト: 1 = 1回限り）",
+        )
 
     def handle(self, *args, **options):
         count: int = options["count"]
@@ -31,6 +38,12 @@ class Command(BaseCommand):
         if count <= 0:
             self.stderr.write(self.style.ERROR("--count は1以上で指定してください。"))
             return
+        usage_limit: int = options["usage_limit"]
+        if usage_limit <= 0:
+            self.stderr.write(
+                self.style.ERROR("--usage-limit は1以上で指定してください。")
+            )
+            return
 
         created: list[PromotionCode] = []
 
@@ -56,6 +69,7 @@ class Command(BaseCommand):
                     promotion = PromotionCode.objects.create(
                         code=code,
                         discount_amount=discount_amount,
+                        usage_limit=usage_limit,
                         is_used=False,
                         used_at=None,
                     )
@@ -0,0 +1,37 @@
+"""削除（アーカイブ）済みの商品に残ったカートの明細・在庫の確保を削除する管理コマンド。
+
+削除済みの商品はカートの表示・チェックアウトから除外されるため、このコマンドは
+表の掃除。cron などで定期的に実行する（商品の行と注文履歴の参照は残す）。
+
+使い方:
+    python manage.py purge_archived_products
+    python manage.py purge_archived_products --batch-size 5000
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.services.product_archive import purge_archived_cart_rows
+
+
+class Command(BaseCommand):
+    help = "削除済みの商品に残ったカートの明細・在庫の確保を削除します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回のトランザクションで削除する件数（デフォルト: 1000）",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size は1以上で指定してください。")
+
+        cart_items, holds = purge_archived_cart_rows(options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"削除済みの商品のカートの明細を {cart_items} 件、"
+                f"在庫の確保を {holds} 件削除しました。"
+            )
+        )
@@ -0,0 +1,34 @@
+"""有効期限を過ぎた在庫の確保（StockHold）を削除する管理コマンド。
+
+失効した確保は在庫の計算に含まれないため、このコマンドは表の肥大化を防ぐための掃除。
+cron などで定期的に実行する。
+
+使い方:
+    python manage.py release_expired_holds
+    python manage.py release_expired_holds --batch-size 5000
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.services.holds import sweep_expired_holds
+
+
+class Command(BaseCommand):
+    help = "有効期限を過ぎた在庫の確保を削除します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回のトランザクションで削除する件数（デフォルト: 1000）",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size は1以上で指定してください。")
+
+        deleted = sweep_expired_holds(options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"期限切れの在庫の確保を {deleted} 件削除しました。")
+        )
@@ -0,0 +1,40 @@
+"""未集計の注文を売上の集計テーブル（日別・商品別）に加算する管理コマンド。
+
+前回処理した注文IDより後の注文だけを処理するため、何度実行しても二重に集計されない。
+cron などで定期的に実行する（管理画面の売上ダッシュボードは集計テーブルだけを読む）。
+
+使い方:
+    python manage.py rollup_sales
+    python manage.py rollup_sales --batch-size 5000 --settle-seconds 120
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.services.rollups import rollup_new_orders
+
+
+class Command(BaseCommand):
+    help = "未集計の注文を売上の集計テーブルに加算します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回のトランザクションで集計する注文数（デフォルト: 1000）",
+        )
+        parser.add_argument(
+            "--settle-seconds",
+            type=int,
+            default=60,
+            help="作成からこの秒数が経過した注文だけを集計する（デフォルト: 60）",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size は1以上で指定してください。")
+        if options["settle_seconds"] < 0:
+            raise CommandError("--settle-seconds は0以上で指定してください。")
+
+        processed = rollup_new_orders(options["batch_size"], options["settle_seconds"])
+        self.stdout.write(self.style.SUCCESS(f"{processed} 件の注文を集計しました。"))
@@ -0,0 +1,227 @@
+"""WSGI（gunicorn 同期ワーカー）と ASGI（gunicorn + uvicorn ワーカー）の同時実行性能を比較するコマンド。
+
+同じワーカー数（= ほぼ同じメモリ量）で両方のサーバーを順に起動し、
+商品一覧・商品詳細・カートを並列にリクエストして、スループット・レイテンシ・
+メモリ使用量（RSS）を出力する。ASGI 側は ASYNC_VIEWS_ENABLED=True で起動する。
+
+使い方:
+    python manage.py server_benchmark
+    python manage.py server_benchmark --workers 2 --concurrency 100 --requests 5000
+
+※ サーバーは別プロセスで起動するため、SQLite の場合はファイルのDBを使うこと。
+※ メモリ使用量は /proc から取得するため Linux でのみ出力される。
+※ 事前に collectstatic を実行しておくこと。
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ._benchmark import HttpClient, cleanup_products, percentile, seed_products
+
+SERVER_PROFILES = {
+    "wsgi": {
+        "args": ["config.wsgi"],
+        "env": {"ASYNC_VIEWS_ENABLED": "False"},
+    },
+    "asgi": {
+        "args": ["config.asgi:application", "-k", "uvicorn.workers.UvicornWorker"],
+        "env": {"ASYNC_VIEWS_ENABLED": "True"},
+    },
+}
+
+
+def _rss_bytes(pid: int) -> int | None:
+    """プロセスとその子プロセスの RSS 合計（バイト）を返す。取得できなければ None。"""
+    proc = Path("/proc")
+    if not proc.exists():
+        return None
+
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            for line in (proc / str(current) / "status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+            children = (
+                proc / str(current) / "task" / str(current) / "children"
+            ).read_text()
+        except OSError:
+            continue
+        pids.extend(int(child) for child in children.split())
+    return total
+
+
+class Command(BaseCommand):
+    help = (
+        "同じワーカー数で WSGI と ASGI のサーバーを起動し、同時実行性能を比較します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=2,
+            help="gunicorn のワーカー数（両サーバー共通、デフォルト: 2）",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="同時接続数（デフォルト: 50）",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="サーバーごとの総リクエスト数（デフォルト: 2000）",
+        )
+        parser.add_argument(
+            "--products",
+            type=int,
+            default=100,
+            help="投入するベンチマーク用商品の数（デフォルト: 100）",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=8765,
+            help="サーバーを起動するポート（デフォルト: 8765）",
+        )
+        parser.add_argument(
+            "--profiles",
+            nargs="+",
+            choices=list(SERVER_PROFILES),
+            default=list(SERVER_PROFILES),
+            help="計測するサーバー構成（デフォルト: wsgi asgi）",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["workers"], options["concurrency"], options["requests"]) <= 0:
+            raise CommandError(
+                "--workers / --concurrency / --requests は1以上で指定してください。"
+            )
+
+        cleanup_products()
+        product_ids = seed_products(options["products"], stock=100)
+
+        try:
+            rows = [
+                self._benchmark(profile, product_ids, options)
+                for profile in options["profiles"]
+            ]
+        finally:
+            cleanup_products()
+
+        self.stdout.write("")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"計測結果（ワーカー {options['workers']} / 同時接続 "
+                f"{options['concurrency']} / {options['requests']}リクエスト）："
+            )
+        )
+        self.stdout.write(
+            "| server | req/s | errors | p50 (ms) | p95 (ms) | p99 (ms) | RSS (MB) |"
+        )
+        self.stdout.write("| --- | ---: | ---: | ---: | ---: | ---: | ---: |")
+        for row in rows:
+            self.stdout.write(row)
+
+    def _benchmark(self, profile: str, product_ids: list[int], options) -> str:
+        """1つのサーバー構成を起動して計測し、結果の表の1行を返す。"""
+        base_url = f"http://127.0.0.1:{options['port']}"
+        server = self._start_server(profile, options["workers"], options["port"])
+        try:
+            self._wait_until_ready(base_url, server)
+
+            paths = ["/", "/cart/"] + [f"/products/{pk}/" for pk in product_ids[:20]]
+            latencies: list[float] = []
+            errors = 0
+            lock = threading.Lock()
+            local = threading.local()
+
+            def run(index: int) -> None:
+                nonlocal errors
+                # 接続ごとに Cookie を分けるため、スレッドごとにクライアントを持つ
+                if not hasattr(local, "client"):
+                    local.client = HttpClient(base_url, timeout=60)
+                started = time.perf_counter()
+                try:
+                    status, _ = local.client.request(paths[index % len(paths)])
+                except OSError:
+                    status = 0
+                latency = time.perf_counter() - started
+                with lock:
+                    latencies.append(latency)
+                    if status != 200:
+                        errors += 1
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                list(executor.map(run, range(options["requests"])))
+            elapsed = time.perf_counter() - started
+            rss = _rss_bytes(server.pid)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        latencies.sort()
+        rss_mb = f"{rss / 1024 / 1024:.0f}" if rss is not None else "-"
+        return (
+            f"| {profile} | {len(latencies) / elapsed:.1f} | {errors} "
+            f"| {percentile(latencies, 50) * 1000:.1f} "
+            f"| {percentile(latencies, 95) * 1000:.1f} "
+            f"| {percentile(latencies, 99) * 1000:.1f} "
+            f"| {rss_mb} |"
+        )
+
+    def _start_server(self, profile: str, workers: int, port: int) -> subprocess.Popen:
+        """gunicorn を指定の構成で起動する。"""
+        config = SERVER_PROFILES[profile]
+        env = {
+            **os.environ,
+            **config["env"],
+            "ALLOWED_HOSTS": "127.0.0.1",
+            "DJANGO_SETTINGS_MODULE": os.environ.get(
+                "DJANGO_SETTINGS_MODULE", "config.settings"
+            ),
+        }
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            *config["args"],
+            "--workers",
+            str(workers),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--log-level",
+            "warning",
+        ]
+        self.stdout.write(f"{profile}: {' '.join(command[2:])}")
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+    def _wait_until_ready(self, base_url: str, server: subprocess.Popen) -> None:
+        """サーバーがリクエストを受け付けるまで待つ。"""
+        client = HttpClient(base_url, timeout=5)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("サーバーの起動に失敗しました。")
+            try:
+                status, _ = client.request("/")
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise CommandError("サーバーが時間内に起動しませんでした。")
@@ -0,0 +1,58 @@
+"""CSV / JSONL ファイルの在庫数を一括で反映する管理コマンド（倉庫連携用）。
+
+各行は sku と、stock（在庫数をその値にする）または delta（在庫数に加減する）のどちらか。
+CSV の場合は sku, stock, delta の列を持ち、使わない方の列は空欄にする。
+
+使い方:
+    python manage.py sync_stock stock.csv
+    python manage.py sync_stock stock.jsonl --batch-size 10000
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.services.catalog_import import FORMATS, detect_format, read_rows
+from products.services.stock_sync import sync_stock
+
+
+class Command(BaseCommand):
+    help = "CSV / JSONL ファイルの在庫数（stock または delta）を一括で反映します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="読み込むファイルのパス")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="ファイルの形式（省略時は拡張子から判定）",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="1回の UPDATE で反映する行数（デフォルト: 5000）",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size は1以上で指定してください。")
+
+        try:
+            fmt = options["format"] or detect_format(options["path"])
+            with open(options["path"], "rb") as f:
+                result = sync_stock(
+                    read_rows(f, fmt, required_columns=("sku",)),
+                    batch_size=options["batch_size"],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e)) from e
+
+        for line_no, error in result.errors:
+            self.stderr.write(f"{line_no}行目: {error}")
+
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(
+            style(
+                f"{result.total_rows}行中 {result.updated}行の在庫数を反映しました"
+                f"（エラー {len(result.errors)}行、{result.elapsed:.2f}秒、"
+                f"{result.rows_per_second:.0f}行/秒）。"
+            )
+        )
@@ -0,0 +1,97 @@
+"""注文のステータスを一括で変更する管理コマンド（発送処理などの連携用）。
+
+注文IDは引数、またはファイル（1行に1つ。"-" で標準入力）で指定する。
+遷移できない注文（発送済みの注文を未払いに戻すなど）は変更せず、エラーとして出力する。
+キャンセルした注文の数量は在庫に戻す（--release-promotions でプロモーションコードも未使用に戻す）。
+
+使い方:
+    python manage.py transition_orders shipped 101 102 103
+    python manage.py transition_orders shipped --ids-file shipped_order_ids.txt
+    cat ids.txt | python manage.py transition_orders delivered --ids-file -
+    python manage.py transition_orders cancelled 104 --release-promotions
+"""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.models import Order
+from products.services.order_status import transition_orders
+
+
+class Command(BaseCommand):
+    help = "注文のステータスを一括で変更します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "status", choices=Order.Status.values, help="変更後のステータス"
+        )
+        parser.add_argument("order_ids", nargs="*", type=int, help="注文ID")
+        parser.add_argument(
+            "--ids-file",
+            help="注文IDを1行に1つ書いたファイル（- で標準入力）",
+        )
+        parser.add_argument(
+            "--release-promotions",
+            action="store_true",
+            help="キャンセルした注文のプロモーションコードを未使用に戻す",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回のトランザクションで変更する件数（デフォルト: 1000）",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size は1以上で指定してください。")
+
+        order_ids = list(options["order_ids"])
+        if options["ids_file"]:
+            order_ids.extend(self._read_ids(options["ids_file"]))
+        if not order_ids:
+            raise CommandError("注文IDを指定してください。")
+
+        result = transition_orders(
+            order_ids,
+            options["status"],
+            batch_size=options["batch_size"],
+            release_promotions=options["release_promotions"],
+        )
+
+        for order_id, error in result.errors:
+            self.stderr.write(f"注文ID {order_id}: {error}")
+
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(
+            style(
+                f"{result.total}件中 {result.updated}件のステータスを"
+                f"「{Order.Status(options['status']).label}」に変更しました"
+                f"（エラー {len(result.errors)}件、{result.elapsed:.2f}秒）。"
+            )
+        )
+        if options["status"] == Order.Status.CANCELLED:
+            self.stdout.write(
+                f"在庫に {result.restocked_units} 個戻し、"
+                f"プロモーションコードを {result.released_promotions} 件未使用に戻しました。"
+            )
+
+    def _read_ids(self, path: str) -> list[int]:
+        try:
+            f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        except OSError as e:
+            raise CommandError(str(e)) from e
+
+        order_ids = []
+        with f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    order_ids.append(int(line))
+                except ValueError:
+                    raise CommandError(
+                        f"{line_no}行目: 注文IDは整数で指定してください。"
+                    )
+        return order_ids
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.5 on 2026-10-19 05:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_alter_order_total_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=64, verbose_name='セッションキー')),
+                ('quantity', models.PositiveIntegerField(verbose_name='確保数')),
+                ('expires_at', models.DateTimeField(verbose_name='有効期限')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='products.product', verbose_name='商品')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'expires_at'], name='products_st_product_949bde_idx'), models.Index(fields=['expires_at'], name='products_st_expires_a9077b_idx')],
+                'unique_together': {('session_key', 'product')},
+            },
+        ),
+    ]
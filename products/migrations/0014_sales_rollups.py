@@ -0,0 +1,45 @@
+# Generated by Django 4.2.5 on 2026-10-19 05:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_stockhold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='日付')),
+                ('order_count', models.PositiveIntegerField(default=0, verbose_name='注文数')),
+                ('units_sold', models.PositiveIntegerField(default=0, verbose_name='販売個数')),
+                ('revenue', models.PositiveBigIntegerField(default=0, verbose_name='売上（割引後）')),
+                ('discount_total', models.PositiveBigIntegerField(default=0, verbose_name='割引額合計')),
+                ('promotion_redemptions', models.PositiveIntegerField(default=0, verbose_name='プロモーションコード利用数')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesRollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='集計名')),
+                ('last_order_id', models.PositiveBigIntegerField(default=0, verbose_name='集計済みの注文ID')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_count', models.PositiveIntegerField(default=0, verbose_name='注文数')),
+                ('units_sold', models.PositiveIntegerField(default=0, verbose_name='販売個数')),
+                ('revenue', models.PositiveBigIntegerField(default=0, verbose_name='売上（割引前）')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollup', to='products.product', verbose_name='商品')),
+            ],
+        ),
+    ]
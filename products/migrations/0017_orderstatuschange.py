@@ -0,0 +1,24 @@
+# Generated by Django 4.2.5 on 2026-10-19 05:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_product_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('pending', '未払い'), ('paid', '支払い済み'), ('shipped', '発送済み'), ('delivered', '配達済み'), ('cancelled', 'キャンセル')], max_length=20, verbose_name='変更前')),
+                ('to_status', models.CharField(choices=[('pending', '未払い'), ('paid', '支払い済み'), ('shipped', '発送済み'), ('delivered', '配達済み'), ('cancelled', 'キャンセル')], max_length=20, verbose_name='変更後')),
+                ('changed_at', models.DateTimeField(auto_now_add=True, verbose_name='変更日時')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='products.order', verbose_name='注文')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.5 on 2026-10-19 06:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_orderstatuschange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderIdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=64, verbose_name='セッションキー')),
+                ('key', models.CharField(max_length=64, verbose_name='冪等性キー')),
+                ('expires_at', models.DateTimeField(verbose_name='有効期限')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='products.order', verbose_name='注文')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='products_or_expires_5994a9_idx')],
+                'unique_together': {('session_key', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.5 on 2026-10-19 06:10
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_redemptions(apps, schema_editor):
+    """使用済みのコードの利用回数と、既存の注文の利用の記録を作る。"""
+    PromotionCode = apps.get_model("products", "PromotionCode")
+    PromotionRedemption = apps.get_model("products", "PromotionRedemption")
+    Order = apps.get_model("products", "Order")
+
+    PromotionCode.objects.filter(is_used=True).update(times_used=1)
+    orders = (
+        Order.objects.filter(promotion_code__isnull=False)
+        .exclude(status="cancelled")
+        .values_list("id", "promotion_code_id")
+    )
+    PromotionRedemption.objects.bulk_create(
+        (
+            PromotionRedemption(order_id=order_id, promotion_id=promotion_id)
+            for order_id, promotion_id in orders.iterator()
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_orderidempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='promotioncode',
+            name='times_used',
+            field=models.PositiveIntegerField(default=0, verbose_name='利用回数'),
+        ),
+        migrations.AddField(
+            model_name='promotioncode',
+            name='usage_limit',
+            field=models.PositiveIntegerField(default=1, help_text='このコードを使える注文の数（1回限りのコードは1）', validators=[django.core.validators.MinValueValidator(1)], verbose_name='利用上限'),
+        ),
+        migrations.CreateModel(
+            name='PromotionRedemption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('redeemed_at', models.DateTimeField(auto_now_add=True, verbose_name='利用日時')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='promotion_redemptions', to='products.order', verbose_name='注文')),
+                ('promotion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='redemptions', to='products.promotioncode', verbose_name='プロモーションコード')),
+            ],
+            options={
+                'unique_together': {('promotion', 'order')},
+            },
+        ),
+        migrations.RunPython(backfill_redemptions, migrations.RunPython.noop),
+    ]
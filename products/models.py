@@ -2,6 +2,16 @@ from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
+class ProductQuerySet(models.QuerySet):
+    def live(self) -> "ProductQuerySet":
+        """削除（アーカイブ）されていない商品"""
+        return self.filter(deleted_at__isnull=True)
+
+    def archived(self) -> "ProductQuerySet":
+        """削除（アーカイブ）された商品"""
+        return self.filter(deleted_at__isnull=False)
+
+
 class Product(models.Model):
     sku = models.CharField(max_length=100, verbose_name="品番", unique=True)
     name = models.CharField(max_length=255, verbose_name="商品名")
@@ -14,6 +24,28 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="公開状態")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+    # 削除した商品は行を残して日時を記録する（カート・注文履歴への波及を避けるため）
+    deleted_at = models.DateTimeField(null=True, blank=True, verbose_name="削除日時")
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # 削除されていない商品を新しい順に並べる（商品管理画面のページ送り）用
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(deleted_at__isnull=True),
+                name="product_live_created_idx",
+            ),
+            # 在庫切れ・在庫わずかの絞り込み用
+            models.Index(fields=["stock"]),
+            # 削除済みの商品に残ったカートの明細の掃除用
+            models.Index(
+                fields=["deleted_at"],
+                condition=models.Q(deleted_at__isnull=False),
+                name="product_archived_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         return self.name
@@ -134,6 +166,56 @@ class Order(models.Model):
         return f"Order #{self.id} ({self.name})"
 
 
+class OrderStatusChange(models.Model):
+    """注文のステータスの変更履歴（products.services.order_status が記録する）"""
+
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name="status_changes",
+        verbose_name="注文",
+    )
+    from_status = models.CharField(
+        max_length=20, choices=Order.Status.choices, verbose_name="変更前"
+    )
+    to_status = models.CharField(
+        max_length=20, choices=Order.Status.choices, verbose_name="変更後"
+    )
+    changed_at = models.DateTimeField(auto_now_add=True, verbose_name="変更日時")
+
+    def __str__(self) -> str:
+        return f"Order #{self.order_id}: {self.from_status} -> {self.to_status}"
+
+
+class OrderIdempotencyKey(models.Model):
+    """
+    注文確定の冪等性キー（products.services.idempotency が注文と同じトランザクションで記録する）
+
+    同じセッション・同じキーの再送信には、新しい注文を作らずにこの注文を返す
+    """
+
+    session_key = models.CharField(max_length=64, verbose_name="セッションキー")
+    key = models.CharField(max_length=64, verbose_name="冪等性キー")
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name="idempotency_keys",
+        verbose_name="注文",
+    )
+    expires_at = models.DateTimeField(verbose_name="有効期限")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+
+    class Meta:
+        unique_together = ("session_key", "key")
+        indexes = [
+            # 期限切れの行の掃除用
+            models.Index(fields=["expires_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"OrderIdempotencyKey(key={self.key}, order={self.order_id})"
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(
         Order, on_delete=models.CASCADE, related_name="items", verbose_name="注文"
@@ -180,10 +262,20 @@ class PromotionCode(models.Model):
         help_text="割引金額（100円から1000円まで）",
     )
 
+    # 何回の注文で使えるか（1 は1回限りのコード、キャンペーン用のコードは大きくする）
+    usage_limit = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)],
+        verbose_name="利用上限",
+        help_text="このコードを使える注文の数（1回限りのコードは1）",
+    )
+    # 利用回数は products.services.promotions の条件付き UPDATE でだけ増減する
+    times_used = models.PositiveIntegerField(default=0, verbose_name="利用回数")
+    # 利用上限に達したかどうか（times_used と同じ UPDATE で更新する）
     is_used = models.BooleanField(default=False, verbose_name="使用済み")
     used_at = models.DateTimeField(
         null=True, blank=True, verbose_name="使用日時"
-    )  # 未使用ならnull
+    )  # 未使用ならnull（複数回使えるコードは最後に使われた日時）
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
 
     class Meta:
@@ -193,3 +285,103 @@ class PromotionCode(models.Model):
 
     def __str__(self) -> str:
         return f"{self.code} (-{self.discount_amount}円)"
+
+
+class PromotionRedemption(models.Model):
+    """プロモーションコードの利用の記録（注文ごとに1行）"""
+
+    promotion = models.ForeignKey(
+        PromotionCode,
+        on_delete=models.CASCADE,
+        related_name="redemptions",
+        verbose_name="プロモーションコード",
+    )
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name="promotion_redemptions",
+        verbose_name="注文",
+    )
+    redeemed_at = models.DateTimeField(auto_now_add=True, verbose_name="利用日時")
+
+    class Meta:
+        unique_together = ("promotion", "order")
+
+    def __str__(self) -> str:
+        return f"{self.promotion_id}: Order #{self.order_id}"
+
+
+class StockHold(models.Model):
+    """
+    チェックアウト中のカートが確保している在庫（有効期限付き）
+
+    有効期限を過ぎた行は在庫の計算に含めない（削除は掃除用のコマンドで行う）
+    """
+
+    session_key = models.CharField(max_length=64, verbose_name="セッションキー")
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="holds", verbose_name="商品"
+    )
+    quantity = models.PositiveIntegerField(verbose_name="確保数")
+    expires_at = models.DateTimeField(verbose_name="有効期限")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+
+    class Meta:
+        unique_together = ("session_key", "product")
+        indexes = [
+            # 商品ごとの有効な確保数の集計用
+            models.Index(fields=["product", "expires_at"]),
+            # 期限切れの行の掃除用
+            models.Index(fields=["expires_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"StockHold(session_key={self.session_key}, product={self.product_id})"
+
+
+class SalesRollupWatermark(models.Model):
+    """売上集計が処理済みの位置（最後に集計した注文ID）"""
+
+    name = models.CharField(max_length=50, unique=True, verbose_name="集計名")
+    last_order_id = models.PositiveBigIntegerField(
+        default=0, verbose_name="集計済みの注文ID"
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    def __str__(self) -> str:
+        return f"{self.name} (order_id <= {self.last_order_id})"
+
+
+class DailySalesRollup(models.Model):
+    """日別の売上集計（rollup_sales コマンドで差分を加算する）"""
+
+    date = models.DateField(unique=True, verbose_name="日付")
+    order_count = models.PositiveIntegerField(default=0, verbose_name="注文数")
+    units_sold = models.PositiveIntegerField(default=0, verbose_name="販売個数")
+    revenue = models.PositiveBigIntegerField(default=0, verbose_name="売上（割引後）")
+    discount_total = models.PositiveBigIntegerField(
+        default=0, verbose_name="割引額合計"
+    )
+    promotion_redemptions = models.PositiveIntegerField(
+        default=0, verbose_name="プロモーションコード利用数"
+    )
+
+    def __str__(self) -> str:
+        return f"DailySalesRollup({self.date})"
+
+
+class ProductSalesRollup(models.Model):
+    """商品別の売上集計（rollup_sales コマンドで差分を加算する）"""
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="sales_rollup",
+        verbose_name="商品",
+    )
+    order_count = models.PositiveIntegerField(default=0, verbose_name="注文数")
+    units_sold = models.PositiveIntegerField(default=0, verbose_name="販売個数")
+    revenue = models.PositiveBigIntegerField(default=0, verbose_name="売上（割引前）")
+
+    def __str__(self) -> str:
+        return f"ProductSalesRollup(product={self.product_id})"
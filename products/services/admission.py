@@ -0,0 +1,160 @@
+"""
+注文確定の入場制限（セール開始時の待合室）
+
+注文確定を同時に処理する数を、全体（CHECKOUT_ADMISSION_LIMIT）と商品ごと
+（CHECKOUT_ADMISSION_PRODUCT_LIMIT）に制限する。上限を超えた注文は行ロックを待たずに
+待合室のページ（順番の目安を表示し、しばらくして自動で再送信する）を返すため、
+ワーカーが行ロック待ちで埋まらず、商品一覧などの閲覧は速いまま保たれる。
+
+- 同時実行数はキャッシュ（CHECKOUT_ADMISSION_CACHE）上の「枠」で数える。
+  枠は cache.add で取り合い、CHECKOUT_ADMISSION_LEASE_SECONDS 秒で失効するため、
+  処理中にワーカーが落ちても枠が残り続けることはない
+- 既定のキャッシュ（LocMemCache）はプロセス内で完結する代替で、上限はプロセスごとになる。
+  複数プロセス・複数サーバーで上限を共有する場合は、Redis などの共有のキャッシュを設定する
+- 待合室の順番は、入れなかったときに受け取る整理番号と、入場した件数の差から求める目安
+  （順番どおりの入場は保証しない。ページを離れた人の番号は飛ばされる）
+- 待合室に入った注文の入力内容はセッションに預かり、待合室のページには冪等性キーだけを
+  埋め込んで再送信する。カード情報は預からず、待合室のページで入力し直してもらう
+"""
+
+import random
+import threading
+import uuid
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+
+QUEUE_TAIL_KEY = "checkout:queue:tail"
+QUEUE_HEAD_KEY = "checkout:queue:head"
+# 整理番号のカウンタを保持する秒数（待つ人がいなくなってしばらくすると 0 からやり直す）
+QUEUE_COUNTER_TIMEOUT = 60 * 60
+
+
+@dataclass
+class Admission:
+    """取得した枠（キャッシュのキー）と、その持ち主を表すトークン"""
+
+    token: str
+    slot_keys: list[str] = field(default_factory=list)
+
+
+class AdmissionController:
+    """キャッシュ上の枠で、注文確定の同時実行数を制限する。"""
+
+    def __init__(
+        self,
+        cache_alias: str = "default",
+        limit: int = 0,
+        product_limit: int = 0,
+        lease_seconds: int = 30,
+    ):
+        self._cache_alias = cache_alias
+        self._limit = limit
+        self._product_limit = product_limit
+        self._lease_seconds = lease_seconds
+
+    @property
+    def _cache(self) -> BaseCache:
+        # キャッシュの接続はスレッドごとのため、使うたびに取得する
+        return caches[self._cache_alias]
+
+    @property
+    def enabled(self) -> bool:
+        return self._limit > 0 or self._product_limit > 0
+
+    def acquire(self, product_ids: Iterable[int]) -> Admission | None:
+        """
+        全体と、カートの商品ごとの枠を取得する（どれか1つでも空きがなければ None）。
+
+        枠は全体 → 商品IDの順に取り、取得できなかった場合は取得済みの枠を返す。
+        """
+        admission = Admission(token=uuid.uuid4().hex)
+        scopes = []
+        if self._limit > 0:
+            scopes.append(("global", self._limit))
+        if self._product_limit > 0:
+            scopes.extend(
+                (f"product:{pk}", self._product_limit)
+                for pk in sorted(set(product_ids))
+            )
+
+        for scope, limit in scopes:
+            slot_key = self._acquire_slot(scope, limit, admission.token)
+            if slot_key is None:
+                self.release(admission)
+                return None
+            admission.slot_keys.append(slot_key)
+        return admission
+
+    def _acquire_slot(self, scope: str, limit: int, token: str) -> str | None:
+        # 毎回同じ枠から試すと先頭の枠に取得が集中するため、開始位置をずらす
+        start = random.randrange(limit)
+        for offset in range(limit):
+            key = f"checkout:slot:{scope}:{(start + offset) % limit}"
+            if self._cache.add(key, token, timeout=self._lease_seconds):
+                return key
+        return None
+
+    def release(self, admission: Admission) -> None:
+        """取得した枠を返す（失効して他の注文が取り直した枠は消さない）。"""
+        owned = self._cache.get_many(admission.slot_keys)
+        self._cache.delete_many(
+            [key for key, token in owned.items() if token == admission.token]
+        )
+        admission.slot_keys = []
+
+    def take_ticket(self) -> int:
+        """待合室の整理番号を発行する。"""
+        return self._incr(QUEUE_TAIL_KEY)
+
+    def mark_admitted(self) -> None:
+        """整理番号を持っていた注文が入場したことを記録する。"""
+        self._incr(QUEUE_HEAD_KEY)
+
+    def position(self, ticket: int) -> int:
+        """整理番号の前に待っている人数の目安（自分を含む）を返す。"""
+        admitted = self._cache.get(QUEUE_HEAD_KEY, 0)
+        return max(ticket - admitted, 1)
+
+    def _incr(self, key: str) -> int:
+        self._cache.add(key, 0, timeout=QUEUE_COUNTER_TIMEOUT)
+        try:
+            return self._cache.incr(key)
+        except ValueError:
+            # add と incr の間にキーが失効・削除された場合は作り直す
+            self._cache.set(key, 1, timeout=QUEUE_COUNTER_TIMEOUT)
+            return 1
+
+
+_controllers: dict[tuple, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """設定（CHECKOUT_ADMISSION_*）に応じた入場制限を返す。"""
+    config = (
+        settings.CHECKOUT_ADMISSION_CACHE,
+        settings.CHECKOUT_ADMISSION_LIMIT,
+        settings.CHECKOUT_ADMISSION_PRODUCT_LIMIT,
+        settings.CHECKOUT_ADMISSION_LEASE_SECONDS,
+    )
+
+    controller = _controllers.get(config)
+    if controller is not None:
+        return controller
+
+    with _controllers_lock:
+        controller = _controllers.get(config)
+        if controller is None:
+            cache_alias, limit, product_limit, lease_seconds = config
+            controller = AdmissionController(
+                cache_alias,
+                limit=limit,
+                product_limit=product_limit,
+                lease_seconds=lease_seconds,
+            )
+            _controllers[config] = controller
+    return controller
@@ -0,0 +1,56 @@
+"""
+商品管理画面の一括操作
+
+選んだ商品（または絞り込み結果のすべて）に対する公開・非公開・在庫数の設定・削除を、
+商品ごとではなくクエリセット単位の UPDATE / DELETE でまとめて行う。
+
+- UPDATE は auto_now が効かないため、updated_at も同じ UPDATE で更新する
+- 在庫数の設定・削除は、在庫数のキャッシュも同じ値に更新・削除する
+- 削除は products.services.product_archive の削除済み（アーカイブ）扱いにする
+- UPDATE の前に、対象の商品の行ロックを主キーの順に取る（注文確定と同じ順序にし、
+  同時に実行してもデッドロックしないようにする）
+"""
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from products.models import Product
+from products.services.product_archive import archive_products
+from products.services.stock import set_stock_levels
+
+
+def apply_bulk_action(
+    queryset: QuerySet[Product], action: str, stock: int | None = None
+) -> int:
+    """一括操作を行い、対象になった商品の件数を返す。"""
+    # 並び順は UPDATE / DELETE に不要なため外す
+    queryset = queryset.order_by()
+    now = timezone.now()
+
+    if action == "delete":
+        # 行は削除せず削除済みにする（カートの明細は purge_archived_products で掃除する）
+        return archive_products(queryset)
+
+    if action == "activate":
+        values = {"is_active": True}
+    elif action == "deactivate":
+        values = {"is_active": False}
+    elif action == "set_stock":
+        values = {"stock": stock}
+    else:
+        raise ValueError(f"不明な一括操作です: {action}")
+
+    with transaction.atomic():
+        ids = _lock_in_pk_order(queryset)
+        count = queryset.update(**values, updated_at=now)
+        if action == "set_stock":
+            transaction.on_commit(lambda: set_stock_levels(dict.fromkeys(ids, stock)))
+    return count
+
+
+def _lock_in_pk_order(queryset: QuerySet[Product]) -> list[int]:
+    """対象の商品の行ロックを主キーの順に取り、主キーの一覧を返す。"""
+    return list(
+        queryset.select_for_update().order_by("pk").values_list("pk", flat=True)
+    )
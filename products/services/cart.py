@@ -1,22 +1,498 @@
-from django.db import transaction
+"""
+カートの保存先（ストア）
+
+CART_STORE_BACKEND でカートの保存先を切り替える。
+
+- "orm": Cart / CartItem テーブルに保存する（デフォルト）
+- "kv": セッションごとに1つのハッシュ（商品ID → 数量）としてキーバリューストアに保存する。
+  CART_STORE_REDIS_URL が設定されていれば Redis、未設定ならプロセス内のメモリを使う。
+  カート操作では DB に書き込まず、注文確定時にのみ注文として DB に保存される。
+
+ビューはストアの種類を意識せず、get_cart_store() が返すストアを使う。
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
 from django.http import HttpRequest
+from django.utils import timezone
 
-from products.models import Cart
+from products.models import Cart, CartItem, Product
+from products.services.stock import aget_stock_levels, get_stock_levels
 
 
-def get_or_create_cart(request: HttpRequest) -> Cart:
+def ensure_session_key(request: HttpRequest) -> str:
+    """まだセッションIDがない場合は save() して session_key を発行させる。"""
+    if request.session.session_key is None:
+        request.session.save()
+    return request.session.session_key
+
+
+def add_cart_item(cart: Cart, product_id: int, quantity: int) -> int | None:
     """
-    現在のセッションに紐づく Cart を取得 or 作成するヘルパー。
+    カートに商品を追加し、追加後の数量を返す。在庫を超える場合は追加せず None を返す。
 
-    - まだセッションIDがない場合は save() して session_key を発行させる
-    - session_key を元に Cart を get_or_create する
+    INSERT … ON CONFLICT DO UPDATE の1文で「新規追加 or 数量の加算」と在庫チェックを
+    行うため、同じ商品を同時に追加しても一意制約違反や加算の取りこぼしが起きない。
+    （PostgreSQL / SQLite 3.35 以降で動作する）
     """
-    if request.session.session_key is None:
-        request.session.save()
+    item_table = connection.ops.quote_name(CartItem._meta.db_table)
+    product_table = connection.ops.quote_name(Product._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+    sql = f"""
+        INSERT INTO {item_table} (cart_id, product_id, quantity, created_at, updated_at)
+        SELECT %s, id, %s, %s, %s FROM {product_table}
+        WHERE id = %s AND stock >= %s AND deleted_at IS NULL
+        ON CONFLICT (cart_id, product_id) DO UPDATE
+        SET quantity = {item_table}.quantity + excluded.quantity,
+            updated_at = excluded.updated_at
+        WHERE {item_table}.quantity + excluded.quantity <= (
+            SELECT stock FROM {product_table} WHERE id = excluded.product_id
+        )
+        RETURNING quantity
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [cart.id, quantity, now, now, product_id, quantity])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+@dataclass
+class CartLine:
+    """キーバリューストアのカート明細（テンプレートからは CartItem と同じように扱える）。"""
+
+    id: int
+    product: Product
+    quantity: int
+
+    @property
+    def product_id(self) -> int:
+        return self.product.id
+
+
+def _empty_totals() -> dict:
+    return {"item_count": 0, "total_quantity": 0, "cart_total": 0}
+
+
+class CartStore(ABC):
+    """
+    カートの保存先のインターフェース。
+
+    明細（line）は id / product / product_id / quantity を持つオブジェクトで、
+    ORM ストアでは CartItem、キーバリューストアでは CartLine になる。
+    同期版はすべて抽象メソッドで、実装が欠けたストアはインスタンスを作る時点でエラーになる。
+    非同期版（a で始まるメソッド）は、未実装の場合スレッドで同期版を呼ぶ。
+    """
+
+    @abstractmethod
+    def get_lines(self, session_key: str | None) -> list:
+        """商品を読み込んだ明細を、追加順に返す。"""
+
+    @abstractmethod
+    def get_line(self, session_key: str | None, item_id: int):
+        """明細を1件返す。存在しない場合は None。"""
 
-    session_key = request.session.session_key
+    @abstractmethod
+    def add(self, session_key: str, product: Product, quantity: int) -> int | None:
+        """商品を追加して追加後の数量を返す。在庫を超える場合は追加せず None。"""
 
-    with transaction.atomic():
+    @abstractmethod
+    def set_quantity(self, session_key: str, line, quantity: int) -> None:
+        """明細の数量を変更する。"""
+
+    @abstractmethod
+    def remove(self, session_key: str | None, item_id: int) -> bool:
+        """明細を削除する。削除した場合は True。"""
+
+    @abstractmethod
+    def totals(self, session_key: str | None) -> dict:
+        """
+        カートの集計値を返す。
+
+        - item_count: 明細数（在庫切れの明細を含む）
+        - total_quantity / cart_total: 在庫がある明細の合計数量・小計合計
+        """
+
+    @abstractmethod
+    def clear(self, session_key: str) -> None:
+        """カートを空にする（注文確定後に呼ぶ）。"""
+
+    @abstractmethod
+    def quantities(self, session_key: str | None) -> dict[int, int]:
+        """商品を読み込まずに、商品IDごとの数量を返す。"""
+
+    async def aget_lines(self, session_key: str | None) -> list:
+        return await sync_to_async(self.get_lines)(session_key)
+
+    async def aget_line(self, session_key: str | None, item_id: int):
+        return await sync_to_async(self.get_line)(session_key, item_id)
+
+    async def aset_quantity(self, session_key: str, line, quantity: int) -> None:
+        await sync_to_async(self.set_quantity)(session_key, line, quantity)
+
+    async def aremove(self, session_key: str | None, item_id: int) -> bool:
+        return await sync_to_async(self.remove)(session_key, item_id)
+
+    async def atotals(self, session_key: str | None) -> dict:
+        return await sync_to_async(self.totals)(session_key)
+
+    async def aquantities(self, session_key: str | None) -> dict[int, int]:
+        return await sync_to_async(self.quantities)(session_key)
+
+
+class OrmCartStore(CartStore):
+    """Cart / CartItem テーブルにカートを保存するストア。"""
+
+    @staticmethod
+    def _items(session_key: str | None):
+        # 削除済みの商品の明細は表示・集計しない（行は purge_archived_products が削除する）
+        return CartItem.objects.filter(
+            cart__session_key=session_key, product__deleted_at__isnull=True
+        )
+
+    @staticmethod
+    def _totals_aggregates() -> dict:
+        """明細数・合計数量・小計合計を1回の集計クエリで求めるための式を返す。"""
+        available = Q(product__stock__gt=0)
+        return {
+            "item_count": Count("id"),
+            "total_quantity": Sum("quantity", filter=available),
+            "cart_total": Sum(F("quantity") * F("product__price"), filter=available),
+        }
+
+    def get_lines(self, session_key):
+        if not session_key:
+            return []
+        return list(
+            self._items(session_key).select_related("product").order_by("created_at")
+        )
+
+    def get_line(self, session_key, item_id):
+        if not session_key:
+            return None
+        return (
+            self._items(session_key)
+            .select_related("product")
+            .filter(id=item_id)
+            .first()
+        )
+
+    def add(self, session_key, product, quantity):
         cart, _created = Cart.objects.get_or_create(session_key=session_key)
+        return add_cart_item(cart, product.id, quantity)
+
+    def set_quantity(self, session_key, line, quantity):
+        line.quantity = quantity
+        line.save(update_fields=["quantity", "updated_at"])
+
+    def remove(self, session_key, item_id):
+        if not session_key:
+            return False
+        deleted, _ = self._items(session_key).filter(id=item_id).delete()
+        return deleted > 0
+
+    def totals(self, session_key):
+        if not session_key:
+            return _empty_totals()
+        totals = self._items(session_key).aggregate(**self._totals_aggregates())
+        return {key: value or 0 for key, value in totals.items()}
+
+    def clear(self, session_key):
+        Cart.objects.filter(session_key=session_key).delete()
+
+    def quantities(self, session_key):
+        if not session_key:
+            return {}
+        return dict(self._items(session_key).values_list("product_id", "quantity"))
+
+    async def aget_lines(self, session_key):
+        if not session_key:
+            return []
+        return [
+            item
+            async for item in self._items(session_key)
+            .select_related("product")
+            .order_by("created_at")
+        ]
+
+    async def aget_line(self, session_key, item_id):
+        if not session_key:
+            return None
+        return (
+            await self._items(session_key)
+            .select_related("product")
+            .filter(id=item_id)
+            .afirst()
+        )
+
+    async def aset_quantity(self, session_key, line, quantity):
+        line.quantity = quantity
+        await line.asave(update_fields=["quantity", "updated_at"])
+
+    async def aremove(self, session_key, item_id):
+        if not session_key:
+            return False
+        deleted, _ = await self._items(session_key).filter(id=item_id).adelete()
+        return deleted > 0
+
+    async def aquantities(self, session_key):
+        if not session_key:
+            return {}
+        return {
+            product_id: quantity
+            async for product_id, quantity in self._items(session_key).values_list(
+                "product_id", "quantity"
+            )
+        }
+
+    async def atotals(self, session_key):
+        if not session_key:
+            return _empty_totals()
+        totals = await self._items(session_key).aaggregate(**self._totals_aggregates())
+        return {key: value or 0 for key, value in totals.items()}
+
+
+class InMemoryKeyValueClient:
+    """
+    Redis のハッシュ操作のうちカートで使うものだけを、プロセス内のメモリで実装したクライアント。
+
+    Redis を用意しない開発環境・テスト用。値は Redis と同じく bytes で返す。
+    """
+
+    def __init__(self):
+        self._data: dict[str, dict[bytes, bytes]] = {}
+        self._expires: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _hash(self, key: str, create: bool = False) -> dict[bytes, bytes]:
+        """
+        キーのハッシュを返す（期限切れなら削除してから）。
+
+        読み取りでは空のハッシュを作らず、書き込み（create=True）のときだけ作る。
+        """
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        if create:
+            return self._data.setdefault(key, {})
+        return self._data.get(key, {})
+
+    def hgetall(self, key: str) -> dict[bytes, bytes]:
+        with self._lock:
+            return dict(self._hash(key))
+
+    def hget(self, key: str, field) -> bytes | None:
+        with self._lock:
+            return self._hash(key).get(str(field).encode())
+
+    def hset(self, key: str, field, value) -> int:
+        with self._lock:
+            data = self._hash(key, create=True)
+            field = str(field).encode()
+            created = field not in data
+            data[field] = str(value).encode()
+            return int(created)
+
+    def hincrby(self, key: str, field, amount: int) -> int:
+        with self._lock:
+            data = self._hash(key, create=True)
+            field = str(field).encode()
+            value = int(data.get(field, b"0")) + amount
+            data[field] = str(value).encode()
+            return value
+
+    def hdel(self, key: str, *fields) -> int:
+        with self._lock:
+            data = self._hash(key)
+            deleted = sum(
+                data.pop(str(field).encode(), None) is not None for field in fields
+            )
+            # Redis と同じく、空になったハッシュはキーごと削除する
+            if not data:
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return deleted
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                deleted += int(bool(self._data.pop(key, None)))
+                self._expires.pop(key, None)
+            return deleted
+
+    def expire(self, key: str, seconds: int) -> bool:
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._expires[key] = time.monotonic() + seconds
+            return True
+
+    def flushdb(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+
+class KeyValueCartStore(CartStore):
+    """
+    セッションごとに1つのハッシュ（商品ID → 数量）でカートを保存するストア。
+
+    - 明細IDには商品IDを使う
+    - 在庫チェックは HINCRBY で加算した結果が在庫を超えたら戻す（DB への書き込みはない）
+    - 商品情報（価格・在庫）は表示・集計のたびに DB から1クエリでまとめて取得する
+    """
+
+    def __init__(self, client, ttl: int, prefix: str = "cart:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, session_key: str) -> str:
+        return f"{self.prefix}{session_key}"
+
+    def _quantities(self, session_key: str | None) -> dict[int, int]:
+        if not session_key:
+            return {}
+        return {
+            int(product_id): int(quantity)
+            for product_id, quantity in self.client.hgetall(
+                self._key(session_key)
+            ).items()
+        }
+
+    def get_lines(self, session_key):
+        quantities = self._quantities(session_key)
+        if not quantities:
+            return []
+
+        products = Product.objects.live().in_bulk(list(quantities))
+        # 削除済み・存在しない商品の明細はカートから取り除く
+        missing = [pk for pk in quantities if pk not in products]
+        if missing:
+            self.client.hdel(self._key(session_key), *missing)
+
+        # ハッシュは順序を保証しないため、商品ID順で返す
+        return [
+            CartLine(id=pk, product=products[pk], quantity=quantity)
+            for pk, quantity in sorted(quantities.items())
+            if pk in products
+        ]
+
+    def get_line(self, session_key, item_id):
+        if not session_key:
+            return None
+        quantity = self.client.hget(self._key(session_key), item_id)
+        if quantity is None:
+            return None
+        product = Product.objects.live().filter(pk=item_id).first()
+        if product is None:
+            return None
+        return CartLine(id=item_id, product=product, quantity=int(quantity))
+
+    def add(self, session_key, product, quantity):
+        if product.stock < quantity:
+            return None
+        key = self._key(session_key)
+        new_quantity = self.client.hincrby(key, product.id, quantity)
+        if new_quantity > product.stock:
+            # 在庫を超えた分を戻す（同時に追加された場合も、加算・減算は原子的に行われる）
+            remaining = self.client.hincrby(key, product.id, -quantity)
+            if remaining <= 0:
+                self.client.hdel(key, product.id)
+            return None
+        self.client.expire(key, self.ttl)
+        return new_quantity
+
+    def set_quantity(self, session_key, line, quantity):
+        key = self._key(session_key)
+        self.client.hset(key, line.id, quantity)
+        self.client.expire(key, self.ttl)
+        line.quantity = quantity
+
+    def remove(self, session_key, item_id):
+        if not session_key:
+            return False
+        return self.client.hdel(self._key(session_key), item_id) > 0
+
+    def totals(self, session_key):
+        lines = self.get_lines(session_key)
+        available = [line for line in lines if line.product.stock > 0]
+        return {
+            "item_count": len(lines),
+            "total_quantity": sum(line.quantity for line in available),
+            "cart_total": sum(line.product.price * line.quantity for line in available),
+        }
+
+    def clear(self, session_key):
+        self.client.delete(self._key(session_key))
+
+    def quantities(self, session_key):
+        return self._quantities(session_key)
+
+
+def get_badge_quantity(session_key: str | None) -> int:
+    """
+    カートバッジに表示する、在庫がある商品の合計数量を返す。
+
+    全ページで表示されるため、商品の行は読み込まずに在庫数のキャッシュで判定する。
+    """
+    quantities = get_cart_store().quantities(session_key)
+    levels = get_stock_levels(quantities)
+    return sum(
+        quantity
+        for product_id, quantity in quantities.items()
+        if levels.get(product_id, 0) > 0
+    )
+
+
+async def aget_badge_quantity(session_key: str | None) -> int:
+    """`get_badge_quantity` の非同期版。"""
+    quantities = await get_cart_store().aquantities(session_key)
+    levels = await aget_stock_levels(quantities)
+    return sum(
+        quantity
+        for product_id, quantity in quantities.items()
+        if levels.get(product_id, 0) > 0
+    )
+
+
+_stores: dict[tuple, CartStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_cart_store() -> CartStore:
+    """設定（CART_STORE_BACKEND / CART_STORE_REDIS_URL）に応じたストアを返す。"""
+    backend = settings.CART_STORE_BACKEND
+    redis_url = settings.CART_STORE_REDIS_URL
+    config = (backend, redis_url, settings.CART_STORE_TTL)
+
+    store = _stores.get(config)
+    if store is not None:
+        return store
+
+    with _stores_lock:
+        store = _stores.get(config)
+        if store is None:
+            if backend == "orm":
+                store = OrmCartStore()
+            elif backend == "kv":
+                if redis_url:
+                    import redis
 
-    return cart
+                    client = redis.Redis.from_url(redis_url)
+                else:
+                    client = InMemoryKeyValueClient()
+                store = KeyValueCartStore(client, ttl=settings.CART_STORE_TTL)
+            else:
+                raise ValueError(f"不明な CART_STORE_BACKEND です: {backend}")
+            _stores[config] = store
+    return store
@@ -0,0 +1,193 @@
+"""
+商品の一括登録・更新（CSV / JSONL）
+
+仕入れ先のフィードなど数万件の商品を、品番（sku）をキーにまとめて登録・更新する。
+
+- ファイルは1行ずつ読み込み、全体をメモリに載せない
+- 各行は ProductImportForm（ProductForm と同じ入力ルール）で検証し、エラーは行番号付きで返す
+  （フォームは1つだけ作り、全行の検証に使い回す）
+- 検証済みの行は chunk_size 件ごとに bulk_create(update_conflicts=True) で upsert する
+  （品番が既存なら更新、なければ作成。1チャンク = 1トランザクション）
+- 任意の列（description / is_active）は、ファイルにある場合だけ既存の商品を更新する
+- 削除済み（アーカイブ）の商品の品番の行は、その商品を更新して元に戻す（deleted_at を空にする）。
+  品番は削除後も一意のまま残るため、削除した品番を使い直す方法は一括登録だけになる。
+  元に戻した件数は ImportResult.revived で返す
+"""
+
+import csv
+import io
+import json
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from typing import BinaryIO
+
+from django.db import transaction
+
+from products.forms import ProductImportForm
+from products.models import Product
+from products.services.stock import set_stock_levels
+
+REQUIRED_COLUMNS = ("sku", "name", "price", "stock")
+OPTIONAL_COLUMNS = ("description", "is_active")
+FORMATS = ("csv", "jsonl")
+
+
+@dataclass
+class ImportResult:
+    """一括登録の結果"""
+
+    total_rows: int = 0
+    applied: int = 0
+    # 削除済みから元に戻した商品の数（applied に含まれる）
+    revived: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total_rows / self.elapsed if self.elapsed else 0.0
+
+
+def detect_format(filename: str) -> str:
+    """ファイル名の拡張子から形式（csv / jsonl）を判定する。"""
+    if filename.lower().endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if filename.lower().endswith(".csv"):
+        return "csv"
+    raise ValueError("ファイルの形式を判定できません（.csv / .jsonl に対応）。")
+
+
+def read_rows(
+    file: BinaryIO, fmt: str, required_columns: tuple[str, ...] = REQUIRED_COLUMNS
+) -> Iterator[tuple[int, dict | None]]:
+    """
+    ファイルを1行ずつ読み込み、(行番号, 行の辞書) を返す。
+
+    JSONL で読み込めない行は、行の辞書の代わりに None を返す。
+    CSV のヘッダーに required_columns の列がない場合は ValueError を送出する。
+    """
+    # Excel で保存した CSV の BOM を取り除く
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        missing = [c for c in required_columns if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"必須の列がありません: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            row = None
+        yield line_no, row if isinstance(row, dict) else None
+
+
+def import_products(file: BinaryIO, fmt: str, chunk_size: int = 1000) -> ImportResult:
+    """ファイルの商品を品番をキーに登録・更新し、結果を返す。"""
+    started = time.perf_counter()
+    result = ImportResult()
+    seen_skus: set[str] = set()
+    chunk: list[tuple[frozenset[str], Product]] = []
+    form = ProductImportForm()
+
+    for line_no, row in read_rows(file, fmt):
+        result.total_rows += 1
+        product, columns, error = _validate_row(form, row)
+        if error is None and product.sku in seen_skus:
+            error = f"品番「{product.sku}」がファイル内で重複しています。"
+        if error is not None:
+            result.errors.append((line_no, error))
+            continue
+
+        seen_skus.add(product.sku)
+        chunk.append((columns, product))
+        if len(chunk) >= chunk_size:
+            _apply_into(result, chunk)
+            chunk = []
+
+    if chunk:
+        _apply_into(result, chunk)
+
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _validate_row(
+    form: ProductImportForm, row: dict | None
+) -> tuple[Product | None, frozenset[str], str | None]:
+    """1行を検証し、(商品, ファイルにあった任意の列, エラーメッセージ) を返す。"""
+    if row is None:
+        return None, frozenset(), "JSON のオブジェクトとして読み込めません。"
+
+    data = {
+        key: "" if value is None else value
+        for key, value in row.items()
+        if key in REQUIRED_COLUMNS + OPTIONAL_COLUMNS
+    }
+    columns = frozenset(c for c in OPTIONAL_COLUMNS if c in data)
+    # 公開状態の列がない場合、新規の商品は公開にする（既存の商品は更新しない）
+    data.setdefault("is_active", True)
+
+    cleaned_data, errors = form.clean_row(data)
+    if errors:
+        error = " / ".join(
+            f"{name}: {' '.join(messages)}" for name, messages in errors.items()
+        )
+        return None, columns, error
+    return Product(**cleaned_data), columns, None
+
+
+def _apply_into(
+    result: ImportResult, chunk: list[tuple[frozenset[str], Product]]
+) -> None:
+    applied, revived = _apply_chunk(chunk)
+    result.applied += applied
+    result.revived += revived
+
+
+def _apply_chunk(chunk: list[tuple[frozenset[str], Product]]) -> tuple[int, int]:
+    """検証済みの行をまとめて upsert し、(反映した件数, 元に戻した削除済みの商品の数) を返す。"""
+    # 任意の列の有無が同じ行ごとに、更新する列を揃えて upsert する
+    groups: dict[frozenset[str], list[Product]] = defaultdict(list)
+    for columns, product in chunk:
+        groups[columns].append(product)
+
+    with transaction.atomic():
+        revived = (
+            Product.objects.archived()
+            .filter(sku__in=[product.sku for _, product in chunk])
+            .count()
+        )
+        for columns, products in groups.items():
+            Product.objects.bulk_create(
+                products,
+                update_conflicts=True,
+                unique_fields=["sku"],
+                update_fields=[
+                    "name",
+                    "price",
+                    "stock",
+                    *sorted(columns),
+                    "updated_at",
+                    # 削除済みの商品の品番は、登録し直すと一覧・販売に戻す（revived で件数を返す）
+                    "deleted_at",
+                ],
+            )
+
+    # 在庫数のキャッシュも更新後の値にする（write-through）
+    set_stock_levels(
+        dict(
+            Product.objects.filter(
+                sku__in=[product.sku for _, product in chunk]
+            ).values_list("id", "stock")
+        )
+    )
+    return len(chunk), revived
@@ -0,0 +1,51 @@
+"""
+注文確定時の行ロックの待ち方
+
+商品の行ロックは常に主キーの順に取る（holds.lock_available_products）ため、
+同じ商品を含むカート同士がデッドロックすることはない。ただし、混雑時に
+ロックを待ち続けるとワーカーが詰まるため、待ち方を CHECKOUT_LOCK_POLICY で選べるようにする。
+
+- "wait": ロックが解放されるまで待つ（既定）
+- "nowait": ロック中の行があれば待たずに失敗する（SELECT ... FOR UPDATE NOWAIT）
+- "timeout": CHECKOUT_LOCK_TIMEOUT_MS ミリ秒まで待って失敗する
+  （PostgreSQL の lock_timeout を使う。他の DB では "wait" と同じ）
+
+失敗した場合は LockBusy を送出し、呼び出し側は再試行できる応答（503 と Retry-After）を返す。
+SKIP LOCKED は、ロック中の商品を黙って結果から外す（カートの明細が欠けた注文になる）ため使わない。
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+POLICIES = ("wait", "nowait", "timeout")
+
+
+class LockBusy(Exception):
+    """行ロックを取得できなかった（しばらく待ってから再試行できる）"""
+
+
+def lock_nowait() -> bool:
+    """select_for_update に nowait=True を指定するかどうかを返す。"""
+    return settings.CHECKOUT_LOCK_POLICY == "nowait"
+
+
+def apply_lock_timeout() -> None:
+    """現在のトランザクションで、行ロックを待つ時間の上限を設定する（"timeout" の場合だけ）。"""
+    if settings.CHECKOUT_LOCK_POLICY != "timeout" or connection.vendor != "postgresql":
+        return
+    timeout_ms = int(settings.CHECKOUT_LOCK_TIMEOUT_MS)
+    with connection.cursor() as cursor:
+        # SET はパラメータを使えないため、整数に変換した値を埋め込む
+        cursor.execute(f"SET LOCAL lock_timeout = {timeout_ms}")
+
+
+@contextmanager
+def acquiring_locks() -> Iterator[None]:
+    """行ロックの取得中に起きた DB のエラー（NOWAIT・lock_timeout・デッドロック）を LockBusy にする。"""
+    try:
+        yield
+    except OperationalError as exc:
+        raise LockBusy(str(exc)) from exc
@@ -0,0 +1,159 @@
+"""
+チェックアウト中の在庫の確保（有効期限付き）
+
+購入手続きを始めた時点で、カートの数量分の在庫を StockHold に確保する。
+他のカートからは「在庫数 - 有効な確保数」を購入可能数として扱うため、
+在庫の取り合いは注文確定時ではなく、購入手続きの開始時に決まる。
+
+- 確保は STOCK_HOLD_TTL 秒で失効し、失効した行は集計に含めない
+- 失効した行の削除は release_expired_holds コマンドでまとめて行う
+- 在庫の最終的な判定は、これまでどおり注文確定時の行ロックで行う
+"""
+
+from datetime import timedelta
+from typing import Iterable
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products.models import Product, StockHold
+
+
+def active_holds() -> models.QuerySet:
+    """有効期限内の確保を返す。"""
+    return StockHold.objects.filter(expires_at__gt=timezone.now())
+
+
+def annotate_available(
+    queryset: models.QuerySet, exclude_session_key: str | None = None
+) -> models.QuerySet:
+    """
+    商品のクエリセットに、有効な確保数（held）と購入可能数（available）を付ける。
+
+    exclude_session_key を指定すると、そのカート自身の確保は差し引かない。
+    在庫数が管理画面で減らされた場合などは available が負になり得る。
+    """
+    holds = active_holds().filter(product=OuterRef("pk"))
+    if exclude_session_key:
+        holds = holds.exclude(session_key=exclude_session_key)
+    held = holds.values("product").annotate(total=Sum("quantity")).values("total")
+
+    return queryset.annotate(
+        held=Coalesce(Subquery(held), 0, output_field=models.IntegerField())
+    ).annotate(
+        available=models.ExpressionWrapper(
+            F("stock") - F("held"), output_field=models.IntegerField()
+        )
+    )
+
+
+def get_available_stock(
+    product_ids: Iterable[int], exclude_session_key: str | None = None
+) -> dict[int, int]:
+    """商品IDごとの購入可能数を、ロックを取らずに1クエリで返す（存在しない商品は含まない）。"""
+    return {
+        pk: max(available, 0)
+        for pk, available in annotate_available(
+            Product.objects.live().filter(pk__in=list(product_ids)),
+            exclude_session_key,
+        ).values_list("id", "available")
+    }
+
+
+def lock_available_products(
+    product_ids: Iterable[int],
+    exclude_session_key: str | None = None,
+    nowait: bool = False,
+) -> dict[int, Product]:
+    """
+    商品の行ロックを取り、購入可能数（available）を付けて {商品ID: 商品} で返す。
+
+    ロックは常に主キーの順に取る（注文確定・在庫の確保・キャンセル時の在庫の戻しで
+    同じ順序にし、同じ商品を含むトランザクション同士がデッドロックしないようにする）。
+    nowait=True の場合、ロック中の商品があれば待たずに OperationalError を送出する。
+
+    ロックと購入可能数の読み取りは別のクエリにする。PostgreSQL（READ COMMITTED）では、
+    ロック待ちの後に読み直されるのはロックした行だけで、同じ SELECT の確保数のサブクエリは
+    待つ前のスナップショットのまま読まれる（待っている間に確保された分を見落とす）。
+    ロックを取った後の2つ目のクエリは、その時点のスナップショットで確保数を数える。
+    """
+    locked_ids = list(
+        Product.objects.live()
+        .filter(pk__in=list(product_ids))
+        .select_for_update(nowait=nowait)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    if not locked_ids:
+        return {}
+
+    queryset = annotate_available(
+        Product.objects.filter(pk__in=locked_ids).order_by("pk"), exclude_session_key
+    )
+    return {product.pk: product for product in queryset}
+
+
+def hold_cart_stock(session_key: str, lines: list) -> dict[int, int]:
+    """
+    カートの明細分の在庫を確保し、数量分を確保できなかった商品の購入可能数を返す。
+
+    商品の行を短時間ロックして、他のカートの確保と直列化する。
+    確保できた分（数量と購入可能数の小さい方）だけを保持し、
+    不足した商品は {商品ID: 購入可能数} で返す（数量の調整は呼び出し側で行う）。
+    """
+    quantities = {line.product_id: line.quantity for line in lines}
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+    shortages: dict[int, int] = {}
+    holds: list[StockHold] = []
+
+    with transaction.atomic():
+        products = lock_available_products(quantities, exclude_session_key=session_key)
+
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            available = max(product.available, 0) if product else 0
+            if available < quantity:
+                shortages[product_id] = available
+            if min(quantity, available) > 0:
+                holds.append(
+                    StockHold(
+                        session_key=session_key,
+                        product_id=product_id,
+                        quantity=min(quantity, available),
+                        expires_at=expires_at,
+                    )
+                )
+
+        # 確保し直す（数量が変わった場合も、前回の確保を置き換える）
+        StockHold.objects.filter(session_key=session_key).delete()
+        StockHold.objects.bulk_create(holds)
+
+    return shortages
+
+
+def release_holds(session_key: str) -> None:
+    """カートの確保をすべて解除する（注文確定後に呼ぶ）。"""
+    StockHold.objects.filter(session_key=session_key).delete()
+
+
+def sweep_expired_holds(batch_size: int = 1000) -> int:
+    """
+    有効期限を過ぎた確保を削除し、削除した件数を返す。
+
+    expires_at のインデックスで対象を絞り、batch_size 件ずつ短いトランザクションで削除する。
+    """
+    now = timezone.now()
+    deleted_total = 0
+    while True:
+        ids = list(
+            StockHold.objects.filter(expires_at__lte=now)
+            .order_by("expires_at")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted_total
+        deleted, _ = StockHold.objects.filter(pk__in=ids).delete()
+        deleted_total += deleted
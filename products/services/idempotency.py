@@ -0,0 +1,96 @@
+"""
+注文確定の冪等性キー
+
+購入手続きのフォーム（hidden の idempotency_key）または Idempotency-Key ヘッダーで送られたキーを、
+作成した注文と同じトランザクションで OrderIdempotencyKey に記録する（セッションとキーの組で一意）。
+
+- 同じキーの再送信（二重クリック・通信の再試行・戻るボタンからの再送信）は、
+  カート・在庫・行ロックに触れずに最初の注文の結果を返す
+- 最初の送信が処理中に届いた再送信は、一意制約でキーを記録できないため、
+  作りかけの注文をロールバックしてから最初の注文の結果を返す
+- キーは ORDER_IDEMPOTENCY_TTL 秒で失効し、失効した行は purge_idempotency_keys コマンドで削除する
+"""
+
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpRequest
+from django.utils import timezone
+
+from products.models import Order, OrderIdempotencyKey
+
+MAX_KEY_LENGTH = 64
+
+
+def new_idempotency_key() -> str:
+    """購入手続きのフォームに埋め込むキーを返す。"""
+    return uuid.uuid4().hex
+
+
+def get_idempotency_key(request: HttpRequest) -> str | None:
+    """リクエストの冪等性キーを返す（指定がない・長すぎる場合は None）。"""
+    key = (
+        request.POST.get("idempotency_key")
+        or request.headers.get("Idempotency-Key")
+        or ""
+    ).strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None
+    return key
+
+
+def find_order_id(session_key: str, key: str) -> int | None:
+    """キーで作成済みの注文のIDを返す（未使用・失効済みの場合は None）。"""
+    return (
+        OrderIdempotencyKey.objects.filter(
+            session_key=session_key, key=key, expires_at__gt=timezone.now()
+        )
+        .values_list("order_id", flat=True)
+        .first()
+    )
+
+
+def claim_idempotency_key(session_key: str, key: str, order: Order) -> bool:
+    """
+    注文の作成と同じトランザクションでキーを記録する。
+
+    他の送信が同じキーを記録済み（または記録中）の場合は False を返す。
+    """
+    now = timezone.now()
+    # 失効したキーは、同じ値で記録し直せるようにする
+    OrderIdempotencyKey.objects.filter(
+        session_key=session_key, key=key, expires_at__lte=now
+    ).delete()
+    try:
+        with transaction.atomic():
+            OrderIdempotencyKey.objects.create(
+                session_key=session_key,
+                key=key,
+                order=order,
+                expires_at=now + timedelta(seconds=settings.ORDER_IDEMPOTENCY_TTL),
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def sweep_expired_keys(batch_size: int = 1000) -> int:
+    """
+    有効期限を過ぎたキーを削除し、削除した件数を返す。
+
+    expires_at のインデックスで対象を絞り、batch_size 件ずつ短いトランザクションで削除する。
+    """
+    now = timezone.now()
+    deleted_total = 0
+    while True:
+        ids = list(
+            OrderIdempotencyKey.objects.filter(expires_at__lte=now)
+            .order_by("expires_at")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted_total
+        deleted, _ = OrderIdempotencyKey.objects.filter(pk__in=ids).delete()
+        deleted_total += deleted
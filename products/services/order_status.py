@@ -0,0 +1,178 @@
+"""
+注文のステータスの遷移
+
+ステータスは次の順にだけ進める（キャンセルは発送前まで）。
+
+    未払い → 支払い済み → 発送済み → 配達済み
+    未払い・支払い済み → キャンセル
+
+多数の注文（発送処理で1日数千件など）は、遷移ごと（変更前のステータスごと）に
+「WHERE id IN (...) AND status = 変更前」の条件付き UPDATE 1回でまとめて変更する。
+
+- 条件付きの UPDATE なので、同時に実行しても同じ注文が二重に遷移することはない
+- 実際に変更した注文だけを OrderStatusChange に記録する（1回の bulk_create）
+- 遷移できない・存在しない注文は、注文IDごとのエラーとして返す
+
+キャンセルした注文は、同じトランザクションで注文明細の数量を在庫に戻す。
+
+- 戻すのは実際にキャンセルに遷移した注文の分だけ（同時に実行しても二重に戻らない）
+- 対象の商品は主キーの順に行ロックを取ってから、商品ごとの数量の合計を
+  1回の UPDATE で加算する（チェックアウトと同じ行を触っても、読み込んだ値で上書きしない）
+- 売上の集計済みの注文は、集計値からも差し引く（products.services.rollups を参照）
+- release_promotions=True の場合は、注文でのプロモーションコードの利用を取り消し、
+  コードの利用回数を戻す（products.services.promotions を参照）
+"""
+
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from products.models import Order, OrderItem, OrderStatusChange, Product
+from products.services.promotions import release_redemptions
+from products.services.rollups import subtract_cancelled_orders
+from products.services.stock import set_stock_levels
+
+Status = Order.Status
+
+# 変更前のステータス -> 変更できるステータス
+TRANSITIONS: dict[str, tuple[str, ...]] = {
+    Status.PENDING: (Status.PAID, Status.CANCELLED),
+    Status.PAID: (Status.SHIPPED, Status.CANCELLED),
+    Status.SHIPPED: (Status.DELIVERED,),
+    Status.DELIVERED: (),
+    Status.CANCELLED: (),
+}
+
+
+@dataclass
+class TransitionResult:
+    """ステータスの一括変更の結果"""
+
+    total: int = 0
+    updated: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+    # キャンセルで在庫に戻した数量の合計・未使用に戻したプロモーションコードの数
+    restocked_units: int = 0
+    released_promotions: int = 0
+
+
+def can_transition(current: str, target: str) -> bool:
+    """current から target に変更できるかどうかを返す。"""
+    return target in TRANSITIONS.get(current, ())
+
+
+def transition_orders(
+    order_ids: Iterable[int],
+    target: str,
+    batch_size: int = 1000,
+    release_promotions: bool = False,
+) -> TransitionResult:
+    """注文のステータスを target に変更し、結果を返す（batch_size 件ずつ1トランザクション）。"""
+    if target not in Status.values:
+        raise ValueError(f"不明なステータスです: {target}")
+
+    started = time.perf_counter()
+    ids = list(dict.fromkeys(order_ids))
+    result = TransitionResult(total=len(ids))
+    for start in range(0, len(ids), batch_size):
+        _transition_batch(
+            ids[start : start + batch_size], target, result, release_promotions
+        )
+
+    result.errors.sort(key=lambda error: error[0])
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _transition_batch(
+    ids: list[int], target: str, result: TransitionResult, release_promotions: bool
+) -> None:
+    table = connection.ops.quote_name(Order._meta.db_table)
+    placeholders = ", ".join(["%s"] * len(ids))
+    sql = (
+        f"UPDATE {table} SET status = %s, updated_at = %s "
+        f"WHERE status = %s AND id IN ({placeholders}) RETURNING id"
+    )
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    sources = [source for source, targets in TRANSITIONS.items() if target in targets]
+
+    with transaction.atomic():
+        changes: list[OrderStatusChange] = []
+        with connection.cursor() as cursor:
+            for source in sources:
+                cursor.execute(sql, [target, now, source, *ids])
+                changes.extend(
+                    OrderStatusChange(order_id=pk, from_status=source, to_status=target)
+                    for (pk,) in cursor.fetchall()
+                )
+        OrderStatusChange.objects.bulk_create(changes)
+
+        updated = {change.order_id for change in changes}
+        if target == Status.CANCELLED and updated:
+            result.restocked_units += _restock_cancelled(updated)
+            subtract_cancelled_orders(updated)
+            if release_promotions:
+                result.released_promotions += release_redemptions(updated)
+
+        rejected = [pk for pk in ids if pk not in updated]
+        current = dict(
+            Order.objects.filter(pk__in=rejected).values_list("pk", "status")
+        )
+
+    result.updated += len(updated)
+    target_label = Status(target).label
+    for pk in rejected:
+        if pk not in current:
+            result.errors.append((pk, "注文が存在しません。"))
+        else:
+            result.errors.append(
+                (
+                    pk,
+                    f"ステータスが「{Status(current[pk]).label}」の注文は"
+                    f"「{target_label}」にできません。",
+                )
+            )
+
+
+def _restock_cancelled(order_ids: set[int]) -> int:
+    """キャンセルした注文の数量を在庫に戻し、戻した数量の合計を返す。"""
+    quantities = dict(
+        OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+        .values("product_id")
+        .annotate(quantity=Sum("quantity"))
+        .values_list("product_id", "quantity")
+    )
+    if not quantities:
+        return 0
+
+    # 注文確定と同じく、商品の行ロックは主キーの順に取る（holds.lock_available_products を参照）
+    list(
+        Product.objects.filter(pk__in=list(quantities))
+        .order_by("pk")
+        .select_for_update()
+        .values_list("pk", flat=True)
+    )
+
+    product_table = connection.ops.quote_name(Product._meta.db_table)
+    item_table = connection.ops.quote_name(OrderItem._meta.db_table)
+    placeholders = ", ".join(["%s"] * len(order_ids))
+    sql = (
+        f"UPDATE {product_table} SET stock = {product_table}.stock + r.quantity "
+        f"FROM (SELECT product_id, SUM(quantity) AS quantity FROM {item_table} "
+        f"WHERE order_id IN ({placeholders}) AND product_id IS NOT NULL "
+        f"GROUP BY product_id) AS r "
+        f"WHERE {product_table}.id = r.product_id "
+        f"RETURNING {product_table}.id, {product_table}.stock"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(order_ids))
+        stock_levels = dict(cursor.fetchall())
+
+    # 在庫数のキャッシュも戻した後の値にする（write-through）
+    transaction.on_commit(lambda: set_stock_levels(stock_levels))
+    return sum(quantities[pk] for pk in stock_levels)
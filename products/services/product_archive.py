@@ -0,0 +1,58 @@
+"""
+商品の削除（アーカイブ）と、削除済みの商品に残ったカートの明細の掃除
+
+商品の行を DELETE すると、CASCADE でその商品を入れた全カートの明細・在庫の確保が削除され、
+注文明細の商品への参照も NULL に更新される。人気の商品ほど1つのトランザクションで
+触る行が多くなり、その間チェックアウト中の行ロックと競合する。
+
+- 削除は商品の行に deleted_at を記録するだけの UPDATE にする（注文履歴の参照も残る）
+- 削除済みの商品はカート・チェックアウト・一覧の読み込みで除外する（Product.objects.live()）
+- カートの明細・在庫の確保は purge_archived_products コマンドが batch_size 件ずつ短い
+  トランザクションで削除する
+"""
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from products.models import CartItem, Product, StockHold
+from products.services.stock import invalidate_stock_levels
+
+
+def archive_products(queryset: QuerySet[Product]) -> int:
+    """商品を削除済みにし、件数を返す（すでに削除済みの商品は数えない）。"""
+    queryset = queryset.order_by().live()
+    now = timezone.now()
+
+    with transaction.atomic():
+        ids = list(queryset.values_list("pk", flat=True))
+        count = queryset.update(deleted_at=now, updated_at=now)
+        transaction.on_commit(lambda: invalidate_stock_levels(ids))
+    return count
+
+
+def purge_archived_cart_rows(batch_size: int = 1000) -> tuple[int, int]:
+    """
+    削除済みの商品に残ったカートの明細・在庫の確保を削除し、(明細数, 確保数) を返す。
+
+    batch_size 件ずつ別のトランザクションで削除するため、1回のロックは短く済む。
+    """
+    return (
+        _delete_in_batches(CartItem, batch_size),
+        _delete_in_batches(StockHold, batch_size),
+    )
+
+
+def _delete_in_batches(model, batch_size: int) -> int:
+    archived = Product.objects.archived().values("pk")
+    deleted_total = 0
+    while True:
+        ids = list(
+            model.objects.filter(product__in=archived).values_list("pk", flat=True)[
+                :batch_size
+            ]
+        )
+        if not ids:
+            return deleted_total
+        deleted, _ = model.objects.filter(pk__in=ids).delete()
+        deleted_total += deleted
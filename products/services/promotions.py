@@ -0,0 +1,85 @@
+"""
+プロモーションコードの利用回数
+
+キャンペーン用に多くの注文で使えるコードのため、コードごとに利用上限（usage_limit）と
+利用回数（times_used）を持つ（従来の1回限りのコードは usage_limit=1）。
+
+- 注文確定ではコードの行を select_for_update でロックしない。利用回数は
+  「times_used < usage_limit」を条件にした1回の UPDATE で加算し、上限に達していれば加算しない
+  （同時に使われても上限を超えない）
+- UPDATE が取る行ロックはコミットまで続くため、注文確定のトランザクションの最後の方で加算する
+  （人気のコードでも、同じコードを使う注文同士が待つのはコミットまでの短い間だけ）
+- 利用は注文ごとに PromotionRedemption に記録する
+- is_used は「利用上限に達した」を表し、同じ UPDATE で更新する
+  （未使用のコードを is_used=False で絞り込む箇所は、そのまま利用可能なコードの絞り込みになる）
+"""
+
+from django.db import connection
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from products.models import Order, PromotionCode, PromotionRedemption
+
+
+def redeem_promotion(promotion: PromotionCode, order: Order) -> bool:
+    """
+    コードの利用回数を1加算して利用を記録する（注文と同じトランザクションで呼ぶ）。
+
+    利用上限に達していた場合は何もせずに False を返す。
+    """
+    updated = PromotionCode.objects.filter(
+        pk=promotion.pk, times_used__lt=F("usage_limit")
+    ).update(
+        times_used=F("times_used") + 1,
+        # SET の右辺の times_used は加算前の値
+        is_used=Case(
+            When(times_used__gte=F("usage_limit") - 1, then=Value(True)),
+            default=Value(False),
+        ),
+        used_at=timezone.now(),
+    )
+    if not updated:
+        return False
+
+    PromotionRedemption.objects.create(promotion=promotion, order=order)
+    return True
+
+
+def refresh_exhausted(promotion_id: int) -> None:
+    """利用上限の変更に合わせて、使用済み（is_used）を判定し直す。"""
+    PromotionCode.objects.filter(pk=promotion_id).update(
+        is_used=Case(
+            When(times_used__gte=F("usage_limit"), then=Value(True)),
+            default=Value(False),
+        )
+    )
+
+
+def release_redemptions(order_ids: set[int]) -> int:
+    """
+    注文の利用の記録を削除し、その分だけコードの利用回数を戻す。
+
+    利用回数を戻したコードの数を返す（コードごとの件数を1回の UPDATE でまとめて戻す）。
+    """
+    if not order_ids:
+        return 0
+
+    promotion_table = connection.ops.quote_name(PromotionCode._meta.db_table)
+    redemption_table = connection.ops.quote_name(PromotionRedemption._meta.db_table)
+    placeholders = ", ".join(["%s"] * len(order_ids))
+    sql = (
+        f"UPDATE {promotion_table} SET "
+        f"times_used = {promotion_table}.times_used - r.released, is_used = %s, "
+        f"used_at = CASE WHEN {promotion_table}.times_used = r.released THEN NULL "
+        f"ELSE {promotion_table}.used_at END "
+        f"FROM (SELECT promotion_id, COUNT(*) AS released FROM {redemption_table} "
+        f"WHERE order_id IN ({placeholders}) GROUP BY promotion_id) AS r "
+        f"WHERE {promotion_table}.id = r.promotion_id "
+        f"RETURNING {promotion_table}.id"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [False, *order_ids])
+        released = len(cursor.fetchall())
+
+    PromotionRedemption.objects.filter(order_id__in=order_ids).delete()
+    return released
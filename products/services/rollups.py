@@ -0,0 +1,183 @@
+"""
+売上の集計テーブル（日別・商品別）の差分更新
+
+注文・注文明細の全件を毎回集計せず、前回処理した注文ID（SalesRollupWatermark）より
+後の注文だけを集計して DailySalesRollup / ProductSalesRollup に加算する。
+
+- 集計値の加算と処理済みの位置の更新は同じトランザクションで行うため、
+  途中で失敗しても再実行すれば二重に加算されない（冪等）
+- 処理済みの位置の行をロックするため、同時に実行しても直列に処理される
+- 注文IDの採番とコミットの順序は前後し得るため、作成から settle_seconds 秒が
+  経過した注文だけを集計する（それより長く未コミットの注文は集計から漏れる）
+- キャンセルした注文は集計しない。集計済みの注文をキャンセルした場合は、
+  キャンセルと同じトランザクションで subtract_cancelled_orders を呼び、集計値から差し引く
+  （処理済みの位置の行をロックして判定するため、集計と同時に実行しても二重に差し引かない）
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from products.models import (
+    DailySalesRollup,
+    Order,
+    OrderItem,
+    ProductSalesRollup,
+    SalesRollupWatermark,
+)
+
+WATERMARK_NAME = "sales"
+# 集計に使う注文の項目
+ORDER_FIELDS = ("pk", "created_at", "total_amount", "promotion_discount_amount")
+
+
+def rollup_new_orders(batch_size: int = 1000, settle_seconds: int = 60) -> int:
+    """未集計の注文を batch_size 件ずつ集計テーブルに加算し、処理した注文数を返す。"""
+    processed = 0
+    while True:
+        count = _rollup_batch(batch_size, settle_seconds)
+        if not count:
+            return processed
+        processed += count
+
+
+def _rollup_batch(batch_size: int, settle_seconds: int) -> int:
+    """未集計の注文を最大 batch_size 件集計し、処理した注文数を返す。"""
+    cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+
+    with transaction.atomic():
+        watermark, _ = SalesRollupWatermark.objects.select_for_update().get_or_create(
+            name=WATERMARK_NAME
+        )
+        orders = list(
+            Order.objects.filter(pk__gt=watermark.last_order_id, created_at__lte=cutoff)
+            .order_by("pk")
+            .values(*ORDER_FIELDS, "status")[:batch_size]
+        )
+        if not orders:
+            return 0
+        order_ids = [order["pk"] for order in orders]
+
+        _apply_orders(
+            [order for order in orders if order["status"] != Order.Status.CANCELLED],
+            sign=1,
+        )
+
+        watermark.last_order_id = order_ids[-1]
+        watermark.save(update_fields=["last_order_id", "updated_at"])
+
+    return len(orders)
+
+
+def subtract_cancelled_orders(order_ids: set[int]) -> int:
+    """
+    キャンセルした注文のうち集計済みの分を集計値から差し引き、差し引いた注文数を返す。
+
+    キャンセルのステータス変更と同じトランザクションで呼ぶ。
+    """
+    watermark = (
+        SalesRollupWatermark.objects.select_for_update()
+        .filter(name=WATERMARK_NAME)
+        .first()
+    )
+    if watermark is None:
+        return 0
+
+    orders = list(
+        Order.objects.filter(pk__in=order_ids, pk__lte=watermark.last_order_id).values(
+            *ORDER_FIELDS
+        )
+    )
+    _apply_orders(orders, sign=-1)
+    return len(orders)
+
+
+def _apply_orders(orders: list[dict], sign: int) -> None:
+    """注文の売上を集計テーブルに加算する（sign=-1 の場合は差し引く）。"""
+    if not orders:
+        return
+
+    order_ids = [order["pk"] for order in orders]
+    units_by_order = dict(
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values("order_id")
+        .annotate(units=Sum("quantity"))
+        .values_list("order_id", "units")
+    )
+    _add_daily(orders, units_by_order, sign)
+    _add_products(
+        OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+        .values("product_id")
+        .annotate(
+            orders=Count("order_id", distinct=True),
+            units=Sum("quantity"),
+            revenue=Sum(F("price") * F("quantity")),
+        ),
+        sign,
+    )
+
+
+def _add_daily(orders: list[dict], units_by_order: dict[int, int], sign: int) -> None:
+    """注文を日付（ローカル時刻）ごとにまとめ、日別の集計に加算する。"""
+    deltas: dict = defaultdict(lambda: defaultdict(int))
+    for order in orders:
+        delta = deltas[timezone.localdate(order["created_at"])]
+        delta["order_count"] += sign
+        delta["units_sold"] += sign * units_by_order.get(order["pk"], 0)
+        delta["revenue"] += sign * order["total_amount"]
+        if order["promotion_discount_amount"]:
+            delta["discount_total"] += sign * order["promotion_discount_amount"]
+            delta["promotion_redemptions"] += sign
+
+    # 既存の値に差分を足した値で upsert する（処理済みの位置のロックで直列化済み）
+    existing = DailySalesRollup.objects.in_bulk(list(deltas), field_name="date")
+    rows = []
+    for date, delta in deltas.items():
+        row = DailySalesRollup(date=date)
+        for field, value in delta.items():
+            current = getattr(existing[date], field) if date in existing else 0
+            setattr(row, field, current + value)
+        rows.append(row)
+
+    DailySalesRollup.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["date"],
+        update_fields=[
+            "order_count",
+            "units_sold",
+            "revenue",
+            "discount_total",
+            "promotion_redemptions",
+        ],
+    )
+
+
+def _add_products(product_totals, sign: int) -> None:
+    """商品ごとの販売数・売上を、商品別の集計に加算する。"""
+    totals = {row["product_id"]: row for row in product_totals}
+    if not totals:
+        return
+
+    existing = ProductSalesRollup.objects.in_bulk(list(totals), field_name="product_id")
+    rows = []
+    for product_id, total in totals.items():
+        current = existing.get(product_id) or ProductSalesRollup()
+        rows.append(
+            ProductSalesRollup(
+                product_id=product_id,
+                order_count=current.order_count + sign * total["orders"],
+                units_sold=current.units_sold + sign * total["units"],
+                revenue=current.revenue + sign * total["revenue"],
+            )
+        )
+
+    ProductSalesRollup.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=["order_count", "units_sold", "revenue"],
+    )
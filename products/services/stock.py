@@ -0,0 +1,85 @@
+"""
+在庫数のキャッシュ
+
+カートバッジのように、商品の行そのものは不要で在庫の有無だけを見る処理のために、
+商品IDごとの在庫数を Django のキャッシュに保持する。
+
+- キャッシュの有効期限（STOCK_CACHE_TIMEOUT 秒）が古さの上限になる
+- 注文確定・商品管理画面での保存時に、DB と同じ値をキャッシュへ書き込む（write-through）
+- 在庫の最終的な判定は、これまでどおり注文確定時の行ロック（select_for_update）で行う
+"""
+
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+
+from products.models import Product
+
+
+def _key(product_id: int) -> str:
+    return f"stock:{product_id}"
+
+
+def set_stock_levels(levels: dict[int, int]) -> None:
+    """商品IDごとの在庫数をキャッシュに書き込む。"""
+    if levels:
+        cache.set_many(
+            {_key(pk): stock for pk, stock in levels.items()},
+            timeout=settings.STOCK_CACHE_TIMEOUT,
+        )
+
+
+def invalidate_stock_levels(product_ids: Iterable[int]) -> None:
+    """商品のキャッシュを削除する（商品の削除時など）。"""
+    cache.delete_many([_key(pk) for pk in product_ids])
+
+
+def get_stock_levels(product_ids: Iterable[int]) -> dict[int, int]:
+    """
+    商品IDごとの在庫数を返す。
+
+    キャッシュにない商品は DB から1クエリでまとめて読み込み、キャッシュに書き込む。
+    存在しない（削除済みを含む）商品は結果に含まれない。
+    """
+    ids = set(product_ids)
+    if not ids:
+        return {}
+
+    cached = cache.get_many([_key(pk) for pk in ids])
+    levels = {pk: cached[_key(pk)] for pk in ids if _key(pk) in cached}
+
+    missing = ids - levels.keys()
+    if missing:
+        loaded = dict(
+            Product.objects.live().filter(pk__in=missing).values_list("id", "stock")
+        )
+        set_stock_levels(loaded)
+        levels.update(loaded)
+    return levels
+
+
+async def aget_stock_levels(product_ids: Iterable[int]) -> dict[int, int]:
+    """`get_stock_levels` の非同期版。"""
+    ids = set(product_ids)
+    if not ids:
+        return {}
+
+    cached = await cache.aget_many([_key(pk) for pk in ids])
+    levels = {pk: cached[_key(pk)] for pk in ids if _key(pk) in cached}
+
+    missing = ids - levels.keys()
+    if missing:
+        loaded = {
+            pk: stock
+            async for pk, stock in Product.objects.live()
+            .filter(pk__in=missing)
+            .values_list("id", "stock")
+        }
+        if loaded:
+            await cache.aset_many(
+                {_key(pk): stock for pk, stock in loaded.items()},
+                timeout=settings.STOCK_CACHE_TIMEOUT,
+            )
+        levels.update(loaded)
+    return levels
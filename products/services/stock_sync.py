@@ -0,0 +1,174 @@
+"""
+倉庫からの在庫数の一括反映
+
+{sku, stock} （在庫数をその値にする）または {sku, delta} （在庫数に加減する）の行を、
+batch_size 行ごとに1回の UPDATE でまとめて反映する。
+
+- stock 列だけを更新する（ProductForm での保存と違い、他の列や updated_at は変えない）
+- delta は DB 上で「現在の在庫数 + delta」として計算するため、注文確定の行ロックと
+  同時に実行されても、読み込んだ値で上書きして在庫数が戻ることはない
+- 品番が存在しない行と、delta で在庫数が負になる行は更新せず、行ごとのエラーとして返す
+- UPDATE の前に、対象の商品の行ロックを主キーの順に取る（注文確定・キャンセル時の
+  在庫の戻しと同じ順序にし、同時に実行してもデッドロックしないようにする）
+"""
+
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from django.db import connection, transaction
+
+from products.models import Product
+from products.services.stock import set_stock_levels
+
+
+@dataclass
+class StockAdjustment:
+    """在庫数の変更1行分（line は行番号・配列の位置など、エラーの表示用）"""
+
+    line: int
+    sku: str
+    mode: str  # "stock"（在庫数を指定） / "delta"（在庫数に加減）
+    value: int
+
+
+@dataclass
+class StockSyncResult:
+    """在庫数の一括反映の結果"""
+
+    total_rows: int = 0
+    updated: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total_rows / self.elapsed if self.elapsed else 0.0
+
+
+def parse_adjustment(line: int, row) -> tuple[StockAdjustment | None, str | None]:
+    """1行を検証し、(在庫数の変更, エラーメッセージ) を返す。"""
+    if not isinstance(row, dict):
+        return None, "sku と stock または delta を持つオブジェクトを指定してください。"
+
+    sku = str(row.get("sku") or "").strip()
+    if not sku:
+        return None, "sku を指定してください。"
+
+    # CSV では使わない方の列が空欄になるため、空の値は指定なしとして扱う
+    values = {
+        mode: row[mode]
+        for mode in ("stock", "delta")
+        if row.get(mode) not in (None, "")
+    }
+    if len(values) != 1:
+        return None, f"{sku}: stock と delta のどちらか一方を指定してください。"
+    ((mode, raw),) = values.items()
+
+    try:
+        value = int(raw)
+    except (TypeError, ValueError):
+        return None, f"{sku}: {mode} は整数で指定してください。"
+    if mode == "stock" and value < 0:
+        return None, f"{sku}: stock は0以上で指定してください。"
+
+    return StockAdjustment(line=line, sku=sku, mode=mode, value=value), None
+
+
+def sync_stock(
+    rows: Iterable[tuple[int, object]], batch_size: int = 5000
+) -> StockSyncResult:
+    """(行番号, 行) を batch_size 行ずつ検証・反映し、結果を返す。"""
+    started = time.perf_counter()
+    result = StockSyncResult()
+    batch: dict[str, StockAdjustment] = {}
+
+    for line, row in rows:
+        result.total_rows += 1
+        adjustment, error = parse_adjustment(line, row)
+        if error is None and adjustment.sku in batch:
+            error = f"{adjustment.sku}: 同じ品番が同じバッチ内で重複しています。"
+        if error is not None:
+            result.errors.append((line, error))
+            continue
+
+        batch[adjustment.sku] = adjustment
+        if len(batch) >= batch_size:
+            _apply_into(result, list(batch.values()))
+            batch = {}
+
+    if batch:
+        _apply_into(result, list(batch.values()))
+
+    # 検証エラーと反映時のエラーを行番号順に並べる
+    result.errors.sort(key=lambda error: error[0])
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def _apply_into(result: StockSyncResult, adjustments: list[StockAdjustment]) -> None:
+    updated, errors = apply_stock_adjustments(adjustments)
+    result.updated += updated
+    result.errors.extend(errors)
+
+
+def apply_stock_adjustments(
+    adjustments: list[StockAdjustment],
+) -> tuple[int, list[tuple[int, str]]]:
+    """
+    在庫数の変更を1回の UPDATE で反映し、(更新した件数, 行ごとのエラー) を返す。
+
+    品番の重複は呼び出し側で除いておくこと（同じ行に2回 JOIN されるため）。
+    """
+    table = connection.ops.quote_name(Product._meta.db_table)
+    # VALUES の列名は SQLite / PostgreSQL ともに column1, column2, ... になる
+    values = ", ".join(["(%s, %s, CAST(%s AS INTEGER))"] * len(adjustments))
+    sql = (
+        f"UPDATE {table} SET stock = CASE WHEN v.column2 = 'stock' THEN v.column3 "
+        f"ELSE {table}.stock + v.column3 END "
+        f"FROM (VALUES {values}) AS v "
+        f"WHERE {table}.sku = v.column1 "
+        f"AND (v.column2 = 'stock' OR {table}.stock + v.column3 >= 0) "
+        f"RETURNING {table}.id, {table}.sku, {table}.stock"
+    )
+    params = [p for a in adjustments for p in (a.sku, a.mode, a.value)]
+
+    with transaction.atomic():
+        # UPDATE ... FROM がロックを取る順序は実行計画しだいのため、先に主キーの順でロックする
+        list(
+            Product.objects.filter(sku__in=[a.sku for a in adjustments])
+            .select_for_update()
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            returned = cursor.fetchall()
+
+        updated_skus = {sku for _, sku, _ in returned}
+        rejected = [a for a in adjustments if a.sku not in updated_skus]
+        # 更新されなかった行は、品番が存在するかどうかで理由を分ける
+        existing = set()
+        if rejected:
+            existing = set(
+                Product.objects.filter(sku__in=[a.sku for a in rejected]).values_list(
+                    "sku", flat=True
+                )
+            )
+
+        # 在庫数のキャッシュも更新後の値にする（write-through）
+        stock_levels = {pk: stock for pk, _, stock in returned}
+        transaction.on_commit(lambda: set_stock_levels(stock_levels))
+
+    errors = [
+        (
+            a.line,
+            (
+                f"{a.sku}: 在庫数が負になるため反映できません（delta {a.value}）。"
+                if a.sku in existing
+                else f"{a.sku}: 品番が存在しません。"
+            ),
+        )
+        for a in rejected
+    ]
+    return len(returned), errors
@@ -0,0 +1,28 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+_TAG_FORMATS = {
+    ".css": '<link rel="stylesheet" href="{}">',
+    ".js": '<script src="{}" defer></script>',
+}
+
+
+@register.simple_tag
+def bundle(name: str) -> str:
+    """
+    STATIC_BUNDLES のバンドルを読み込む link / script タグを出力する。
+
+    DEBUG 時は collectstatic なしで確認できるよう、結合前のファイルを個別に出力する。
+    """
+    tag_format = _TAG_FORMATS[name[name.rfind(".") :]]
+    if not settings.DEBUG:
+        return format_html(tag_format, static(name))
+    return format_html_join(
+        "\n",
+        tag_format,
+        ((static(source),) for source in settings.STATIC_BUNDLES[name]),
+    )
@@ -1,3 +1,2457 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+import brotli
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+from django.http import Http404, HttpResponse
+from django.template import Context, Template, engines
+from django.template.backends.django import Template as DjangoTemplate
+from django.test import (
+    AsyncRequestFactory,
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from config.db_router import ReplicaRouter, replica_reads
+from config.decorators import read_from_replica
+from config.middleware import (
+    RequestTimingMiddleware,
+    collect_metrics,
+    normalize_sql,
+)
+
+from . import async_views
+from .forms import ProductForm
+from .management.commands.checkout_benchmark import Command as BenchmarkCommand
+from .models import (
+    Cart,
+    CartItem,
+    DailySalesRollup,
+    Order,
+    OrderIdempotencyKey,
+    OrderItem,
+    OrderStatusChange,
+    Product,
+    ProductSalesRollup,
+    PromotionCode,
+    PromotionRedemption,
+    StockHold,
+)
+from .services.admission import AdmissionController, get_admission_controller
+from .services.cart import (
+    CartStore,
+    InMemoryKeyValueClient,
+    KeyValueCartStore,
+    add_cart_item,
+    get_badge_quantity,
+    get_cart_store,
+)
+from .services.holds import get_available_stock
+from .services.order_status import transition_orders
+from .services.product_archive import archive_products
+from .services.promotions import refresh_exhausted
+from .services.rollups import rollup_new_orders
+from .services.stock import get_stock_levels
+from .services.stock_sync import StockAdjustment, apply_stock_adjustments
+
+# collectstatic 前でもテンプレートの {% static %} が使えるようにする
+TEST_STATICFILES_STORAGE = "django.contrib.staticfiles.storage.StaticFilesStorage"
+
+BASIC_AUTH_USERS = {"admin": "secret"}
+# "admin:secret" を base64 エンコードした値
+BASIC_AUTH_HEADER = "Basic YWRtaW46c2VjcmV0"
+
+# テスト用の SQLite（インメモリ・共有キャッシュ）はロックを待たずにエラーにするため、
+# 複数スレッドから同時に書き込むテストは PostgreSQL でのみ実行する
+SQLITE_CONCURRENCY_SKIP_REASON = "SQLite のテスト用DBは同時書き込みに対応していないため"
+
+ORDER_FORM_DATA = {
+    "name": "山田 太郎",
+    "phone": "090-1234-5678",
+    "email": "taro@example.com",
+    "postal_code": "123-4567",
+    "prefecture": "東京都",
+    "city": "千代田区",
+    "street": "1-1-1",
+    "card_number": "4111 1111 1111 1111",
+    "card_expire": "12/99",
+    "card_cvv": "123",
+    "card_holder": "taro yamada",
+}
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE,
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    BASIC_AUTH_USERS=BASIC_AUTH_USERS,
+)
+class ViewQueryBudgetTests(TestCase):
+    """
+    products/urls.py の全ビューをクエリ数・処理時間の予算内で実行するテスト。
+
+    - 商品1,000件 / カート50明細 / 注文10,000件の規模でデータを用意する
+    - クエリ数が予算を超えた場合（N+1 の混入など）はテストを失敗させる
+    - 同じ形のSQLが繰り返し発行された場合も、発行元とあわせてテストを失敗させる
+    - 処理時間はCI環境の揺れを考慮した緩めのしきい値でチェックする
+    - テスト終了時に、ビューごとのクエリ数と処理時間を一覧で出力する
+    """
+
+    PRODUCT_COUNT = 1000
+    CART_LINE_COUNT = 50
+    ORDER_COUNT = 10000
+
+    # ビューごとの処理時間のしきい値（秒）
+    DEFAULT_TIME_BUDGET = 2.0
+
+    report: dict[str, tuple[int, float]] = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create(
+            Product(
+                sku=f"SKU-{i:05d}",
+                name=f"テスト商品{i}",
+                price=1000 + i,
+                stock=100,
+            )
+            for i in range(cls.PRODUCT_COUNT)
+        )
+        cls.products = list(Product.objects.order_by("id"))
+
+        cls.promotions = PromotionCode.objects.bulk_create(
+            PromotionCode(code=f"USED{i:03d}", discount_amount=500, is_used=True)
+            for i in range(10)
+        )
+        cls.promotion = PromotionCode.objects.create(
+            code="PROMO01", discount_amount=300
+        )
+
+        # 10件に1件はプロモーションコード付きの注文にする
+        Order.objects.bulk_create(
+            (
+                Order(
+                    name=f"購入者{i}",
+                    phone="09012345678",
+                    email=f"buyer{i}@example.com",
+                    postal_code="1234567",
+                    address="東京都千代田区1-1-1",
+                    total_amount=5000,
+                    card_number="4111111111111111",
+                    card_expire="12/99",
+                    card_cvv="123",
+                    card_holder="TARO YAMADA",
+                    promotion_code=(
+                        cls.promotions[i // 10 % 10] if i % 10 == 0 else None
+                    ),
+                    promotion_discount_amount=500 if i % 10 == 0 else None,
+                )
+                for i in range(cls.ORDER_COUNT)
+            ),
+            batch_size=1000,
+        )
+        cls.order = Order.objects.order_by("id").first()
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=cls.order,
+                product=product,
+                product_name=product.name,
+                price=product.price,
+                quantity=1,
+            )
+            for product in cls.products[: cls.CART_LINE_COUNT]
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if not cls.report:
+            return
+        lines = ["", "ビュー別クエリ数・処理時間:"]
+        for name, (query_count, elapsed) in sorted(cls.report.items()):
+            lines.append(
+                f"  {name:<28} {query_count:>4} queries {elapsed * 1000:>9.1f} ms"
+            )
+        sys.stderr.write("\n".join(lines) + "\n")
+
+    def setUp(self):
+        # セッションを発行し、50明細のカートを用意する
+        session = self.client.session
+        session.save()
+        self.cart = Cart.objects.create(session_key=session.session_key)
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, product=product, quantity=2)
+            for product in self.products[: self.CART_LINE_COUNT]
+        )
+        self.cart_item = self.cart.items.order_by("id").first()
+
+        # 在庫数のキャッシュは、運用時と同じく温まった状態で計測する
+        cache.clear()
+        get_stock_levels(
+            product.id for product in self.products[: self.CART_LINE_COUNT]
+        )
+
+    def assertWithinBudget(
+        self,
+        name: str,
+        max_queries: int,
+        func,
+        max_seconds: float | None = None,
+    ):
+        """func を実行し、クエリ数と処理時間が予算内であることを検証する。"""
+        if max_seconds is None:
+            max_seconds = self.DEFAULT_TIME_BUDGET
+
+        with CaptureQueriesContext(connection) as ctx, collect_metrics() as metrics:
+            started = time.perf_counter()
+            response = func()
+            elapsed = time.perf_counter() - started
+
+        query_count = len(ctx.captured_queries)
+        self.report[name] = (query_count, elapsed)
+
+        self.assertLessEqual(
+            query_count,
+            max_queries,
+            f"{name}: クエリ数が予算を超えました（{query_count} > {max_queries}）\n"
+            + "\n".join(q["sql"] for q in ctx.captured_queries),
+        )
+        self.assertEqual(
+            metrics.repeated_queries(),
+            [],
+            f"{name}: 同じ形のSQLが繰り返し発行されています（N+1 の疑い）",
+        )
+        self.assertLessEqual(
+            elapsed,
+            max_seconds,
+            f"{name}: 処理時間がしきい値を超えました（{elapsed:.3f}s > {max_seconds}s）",
+        )
+        return response
+
+    def test_product_list(self):
+        response = self.assertWithinBudget(
+            "product_list",
+            2,
+            lambda: self.client.get(reverse("products:product_list")),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_detail(self):
+        response = self.assertWithinBudget(
+            "product_detail",
+            3,
+            lambda: self.client.get(
+                reverse("products:product_detail", args=[self.products[0].pk])
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_manage_product_list(self):
+        response = self.assertWithinBudget(
+            "manage_product_list",
+            3,
+            lambda: self.client.get(
+                reverse("products:manage_product_list"),
+                HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_manage_product_create(self):
+        response = self.assertWithinBudget(
+            "manage_product_create",
+            1,
+            lambda: self.client.get(
+                reverse("products:manage_product_create"),
+                HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_manage_product_edit(self):
+        response = self.assertWithinBudget(
+            "manage_product_edit",
+            2,
+            lambda: self.client.get(
+                reverse("products:manage_product_edit", args=[self.products[0].pk]),
+                HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_manage_product_delete(self):
+        response = self.assertWithinBudget(
+            "manage_product_delete",
+            2,
+            lambda: self.client.get(
+                reverse("products:manage_product_delete", args=[self.products[0].pk]),
+                HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_manage_order_list(self):
+        # 注文10,000件でも、1ページ分（MANAGE_ORDERS_PER_PAGE 件）だけを取得・描画する
+        response = self.assertWithinBudget(
+            "manage_order_list",
+            3,
+            lambda: self.client.get(
+                reverse("products:manage_order_list"),
+                {"page": 100},
+                HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+        page = response.context["page"]
+        self.assertEqual(page.paginator.count, self.ORDER_COUNT)
+        self.assertEqual(len(page.object_list), settings.MANAGE_ORDERS_PER_PAGE)
+
+    def test_manage_order_detail(self):
+        response = self.assertWithinBudget(
+            "manage_order_detail",
+            6,
+            lambda: self.client.get(
+                reverse("products:manage_order_detail", args=[self.order.pk]),
+                HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_cart_detail(self):
+        response = self.assertWithinBudget(
+            "cart_detail",
+            2,
+            lambda: self.client.get(reverse("products:cart_detail")),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["items"]), self.CART_LINE_COUNT)
+
+    def test_add_to_cart(self):
+        product = self.products[self.CART_LINE_COUNT]
+        response = self.assertWithinBudget(
+            "add_to_cart",
+            3,
+            lambda: self.client.post(
+                reverse("products:add_to_cart", args=[product.pk]),
+                {"quantity": 1},
+            ),
+        )
+        self.assertRedirects(
+            response, reverse("products:cart_detail"), fetch_redirect_response=False
+        )
+        self.assertTrue(self.cart.items.filter(product=product).exists())
+
+    def test_cart_item_update(self):
+        response = self.assertWithinBudget(
+            "cart_item_update",
+            4,
+            lambda: self.client.post(
+                reverse("products:cart_item_update", args=[self.cart_item.pk]),
+                {"quantity": 3},
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["ok"])
+
+    def test_cart_item_delete(self):
+        response = self.assertWithinBudget(
+            "cart_item_delete",
+            3,
+            lambda: self.client.post(
+                reverse("products:cart_item_delete", args=[self.cart_item.pk]),
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["total_quantity"], (self.CART_LINE_COUNT - 1) * 2
+        )
+
+    def test_cart_promotion_apply(self):
+        response = self.assertWithinBudget(
+            "cart_promotion_apply",
+            7,
+            lambda: self.client.post(
+                reverse("products:cart_promotion_apply"),
+                {"promotion_code": self.promotion.code},
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["ok"])
+
+    def test_cart_item_update_delta(self):
+        html_response = self.client.post(
+            reverse("products:cart_item_update", args=[self.cart_item.pk]),
+            {"quantity": 2},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+        )
+        response = self.assertWithinBudget(
+            "cart_item_update (delta)",
+            4,
+            lambda: self.client.post(
+                reverse("products:cart_item_update", args=[self.cart_item.pk]),
+                {"quantity": 3},
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+                HTTP_X_CART_RESPONSE="delta",
+            ),
+        )
+        data = response.json()
+        self.assertEqual(
+            data["item"],
+            {
+                "id": self.cart_item.pk,
+                "quantity": 3,
+                "line_total": self.cart_item.product.price * 3,
+            },
+        )
+        self.assertEqual(data["cart"]["total_quantity"], self.CART_LINE_COUNT * 2 + 1)
+        self.assertEqual(data["cart"]["item_count"], self.CART_LINE_COUNT)
+        self.assertEqual(
+            data["cart"]["payable_total"],
+            sum(p.price * 2 for p in self.products[: self.CART_LINE_COUNT])
+            + self.cart_item.product.price,
+        )
+        # HTML を返さないため、ペイロードは1桁以上小さくなる
+        self.assertLess(len(response.content) * 10, len(html_response.content))
+
+    def test_cart_item_delete_delta(self):
+        response = self.assertWithinBudget(
+            "cart_item_delete (delta)",
+            3,
+            lambda: self.client.post(
+                reverse("products:cart_item_delete", args=[self.cart_item.pk]),
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+                HTTP_X_CART_RESPONSE="delta",
+            ),
+        )
+        data = response.json()
+        self.assertEqual(data["removed_item_id"], self.cart_item.pk)
+        self.assertEqual(data["cart"]["item_count"], self.CART_LINE_COUNT - 1)
+        self.assertEqual(data["cart"]["total_quantity"], (self.CART_LINE_COUNT - 1) * 2)
+
+    def test_cart_promotion_apply_delta(self):
+        response = self.assertWithinBudget(
+            "cart_promotion_apply (delta)",
+            7,
+            lambda: self.client.post(
+                reverse("products:cart_promotion_apply"),
+                {"promotion_code": self.promotion.code},
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+                HTTP_X_CART_RESPONSE="delta",
+            ),
+        )
+        data = response.json()
+        self.assertTrue(data["ok"])
+        self.assertIsNone(data["error"])
+        self.assertEqual(data["cart"]["promotion_code"], "PROMO01")
+        self.assertEqual(data["cart"]["promotion_discount_amount"], 300)
+        self.assertEqual(
+            data["cart"]["payable_total"], data["cart"]["cart_total"] - 300
+        )
+
+        response = self.client.post(
+            reverse("products:cart_promotion_apply"),
+            {"promotion_code": "NOPE"},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            HTTP_X_CART_RESPONSE="delta",
+        )
+        data = response.json()
+        self.assertFalse(data["ok"])
+        self.assertTrue(data["error"])
+
+    def test_cart_promotion_remove(self):
+        response = self.assertWithinBudget(
+            "cart_promotion_remove",
+            2,
+            lambda: self.client.post(
+                reverse("products:cart_promotion_remove"),
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_create(self):
+        response = self.assertWithinBudget(
+            "order_create",
+            # 商品の行ロックと、ロック後の購入可能数の読み直しは別のクエリ
+            17,
+            lambda: self.client.post(reverse("products:order_create"), ORDER_FORM_DATA),
+        )
+        self.assertRedirects(
+            response,
+            reverse("products:order_complete"),
+            fetch_redirect_response=False,
+        )
+        self.assertFalse(Cart.objects.filter(pk=self.cart.pk).exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 98)
+
+    def test_manage_sales_dashboard(self):
+        rollup_new_orders(settle_seconds=0)
+
+        response = self.assertWithinBudget(
+            "manage_sales_dashboard",
+            4,
+            lambda: self.client.get(
+                reverse("products:manage_sales_dashboard"),
+                HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            ),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["period"]["order_count"], self.ORDER_COUNT)
+
+    def test_checkout_hold(self):
+        response = self.assertWithinBudget(
+            "checkout_hold",
+            7,
+            lambda: self.client.post(reverse("products:checkout_hold")),
+        )
+        self.assertEqual(response.json()["ok"], True)
+        self.assertEqual(StockHold.objects.count(), self.CART_LINE_COUNT)
+
+    def test_order_complete(self):
+        session = self.client.session
+        session["last_order_id"] = self.order.pk
+        session.save()
+
+        response = self.assertWithinBudget(
+            "order_complete",
+            8,
+            lambda: self.client.get(reverse("products:order_complete")),
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE,
+    REQUEST_TIMING_ENABLED=True,
+    REQUEST_TIMING_SAMPLE_RATE=1.0,
+)
+class RequestTimingMiddlewareTests(TestCase):
+    """リクエスト計測ミドルウェアのテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(sku="SKU-1", name="テスト商品", price=1000, stock=5)
+
+    def test_server_timing_header_and_log(self):
+        with self.assertLogs("config.middleware", level="INFO") as logs:
+            response = self.client.get(reverse("products:product_list"))
+
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^sql;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["view"], "products:product_list")
+        self.assertGreaterEqual(record["query_count"], 1)
+        self.assertGreater(record["template_ms"], 0)
+        self.assertLessEqual(len(record["slowest_queries"]), 3)
+
+    def test_repeated_query_detection(self):
+        cart = Cart.objects.create(session_key="dummy")
+        for i in range(5):
+            product = Product.objects.create(
+                sku=f"SKU-N{i}", name=f"商品{i}", price=100, stock=1
+            )
+            CartItem.objects.create(cart=cart, product=product)
+
+        with collect_metrics() as metrics:
+            # 明細ごとに商品を取得する典型的な N+1
+            for item in CartItem.objects.filter(cart=cart):
+                item.product.name
+
+        repeated = metrics.repeated_queries()
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0].count, 5)
+        self.assertIn("products/tests.py", repeated[0].location)
+        self.assertIn('WHERE "products_product"."id" = ?', repeated[0].shape)
+
+    def test_template_timing_is_installed_once(self):
+        render = DjangoTemplate.render
+        with collect_metrics() as metrics:
+            engines["django"].from_string("{{ value }}").render({"value": 1})
+        with collect_metrics():
+            pass
+
+        # 計測のたびに render を差し替えない（計測の外では元の render を呼ぶだけ）
+        self.assertIs(DjangoTemplate.render, render)
+        self.assertGreater(metrics.template_time, 0)
+
+    async def test_async_view_counts_queries_from_other_threads(self):
+        def run_query():
+            # 非同期ビューの ORM と同じく、計測を始めたのとは別のスレッド・接続で発行する
+            with connections["default"].cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        async def view(request):
+            await sync_to_async(run_query, thread_sensitive=False)()
+            return HttpResponse("ok")
+
+        middleware = RequestTimingMiddleware(view)
+        with self.assertLogs("config.middleware", level="INFO") as logs:
+            response = await middleware(AsyncRequestFactory().get("/"))
+
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+        self.assertEqual(json.loads(logs.records[0].getMessage())["query_count"], 1)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql(
+                "SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'a''b' LIMIT 21"
+            ),
+            "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?",
+        )
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0.0)
+    def test_not_sampled(self):
+        response = self.client.get(reverse("products:product_list"))
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(REQUEST_TIMING_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse("products:product_list"))
+        self.assertNotIn("Server-Timing", response)
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE, BASIC_AUTH_USERS=BASIC_AUTH_USERS
+)
+class MetricsEndpointTests(TestCase):
+    """メトリクスエンドポイントのテスト。"""
+
+    def test_requires_basic_auth(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 401)
+
+    def test_exposes_commerce_metrics(self):
+        product = Product.objects.create(sku="SKU-1", name="商品", price=100, stock=5)
+        self.client.post(reverse("products:add_to_cart", args=[product.pk]))
+        self.client.post(
+            reverse("products:cart_promotion_apply"), {"promotion_code": "XXXXXXX"}
+        )
+
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION=BASIC_AUTH_HEADER
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('velo_cart_mutations_total{action="add"}', body)
+        self.assertIn('velo_promotion_apply_total{result="failure"}', body)
+        self.assertIn(
+            'velo_http_requests_total{method="POST",status="302",'
+            'view="products:add_to_cart"}',
+            body,
+        )
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATICFILES_STORAGE)
+class AsyncStorefrontViewTests(TestCase):
+    """ASGI 向け非同期ビューのテスト（同期版と同じ結果になることを確認する）。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="非同期テスト商品", price=1200, stock=5
+        )
+        cls.promotion = PromotionCode.objects.create(
+            code="ASYNC01", discount_amount=200
+        )
+
+    def setUp(self):
+        self.session = SessionStore()
+        self.session.create()
+        self.cart = Cart.objects.create(session_key=self.session.session_key)
+        self.item = CartItem.objects.create(
+            cart=self.cart, product=self.product, quantity=1
+        )
+        self.factory = AsyncRequestFactory()
+
+    def _request(self, method: str, path: str, data: dict | None = None):
+        request = getattr(self.factory, method)(
+            path, data or {}, headers={"X-Requested-With": "XMLHttpRequest"}
+        )
+        request.session = SessionStore(self.session.session_key)
+        return request
+
+    async def test_product_list(self):
+        response = await async_views.product_list(self._request("get", "/"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "非同期テスト商品")
+
+    async def test_product_detail_not_found(self):
+        with self.assertRaises(Http404):
+            await async_views.product_detail(self._request("get", "/"), pk=0)
+
+    async def test_cart_item_update(self):
+        request = self._request("post", "/", {"quantity": 3})
+        response = await async_views.cart_item_update(request, item_id=self.item.pk)
+
+        data = json.loads(response.content)
+        self.assertTrue(data["ok"])
+        self.assertEqual(data["total_quantity"], 3)
+        await self.item.arefresh_from_db()
+        self.assertEqual(self.item.quantity, 3)
+
+    async def test_cart_item_delete_delta(self):
+        request = self._request("post", "/")
+        request.META["HTTP_X_CART_RESPONSE"] = "delta"
+        response = await async_views.cart_item_delete(request, item_id=self.item.pk)
+
+        data = json.loads(response.content)
+        self.assertEqual(data["removed_item_id"], self.item.pk)
+        self.assertEqual(data["cart"]["item_count"], 0)
+        self.assertEqual(data["cart"]["payable_total"], 0)
+
+    async def test_cart_item_update_requires_post(self):
+        request = self._request("get", "/")
+        response = await async_views.cart_item_update(request, item_id=self.item.pk)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_cart_promotion_apply_and_detail(self):
+        request = self._request("post", "/", {"promotion_code": "async01"})
+        response = await async_views.cart_promotion_apply(request)
+        self.assertTrue(json.loads(response.content)["ok"])
+        await sync_to_async(request.session.save)()
+
+        response = await async_views.cart_detail(self._request("get", "/"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "ASYNC01")
+        self.assertContains(response, "￥1,000")
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATICFILES_STORAGE)
+class ResponseCompressionMiddlewareTests(TestCase):
+    """JSON・HTML断片のレスポンス圧縮のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="圧縮テスト商品", price=1000, stock=5
+        )
+
+    def setUp(self):
+        self.client.post(reverse("products:add_to_cart", args=[self.product.pk]))
+        self.item = CartItem.objects.get()
+
+    def _update(self, accept_encoding: str, **extra):
+        return self.client.post(
+            reverse("products:cart_item_update", args=[self.item.pk]),
+            {"quantity": 2},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            HTTP_ACCEPT_ENCODING=accept_encoding,
+            **extra,
+        )
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_SIZE=1)
+    def test_brotli_preferred(self):
+        response = self._update("gzip, deflate, br", HTTP_X_CART_RESPONSE="delta")
+
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        data = json.loads(brotli.decompress(response.content))
+        self.assertTrue(data["ok"])
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+
+    def test_json_with_csrf_token_is_not_compressed_with_brotli(self):
+        response = self._update("gzip, deflate, br")
+
+        # カートのサマリー（HTML 断片）にフォームの CSRF トークンが含まれる
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(response.content))
+        self.assertIn("csrfmiddlewaretoken", data["html"])
+
+    def test_html_is_not_compressed_with_brotli(self):
+        response = self.client.get(
+            reverse("products:cart_detail"), HTTP_ACCEPT_ENCODING="gzip, deflate, br"
+        )
+
+        # CSRF トークンを含む HTML は、BREACH 対策のランダムなバイトを付与する gzip で返す
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn(b"csrfmiddlewaretoken", gzip.decompress(response.content))
+
+    def test_gzip(self):
+        response = self._update("gzip, br;q=0")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data["total_quantity"], 2)
+
+    def test_identity(self):
+        response = self._update("identity")
+
+        self.assertNotIn("Content-Encoding", response)
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertTrue(json.loads(response.content)["ok"])
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_SIZE=1024 * 1024)
+    def test_below_min_size(self):
+        response = self._update("gzip, br")
+        self.assertNotIn("Content-Encoding", response)
+
+
+class StaticBundleTests(TestCase):
+    """静的ファイルのバンドル生成とテンプレートタグのテスト。"""
+
+    template = Template('{% load static_bundles %}{% bundle "bundle/site.js" %}')
+
+    def test_collectstatic_builds_precompressed_bundle(self):
+        with tempfile.TemporaryDirectory() as static_root:
+            with override_settings(STATIC_ROOT=static_root):
+                call_command("collectstatic", interactive=False, verbosity=0)
+
+                manifest = json.loads(
+                    (Path(static_root) / "staticfiles.json").read_text()
+                )
+                hashed_name = manifest["paths"]["bundle/site.css"]
+                self.assertRegex(hashed_name, r"^bundle/site\.[0-9a-f]{12}\.css$")
+
+                bundle = Path(static_root) / hashed_name
+                source = Path(static_root) / "css" / "custom.css"
+                self.assertIn(source.read_text().strip(), bundle.read_text())
+                self.assertEqual(
+                    brotli.decompress(Path(f"{bundle}.br").read_bytes()).decode(),
+                    bundle.read_text(),
+                )
+                self.assertTrue(Path(f"{bundle}.gz").exists())
+
+                html = self.template.render(Context())
+                self.assertIn(
+                    f'src="/static/{manifest["paths"]["bundle/site.js"]}"', html
+                )
+
+    @override_settings(DEBUG=True, STATICFILES_STORAGE=TEST_STATICFILES_STORAGE)
+    def test_debug_renders_sources(self):
+        html = self.template.render(Context())
+        self.assertEqual(
+            html, '<script src="/static/js/cart_detail.js" defer></script>'
+        )
+
+
+class AddToCartConcurrencyTests(TransactionTestCase):
+    """カート追加（INSERT … ON CONFLICT）の同時実行のテスト。"""
+
+    THREADS = 8
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            sku="SKU-1", name="同時追加テスト商品", price=1000, stock=5
+        )
+        session = SessionStore()
+        session.create()
+        self.session_key = session.session_key
+        self.cart = Cart.objects.create(session_key=self.session_key)
+
+    def _add_in_parallel(self, quantity: int) -> list[int]:
+        """同じカートに同じ商品を並列に追加し、ステータスコードを返す。"""
+        barrier = threading.Barrier(self.THREADS)
+
+        def add(_):
+            client = Client()
+            client.cookies["sessionid"] = self.session_key
+            barrier.wait()
+            try:
+                response = client.post(
+                    reverse("products:add_to_cart", args=[self.product.pk]),
+                    {"quantity": quantity},
+                )
+                return response.status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            return list(executor.map(add, range(self.THREADS)))
+
+    @skipIf(connection.vendor == "sqlite", SQLITE_CONCURRENCY_SKIP_REASON)
+    def test_parallel_adds_are_not_lost(self):
+        self.product.stock = 100
+        self.product.save()
+
+        statuses = self._add_in_parallel(1)
+
+        self.assertEqual(statuses, [302] * self.THREADS)
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, self.THREADS)
+
+    @skipIf(connection.vendor == "sqlite", SQLITE_CONCURRENCY_SKIP_REASON)
+    def test_parallel_adds_respect_stock(self):
+        self._add_in_parallel(2)
+
+        # 在庫5に対して2個ずつの追加は2回までしか成功しない
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, 4)
+
+    def test_add_cart_item_stock_guard(self):
+        self.assertEqual(add_cart_item(self.cart, self.product.pk, 3), 3)
+        self.assertIsNone(add_cart_item(self.cart, self.product.pk, 3))
+        self.assertEqual(add_cart_item(self.cart, self.product.pk, 2), 5)
+        self.assertIsNone(add_cart_item(self.cart, 0, 1))
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE,
+    CART_STORE_BACKEND="kv",
+    CART_STORE_REDIS_URL="",
+)
+class KeyValueCartStoreTests(TestCase):
+    """キーバリューストア（Redis 互換のインメモリ実装）にカートを保存する場合のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="KVテスト商品", price=1000, stock=5
+        )
+        cls.other = Product.objects.create(
+            sku="SKU-2", name="KVテスト商品2", price=500, stock=0
+        )
+
+    def setUp(self):
+        get_cart_store().client.flushdb()
+
+    def _add(self, product: Product, quantity: int):
+        return self.client.post(
+            reverse("products:add_to_cart", args=[product.pk]), {"quantity": quantity}
+        )
+
+    def test_cart_flow_writes_sql_only_at_checkout(self):
+        self._add(self.product, 2)
+        self._add(self.product, 1)
+
+        response = self.client.get(reverse("products:cart_detail"))
+        self.assertContains(response, "KVテスト商品")
+        self.assertEqual(response.context["total_quantity"], 3)
+
+        response = self.client.post(
+            reverse("products:cart_item_update", args=[self.product.pk]),
+            {"quantity": 4},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            HTTP_X_CART_RESPONSE="delta",
+        )
+        self.assertEqual(response.json()["cart"]["cart_total"], 4000)
+
+        # カート操作では Cart / CartItem に書き込まない
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+        response = self.client.post(reverse("products:order_create"), ORDER_FORM_DATA)
+        self.assertRedirects(
+            response,
+            reverse("products:order_complete"),
+            fetch_redirect_response=False,
+        )
+        order = Order.objects.get()
+        self.assertEqual(order.total_amount, 4000)
+        self.assertEqual(order.items.get().quantity, 4)
+        self.assertEqual(
+            get_cart_store().get_lines(self.client.session.session_key), []
+        )
+
+    def test_stock_guard(self):
+        self._add(self.product, 4)
+        self._add(self.product, 2)
+        self._add(self.other, 1)
+
+        session_key = self.client.session.session_key
+        lines = get_cart_store().get_lines(session_key)
+        self.assertEqual(
+            [(line.id, line.quantity) for line in lines], [(self.product.pk, 4)]
+        )
+
+    def test_delete_and_missing_item(self):
+        self._add(self.product, 1)
+        url = reverse("products:cart_item_delete", args=[self.product.pk])
+
+        response = self.client.post(url, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        self.assertEqual(response.json()["total_quantity"], 0)
+        response = self.client.post(url, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        self.assertEqual(response.status_code, 404)
+
+    def test_deleted_product_is_dropped(self):
+        store = KeyValueCartStore(InMemoryKeyValueClient(), ttl=60)
+        product = Product.objects.create(sku="SKU-3", name="削除予定", price=1, stock=1)
+        store.add("session", product, 1)
+        store.add("session", self.product, 1)
+        product.delete()
+
+        self.assertEqual(
+            [line.id for line in store.get_lines("session")], [self.product.pk]
+        )
+        self.assertEqual(
+            store.client.hgetall("cart:session"), {str(self.product.pk).encode(): b"1"}
+        )
+
+    def test_incomplete_store_fails_on_instantiation(self):
+        class IncompleteStore(CartStore):
+            def get_lines(self, session_key):
+                return []
+
+        with self.assertRaises(TypeError):
+            IncompleteStore()
+
+    def test_reads_do_not_create_empty_carts(self):
+        client = InMemoryKeyValueClient()
+        store = KeyValueCartStore(client, ttl=60)
+        for session_key in ("a", "b", "c"):
+            self.assertEqual(store.get_lines(session_key), [])
+
+        # 閲覧だけのセッションのキーは残らず、空になったカートのキーも消える
+        self.assertEqual(client._data, {})
+        store.add("a", self.product, 1)
+        client.hdel("cart:a", self.product.pk)
+        self.assertEqual(client._data, {})
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE, BASIC_AUTH_USERS=BASIC_AUTH_USERS
+)
+class StockCacheTests(TestCase):
+    """在庫数のキャッシュと write-through のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="在庫テスト商品", price=1000, stock=5
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_levels_skip_database(self):
+        self.assertEqual(get_stock_levels([self.product.pk]), {self.product.pk: 5})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_stock_levels([self.product.pk]), {self.product.pk: 5})
+
+    def test_badge_uses_cached_stock(self):
+        self.client.post(
+            reverse("products:add_to_cart", args=[self.product.pk]), {"quantity": 2}
+        )
+        session_key = self.client.session.session_key
+        self.assertEqual(get_badge_quantity(session_key), 2)
+
+        # キャッシュの期限内は、在庫切れの反映が遅れる（古さは STOCK_CACHE_TIMEOUT まで）
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        self.assertEqual(get_badge_quantity(session_key), 2)
+        cache.clear()
+        self.assertEqual(get_badge_quantity(session_key), 0)
+
+    def test_order_create_writes_through(self):
+        get_stock_levels([self.product.pk])
+        self.client.post(
+            reverse("products:add_to_cart", args=[self.product.pk]), {"quantity": 2}
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("products:order_create"), ORDER_FORM_DATA)
+
+        self.assertEqual(get_stock_levels([self.product.pk]), {self.product.pk: 3})
+
+    def test_manage_product_save_writes_through(self):
+        get_stock_levels([self.product.pk])
+        self.client.post(
+            reverse("products:manage_product_edit", args=[self.product.pk]),
+            {"sku": "SKU-1", "name": "在庫テスト商品", "price": 1000, "stock": 0},
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+        )
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_stock_levels([self.product.pk]), {self.product.pk: 0})
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATICFILES_STORAGE)
+class StockHoldTests(TestCase):
+    """チェックアウト中の在庫の確保のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="確保テスト商品", price=1000, stock=3
+        )
+
+    def _start_checkout(self, client: Client, quantity: int):
+        client.post(
+            reverse("products:add_to_cart", args=[self.product.pk]),
+            {"quantity": quantity},
+        )
+        return client.post(reverse("products:checkout_hold"))
+
+    def test_hold_resolves_contention_before_checkout(self):
+        response = self._start_checkout(self.client, 2)
+        self.assertEqual(response.json()["ok"], True)
+
+        # 後から購入手続きを始めたカートは、残りの1個に数量を合わされる
+        other = Client()
+        response = self._start_checkout(other, 3)
+        self.assertEqual(response.json()["ok"], False)
+        other_session_key = other.session.session_key
+        self.assertEqual(get_cart_store().get_lines(other_session_key)[0].quantity, 1)
+        self.assertEqual(get_available_stock([self.product.pk]), {self.product.pk: 0})
+
+        # 確保した側は注文を確定でき、確保は解除される
+        response = self.client.post(reverse("products:order_create"), ORDER_FORM_DATA)
+        self.assertRedirects(
+            response, reverse("products:order_complete"), fetch_redirect_response=False
+        )
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 1)
+        self.assertFalse(
+            StockHold.objects.exclude(session_key=other_session_key).exists()
+        )
+
+    def test_order_rejected_without_lock_when_held_by_others(self):
+        self._start_checkout(self.client, 3)
+
+        other = Client()
+        other.post(
+            reverse("products:add_to_cart", args=[self.product.pk]), {"quantity": 1}
+        )
+        response = other.post(reverse("products:order_create"), ORDER_FORM_DATA)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "在庫切れのためご注文を確定できません")
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 3)
+
+    def test_expired_holds_are_ignored_and_swept(self):
+        StockHold.objects.create(
+            session_key="expired",
+            product=self.product,
+            quantity=3,
+            expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        self.assertEqual(get_available_stock([self.product.pk]), {self.product.pk: 3})
+
+        call_command("release_expired_holds", stdout=StringIO())
+        self.assertFalse(StockHold.objects.exists())
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE,
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+)
+class IdempotentOrderTests(TestCase):
+    """注文確定の冪等性キーのテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="冪等性テスト商品", price=1000, stock=10
+        )
+
+    def _add_to_cart(self, quantity: int = 2):
+        self.client.post(
+            reverse("products:add_to_cart", args=[self.product.pk]),
+            {"quantity": quantity},
+        )
+
+    def _submit(self, key: str, **extra):
+        return self.client.post(
+            reverse("products:order_create"),
+            {**ORDER_FORM_DATA, "idempotency_key": key},
+            **extra,
+        )
+
+    def test_checkout_form_embeds_key(self):
+        self._add_to_cart()
+        response = self.client.get(reverse("products:cart_detail"))
+        key = response.context["idempotency_key"]
+        self.assertEqual(len(key), 32)
+        self.assertContains(response, f'name="idempotency_key" value="{key}"')
+
+    def test_resubmission_returns_original_order(self):
+        self._add_to_cart()
+        first = self._submit("key-1")
+        order = Order.objects.get()
+
+        # 再送信はカート・在庫・ロックに触れずに、最初の注文の完了ページへ戻す
+        with CaptureQueriesContext(connection) as queries:
+            second = self._submit("key-1")
+        self.assertFalse(any("products_product" in q["sql"] for q in queries))
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(
+            self.client.get(second["Location"]).context["order"].pk, order.pk
+        )
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 8)
+
+        # ヘッダーで送られたキーも同じように扱い、別のキーは新しい注文になる
+        self.client.post(
+            reverse("products:order_create"),
+            ORDER_FORM_DATA,
+            HTTP_IDEMPOTENCY_KEY="key-1",
+        )
+        self.assertEqual(Order.objects.count(), 1)
+        self._add_to_cart(1)
+        self._submit("key-2")
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_concurrent_resubmission_is_rolled_back(self):
+        self._add_to_cart()
+        self._submit("key-1")
+        original = Order.objects.get()
+
+        # 最初の送信の処理中に届いた再送信（先に記録済みのキーを検索で見逃した場合）
+        self._add_to_cart(3)
+        with mock.patch(
+            "products.views.find_order_id", side_effect=[None, original.pk]
+        ):
+            response = self._submit("key-1")
+
+        self.assertRedirects(
+            response, reverse("products:order_complete"), fetch_redirect_response=False
+        )
+        self.assertEqual(list(Order.objects.all()), [original])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 8)
+        self.assertEqual(
+            [
+                line.quantity
+                for line in get_cart_store().get_lines(self.client.session.session_key)
+            ],
+            [3],
+        )
+
+    def test_expired_keys_are_reused_and_purged(self):
+        self._add_to_cart()
+        self._submit("key-1")
+        OrderIdempotencyKey.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        self._add_to_cart(1)
+        self._submit("key-1")
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(OrderIdempotencyKey.objects.count(), 1)
+
+        OrderIdempotencyKey.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        call_command("purge_idempotency_keys", stdout=StringIO())
+        self.assertFalse(OrderIdempotencyKey.objects.exists())
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE,
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    CHECKOUT_ADMISSION_LIMIT=1,
+    CHECKOUT_RETRY_AFTER=2,
+)
+class CheckoutAdmissionTests(TestCase):
+    """注文確定の入場制限（待合室）のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="入場制限テスト商品", price=1000, stock=10
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.post(
+            reverse("products:add_to_cart", args=[self.product.pk]), {"quantity": 1}
+        )
+
+    def test_slots_are_bounded_globally_and_per_product(self):
+        controller = AdmissionController(limit=1, product_limit=1)
+        first = controller.acquire([1, 2])
+        self.assertIsNotNone(first)
+        self.assertIsNone(controller.acquire([3]))
+
+        controller.release(first)
+        controller = AdmissionController(product_limit=1)
+        first = controller.acquire([1, 2])
+        self.assertIsNone(controller.acquire([2, 3]))
+        # 取得できなかった場合、途中まで取った枠（商品3より前はなし）は残らない
+        self.assertIsNotNone(controller.acquire([3]))
+        controller.release(first)
+        self.assertIsNotNone(controller.acquire([1, 2]))
+
+    def test_busy_checkout_waits_in_queue_without_touching_stock(self):
+        controller = get_admission_controller()
+        busy = controller.acquire([])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("products:order_create"),
+                {**ORDER_FORM_DATA, "idempotency_key": "key-1"},
+            )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "2")
+        self.assertEqual(response.context["position"], 1)
+        self.assertContains(
+            response,
+            '<input type="hidden" name="idempotency_key" value="key-1">',
+            status_code=503,
+        )
+        # 入力内容はセッションに預かるが、カード情報はページにもセッションにも残さない
+        self.assertNotContains(response, 'value="4111', status_code=503)
+        pending = self.client.session["checkout_pending"]
+        self.assertEqual(pending["name"], ORDER_FORM_DATA["name"])
+        self.assertFalse(any(name.startswith("card_") for name in pending))
+        # カートを読むだけで、購入可能数の確認・行ロックには進まない
+        self.assertFalse(any("products_stockhold" in q["sql"] for q in queries))
+        self.assertFalse(Order.objects.exists())
+
+        # カード情報のない再送信は、枠を取らずに（混雑中でも）入力画面へ戻す
+        response = self.client.post(
+            reverse("products:order_create"),
+            {"resume": "1", "idempotency_key": "key-1"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors["card_cvv"])
+        self.assertContains(response, f'value="{ORDER_FORM_DATA["name"]}"')
+
+        # 枠が空けば、待合室で入力し直したカード情報で注文でき、処理後は枠を返す
+        controller.release(busy)
+        card = {
+            name: value
+            for name, value in ORDER_FORM_DATA.items()
+            if name.startswith("card_")
+        }
+        response = self.client.post(
+            reverse("products:order_create"),
+            {"resume": "1", "idempotency_key": "key-1", **card},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get().card_number, "4111111111111111")
+        self.assertNotIn("checkout_ticket", self.client.session)
+        self.assertNotIn("checkout_pending", self.client.session)
+        self.assertIsNotNone(controller.acquire([]))
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE,
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+)
+class CheckoutLockTests(TransactionTestCase):
+    """注文確定時の行ロック（取得順・待ち方）のテスト。"""
+
+    THREADS = 8
+
+    def setUp(self):
+        self.products = [
+            Product.objects.create(
+                sku=f"SKU-{i}", name=f"ロックテスト商品{i}", price=1000, stock=100
+            )
+            for i in range(3)
+        ]
+
+    def _cart_client(self, products: list[Product]) -> Client:
+        client = Client()
+        for product in products:
+            client.post(
+                reverse("products:add_to_cart", args=[product.pk]), {"quantity": 1}
+            )
+        return client
+
+    def _checkout_in_parallel(self) -> list[int]:
+        """商品の追加順が異なるカートから並列に注文を確定し、ステータスコードを返す。"""
+        orders = [
+            self.products[i % 3 :] + self.products[: i % 3] for i in range(self.THREADS)
+        ]
+        clients = [
+            self._cart_client(order[::-1] if i % 2 else order)
+            for i, order in enumerate(orders)
+        ]
+        barrier = threading.Barrier(self.THREADS)
+
+        def checkout(client):
+            barrier.wait()
+            try:
+                response = client.post(
+                    reverse("products:order_create"), ORDER_FORM_DATA
+                )
+                return response.status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            return list(executor.map(checkout, clients))
+
+    def test_products_are_locked_in_primary_key_order(self):
+        client = self._cart_client(self.products[::-1])
+
+        with CaptureQueriesContext(connection) as queries:
+            client.post(reverse("products:order_create"), ORDER_FORM_DATA)
+
+        # ロックを取るクエリは主キーだけを読み、購入可能数はロックの後に読み直す
+        lock_index, lock_query = [
+            (i, q["sql"])
+            for i, q in enumerate(queries)
+            if q["sql"].startswith('SELECT "products_product"."id" FROM')
+        ][-1]
+        self.assertIn('ORDER BY "products_product"."id" ASC', lock_query)
+        self.assertIn(
+            '"products_product"."stock" -',
+            queries.captured_queries[lock_index + 1]["sql"],
+        )
+
+    @override_settings(CHECKOUT_RETRY_AFTER=3)
+    def test_busy_lock_returns_retryable_response(self):
+        client = self._cart_client(self.products[:2])
+
+        with mock.patch(
+            "products.views.lock_available_products",
+            side_effect=OperationalError("could not obtain lock on row"),
+        ):
+            response = client.post(reverse("products:order_create"), ORDER_FORM_DATA)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertContains(response, "ただいま注文が混み合っています", status_code=503)
+        # カートと在庫はそのまま残り、もう一度送信すれば注文できる
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.filter(stock=100).count(), 3)
+        response = client.post(reverse("products:order_create"), ORDER_FORM_DATA)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get().items.count(), 2)
+
+    @skipIf(connection.vendor == "sqlite", SQLITE_CONCURRENCY_SKIP_REASON)
+    def test_parallel_checkouts_do_not_deadlock(self):
+        statuses = self._checkout_in_parallel()
+
+        self.assertEqual(statuses, [302] * self.THREADS)
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("stock", flat=True)),
+            [100 - self.THREADS] * 3,
+        )
+
+    @skipIf(connection.vendor == "sqlite", SQLITE_CONCURRENCY_SKIP_REASON)
+    def test_parallel_holds_do_not_oversubscribe_stock(self):
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(stock=3)
+        clients = [self._cart_client([product]) for _ in range(self.THREADS)]
+        barrier = threading.Barrier(self.THREADS)
+
+        def hold(client):
+            barrier.wait()
+            try:
+                return client.post(reverse("products:checkout_hold")).json()["ok"]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            results = list(executor.map(hold, clients))
+
+        # ロック待ちの間に他のカートが確保した分も数えるため、在庫数を超えて確保しない
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(sum(StockHold.objects.values_list("quantity", flat=True)), 3)
+
+    @skipIf(connection.vendor == "sqlite", SQLITE_CONCURRENCY_SKIP_REASON)
+    @override_settings(CHECKOUT_LOCK_POLICY="nowait")
+    def test_parallel_checkouts_fail_fast_with_nowait(self):
+        statuses = self._checkout_in_parallel()
+
+        # ロックを取れなかった注文は 503 で戻り、在庫は確定した注文の分だけ減る
+        self.assertLessEqual(set(statuses), {302, 503})
+        completed = statuses.count(302)
+        self.assertEqual(Order.objects.count(), completed)
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("stock", flat=True)),
+            [100 - completed] * 3,
+        )
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReadReplicaRoutingTests(TestCase):
+    """読み取り用レプリカへの振り分けと read-your-writes のテスト。"""
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), "default")
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Product), "replica1")
+            self.assertEqual(
+                router.db_for_read(SessionStore.get_model_class()), "default"
+            )
+            self.assertEqual(router.db_for_write(Product), "default")
+
+    def test_decorator_reads_primary_while_pinned(self):
+        @read_from_replica
+        def view(request):
+            return HttpResponse(ReplicaRouter().db_for_read(Product))
+
+        factory = RequestFactory()
+        self.assertEqual(view(factory.get("/")).content, b"replica1")
+
+        factory.cookies[settings.READ_REPLICA_STICKY_COOKIE] = "1"
+        self.assertEqual(view(factory.get("/")).content, b"default")
+
+    async def test_decorator_async_view(self):
+        @read_from_replica
+        async def view(request):
+            db = await sync_to_async(ReplicaRouter().db_for_read)(Product)
+            return HttpResponse(db)
+
+        response = await view(AsyncRequestFactory().get("/"))
+        self.assertEqual(response.content, b"replica1")
+
+    def test_mutation_pins_session_to_primary(self):
+        product = Product.objects.create(sku="SKU-1", name="商品", price=100, stock=1)
+        response = self.client.post(reverse("products:add_to_cart", args=[product.pk]))
+
+        cookie = response.cookies[settings.READ_REPLICA_STICKY_COOKIE]
+        self.assertEqual(cookie["max-age"], settings.READ_REPLICA_STICKY_SECONDS)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_pin_without_replicas(self):
+        product = Product.objects.create(sku="SKU-1", name="商品", price=100, stock=1)
+        response = self.client.post(reverse("products:add_to_cart", args=[product.pk]))
+
+        self.assertNotIn(settings.READ_REPLICA_STICKY_COOKIE, response.cookies)
+
+
+@skipUnless(
+    settings.DATABASE_REPLICAS, "DATABASE_REPLICA_URLS が未設定のため（README を参照）"
+)
+@override_settings(STATICFILES_STORAGE=TEST_STATICFILES_STORAGE)
+class ReadReplicaIntegrationTests(TransactionTestCase):
+    """
+    レプリカを設定した状態で、商品一覧の読み取り先を確認するテスト。
+
+    テスト時のレプリカは default のテスト用DBを指す（TEST.MIRROR）。
+    別の接続から読むため、コミット済みのデータが見える TransactionTestCase で行う。
+    """
+
+    databases = "__all__"
+
+    def _replica_query_count(self, url: str) -> int:
+        replica = connections[settings.DATABASE_REPLICAS[0]]
+        with CaptureQueriesContext(replica) as ctx:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_catalog_reads_replica_until_mutation(self):
+        product = Product.objects.create(sku="SKU-1", name="商品", price=100, stock=1)
+        url = reverse("products:product_list")
+
+        self.assertGreater(self._replica_query_count(url), 0)
+
+        self.client.post(reverse("products:add_to_cart", args=[product.pk]))
+        self.assertEqual(self._replica_query_count(url), 0)
+
+
+class SalesRollupTests(TestCase):
+    """売上の集計テーブルの差分更新のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="集計テスト商品", price=1000, stock=100
+        )
+        cls.promotion = PromotionCode.objects.create(
+            code="PROMO01", discount_amount=300, is_used=True
+        )
+
+    def _create_order(self, quantity: int, promotion: PromotionCode | None = None):
+        discount = promotion.discount_amount if promotion else None
+        order = Order.objects.create(
+            name="購入者",
+            phone="09012345678",
+            email="buyer@example.com",
+            postal_code="1234567",
+            address="東京都千代田区1-1-1",
+            total_amount=1000 * quantity - (discount or 0),
+            card_number="4111111111111111",
+            card_expire="12/99",
+            card_cvv="123",
+            card_holder="TARO YAMADA",
+            promotion_code=promotion,
+            promotion_discount_amount=discount,
+        )
+        OrderItem.objects.create(
+            order=order,
+            product=self.product,
+            product_name=self.product.name,
+            price=1000,
+            quantity=quantity,
+        )
+        return order
+
+    def test_rollup_is_incremental_and_idempotent(self):
+        self._create_order(2)
+        self._create_order(1, self.promotion)
+        call_command("rollup_sales", settle_seconds=0, stdout=StringIO())
+        # 再実行しても二重に集計されない
+        call_command("rollup_sales", settle_seconds=0, stdout=StringIO())
+
+        day = DailySalesRollup.objects.get()
+        self.assertEqual(
+            (
+                day.order_count,
+                day.units_sold,
+                day.revenue,
+                day.promotion_redemptions,
+                day.discount_total,
+            ),
+            (2, 3, 2700, 1, 300),
+        )
+
+        # 新しい注文だけが加算される
+        self._create_order(4)
+        self.assertEqual(rollup_new_orders(batch_size=1, settle_seconds=0), 1)
+
+        rollup = ProductSalesRollup.objects.get(product=self.product)
+        self.assertEqual(
+            (rollup.order_count, rollup.units_sold, rollup.revenue), (3, 7, 7000)
+        )
+        self.assertEqual(DailySalesRollup.objects.get().revenue, 6700)
+
+    def test_recent_orders_wait_to_settle(self):
+        self._create_order(1)
+        self.assertEqual(rollup_new_orders(settle_seconds=60), 0)
+        self.assertFalse(DailySalesRollup.objects.exists())
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE, BASIC_AUTH_USERS=BASIC_AUTH_USERS
+)
+class ProductImportTests(TestCase):
+    """商品の一括登録（CSV / JSONL）のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="旧商品名", price=1000, stock=5, description="説明"
+        )
+
+    def _import(self, fmt: str, content: str, *args) -> tuple[str, str]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / f"products.{fmt}"
+            path.write_text(content, encoding="utf-8")
+            stdout, stderr = StringIO(), StringIO()
+            call_command(
+                "import_products", str(path), *args, stdout=stdout, stderr=stderr
+            )
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_upsert_with_row_errors(self):
+        stdout, stderr = self._import(
+            "csv",
+            "\ufeffsku,name,price,stock\n"
+            "SKU-1,新商品名,1200,7\n"
+            "SKU-2,追加商品,500,3\n"
+            "SKU-3,価格エラー,-1,3\n"
+            "SKU-2,重複,500,3\n",
+            "--chunk-size",
+            "1",
+        )
+
+        self.assertIn("4行中 2行を反映しました", stdout)
+        self.assertIn("4行目: price:", stderr)
+        self.assertIn("5行目: 品番「SKU-2」がファイル内で重複しています。", stderr)
+
+        # ファイルにない任意の列（description / is_active）は既存の値のまま
+        updated = Product.objects.get(sku="SKU-1")
+        self.assertEqual(
+            (updated.name, updated.price, updated.stock, updated.description),
+            ("新商品名", 1200, 7, "説明"),
+        )
+        self.assertTrue(Product.objects.get(sku="SKU-2").is_active)
+        self.assertFalse(Product.objects.filter(sku="SKU-3").exists())
+
+    def test_jsonl(self):
+        stdout, stderr = self._import(
+            "jsonl",
+            '{"sku": "SKU-1", "name": "商品", "price": 800, "stock": 0, "is_active": false}\n'
+            "not json\n",
+        )
+
+        self.assertIn("2行中 1行を反映しました", stdout)
+        self.assertIn("2行目: JSON のオブジェクトとして読み込めません。", stderr)
+        self.assertFalse(Product.objects.get(sku="SKU-1").is_active)
+
+    def test_csv_is_active_false_values(self):
+        stdout, _ = self._import(
+            "csv",
+            "sku,name,price,stock,is_active\n"
+            "SKU-1,商品,1000,5,0\n"
+            "SKU-2,商品,1000,5,false\n"
+            "SKU-3,商品,1000,5,1\n",
+        )
+
+        self.assertIn("3行中 3行を反映しました", stdout)
+        self.assertEqual(
+            dict(Product.objects.values_list("sku", "is_active")),
+            {"SKU-1": False, "SKU-2": False, "SKU-3": True},
+        )
+
+    def test_missing_required_column(self):
+        with self.assertRaisesMessage(CommandError, "必須の列がありません: stock"):
+            self._import("csv", "sku,name,price\nSKU-9,商品,100\n")
+
+    def test_upload_view(self):
+        upload = SimpleUploadedFile(
+            "products.csv", "sku,name,price,stock\nSKU-4,アップロード,300,2\n".encode()
+        )
+        response = self.client.post(
+            reverse("products:manage_product_import"),
+            {"file": upload},
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+        )
+
+        self.assertContains(response, "1行中 1行を反映しました")
+        self.assertTrue(Product.objects.filter(sku="SKU-4", stock=2).exists())
+
+
+@override_settings(BASIC_AUTH_USERS=BASIC_AUTH_USERS)
+class StockSyncTests(TestCase):
+    """在庫数の一括反映（倉庫連携）のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = Product.objects.create(
+            sku="SKU-1", name="商品1", price=100, stock=5
+        )
+        cls.second = Product.objects.create(
+            sku="SKU-2", name="商品2", price=100, stock=1
+        )
+
+    def _post(self, payload, **extra):
+        return self.client.post(
+            reverse("products:manage_stock_sync"),
+            json.dumps(payload),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            **extra,
+        )
+
+    def test_api_applies_stock_and_delta_with_row_errors(self):
+        updated_at = self.first.updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._post(
+                {
+                    "items": [
+                        {"sku": "SKU-1", "delta": -2},
+                        {"sku": "SKU-2", "delta": -3},
+                        {"sku": "SKU-9", "stock": 4},
+                        {"sku": "SKU-1", "stock": 1, "delta": 1},
+                    ]
+                }
+            )
+
+        body = response.json()
+        self.assertEqual((body["ok"], body["total"], body["updated"]), (False, 4, 1))
+        self.assertEqual([error["index"] for error in body["errors"]], [1, 2, 3])
+        self.assertIn("在庫数が負になるため反映できません", body["errors"][0]["error"])
+        self.assertIn("品番が存在しません", body["errors"][1]["error"])
+
+        # stock 列だけを更新し、キャッシュも更新後の値になる
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.stock, self.first.updated_at), (3, updated_at))
+        self.assertEqual(get_stock_levels([self.first.pk]), {self.first.pk: 3})
+        self.assertEqual(Product.objects.get(sku="SKU-2").stock, 1)
+
+    def test_rows_are_locked_in_primary_key_order_before_update(self):
+        adjustments = [
+            StockAdjustment(line=1, sku="SKU-2", mode="delta", value=1),
+            StockAdjustment(line=2, sku="SKU-1", mode="stock", value=3),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(apply_stock_adjustments(adjustments), (2, []))
+
+        # 注文確定と同じく主キーの順にロックを取ってから、まとめて UPDATE する
+        sqls = [q["sql"] for q in queries]
+        lock_index = next(i for i, sql in enumerate(sqls) if sql.startswith("SELECT"))
+        self.assertIn('ORDER BY "products_product"."id" ASC', sqls[lock_index])
+        self.assertTrue(sqls[lock_index + 1].startswith("UPDATE"))
+
+    def test_api_rejects_non_json_and_unauthenticated(self):
+        url = reverse("products:manage_stock_sync")
+        response = self.client.post(
+            url, {"items": "[]"}, HTTP_AUTHORIZATION=BASIC_AUTH_HEADER
+        )
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(self._post({"items": "SKU-1"}).status_code, 400)
+        response = self.client.post(url, "{}", content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "stock.csv"
+            path.write_text("sku,stock,delta\nSKU-1,10,\nSKU-2,,+4\n", encoding="utf-8")
+            stdout = StringIO()
+            call_command("sync_stock", str(path), stdout=stdout)
+
+        self.assertIn("2行中 2行の在庫数を反映しました", stdout.getvalue())
+        self.assertEqual(
+            dict(Product.objects.values_list("sku", "stock")),
+            {"SKU-1": 10, "SKU-2": 5},
+        )
+
+
+@override_settings(BASIC_AUTH_CACHE_SECONDS=60)
+class BasicAuthTests(TestCase):
+    """管理画面の Basic 認証のテスト。"""
+
+    def _get(self, credentials: str | None = None):
+        extra = {}
+        if credentials is not None:
+            encoded = base64.b64encode(credentials.encode()).decode()
+            extra["HTTP_AUTHORIZATION"] = f"Basic {encoded}"
+        return self.client.get(reverse("metrics"), **extra)
+
+    @override_settings(BASIC_AUTH_USERS={})
+    def test_unconfigured(self):
+        self.assertEqual(self._get("admin:secret").status_code, 500)
+
+    @override_settings(BASIC_AUTH_USERS={"admin": ""})
+    def test_empty_password_is_not_accepted(self):
+        self.assertEqual(self._get("admin:").status_code, 500)
+
+    @override_settings(
+        BASIC_AUTH_USERS={
+            "admin": "secret",
+            "ops": make_password("ops-pass"),
+            "guest": "",
+        }
+    )
+    def test_plain_and_hashed_users(self):
+        self.assertEqual(self._get("admin:secret").status_code, 200)
+        self.assertEqual(self._get("ops:ops-pass").status_code, 200)
+        self.assertContains(self._get(), "認証が必要です", status_code=401)
+        self.assertContains(
+            self._get("ops:secret"), "認証に失敗しました", status_code=401
+        )
+        self.assertContains(self._get("admin"), "認証情報が無効です", status_code=401)
+        self.assertEqual(self._get("nobody:secret").status_code, 401)
+        self.assertEqual(self._get("guest:").status_code, 401)
+
+    @override_settings(BASIC_AUTH_USERS={"ops": make_password("ops-pass")})
+    def test_verified_header_is_cached(self):
+        with mock.patch(
+            "config.basic_auth.check_password", wraps=check_password
+        ) as checked:
+            for _ in range(3):
+                self.assertEqual(self._get("ops:ops-pass").status_code, 200)
+            # 失敗したヘッダーはキャッシュしない
+            for _ in range(2):
+                self.assertEqual(self._get("ops:wrong").status_code, 401)
+
+        self.assertEqual(checked.call_count, 3)
+
+        # 設定が変わったら、キャッシュ済みのヘッダーも検証し直す
+        with override_settings(BASIC_AUTH_USERS={"ops": "changed"}):
+            self.assertEqual(self._get("ops:ops-pass").status_code, 401)
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE,
+    BASIC_AUTH_USERS=BASIC_AUTH_USERS,
+    MANAGE_PRODUCTS_PER_PAGE=2,
+    MANAGE_LOW_STOCK_THRESHOLD=3,
+)
+class ManageProductListTests(TestCase):
+    """商品管理画面（一覧）の絞り込み・ページ送り・一括操作のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(
+                sku=f"SKU-{i}",
+                name=f"商品{i}",
+                price=100,
+                stock=stock,
+                is_active=active,
+            )
+            for i, (stock, active) in enumerate(
+                [(0, True), (2, True), (3, False), (10, True), (20, True)]
+            )
+        ]
+
+    def _list(self, **params):
+        return self.client.get(
+            reverse("products:manage_product_list"),
+            params,
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+        )
+
+    def _bulk(self, data):
+        return self.client.post(
+            reverse("products:manage_product_bulk_action"),
+            data,
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+        )
+
+    def test_filters_sort_and_pagination(self):
+        def skus(response):
+            return [product.sku for product in response.context["products"]]
+
+        self.assertEqual(skus(self._list(sort="sku")), ["SKU-0", "SKU-1"])
+        response = self._list(sort="sku", page=3)
+        self.assertEqual(skus(response), ["SKU-4"])
+        self.assertEqual(response.context["page"].paginator.count, 5)
+        self.assertEqual(skus(self._list(status="inactive")), ["SKU-2"])
+        self.assertEqual(skus(self._list(status="out_of_stock")), ["SKU-0"])
+        self.assertEqual(
+            skus(self._list(status="low_stock", sort="stock")), ["SKU-1", "SKU-2"]
+        )
+        self.assertEqual(skus(self._list(q="商品4")), ["SKU-4"])
+
+        # 表示する列だけを読み込む
+        product = self._list()
+        self.assertEqual(
+            product.context["products"][0].get_deferred_fields(),
+            {"description", "image", "deleted_at"},
+        )
+
+    def test_bulk_update_selected(self):
+        first, second = self.products[3], self.products[4]
+        updated_at = first.updated_at
+        response = self._bulk(
+            {
+                "action": "deactivate",
+                "product_ids": [first.pk, second.pk],
+                "sort": "sku",
+            }
+        )
+        self.assertRedirects(
+            response,
+            reverse("products:manage_product_list") + "?sort=sku",
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(
+            Product.objects.filter(
+                pk__in=[first.pk, second.pk], is_active=False
+            ).count(),
+            2,
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._bulk({"action": "set_stock", "product_ids": [first.pk], "stock": 7})
+        first.refresh_from_db()
+        self.assertEqual(first.stock, 7)
+        self.assertGreater(first.updated_at, updated_at)
+        self.assertEqual(get_stock_levels([first.pk]), {first.pk: 7})
+
+        # 在庫数の指定がない場合は何も更新しない
+        self._bulk({"action": "set_stock", "product_ids": [first.pk]})
+        self.assertEqual(Product.objects.get(pk=first.pk).stock, 7)
+
+    def test_bulk_delete_all_matching_requires_confirmation(self):
+        data = {"action": "delete", "all_matching": "1", "status": "low_stock"}
+        response = self._bulk(data)
+        self.assertContains(response, "2件の商品を削除します")
+        self.assertEqual(Product.objects.count(), 5)
+
+        # 件数によらず、1回の UPDATE で削除済みにする
+        # （SAVEPOINT・ID の取得・UPDATE・RELEASE）
+        with self.assertNumQueries(4):
+            self._bulk({**data, "confirmed": "1"})
+        self.assertEqual(
+            set(Product.objects.live().values_list("sku", flat=True)),
+            {"SKU-0", "SKU-3", "SKU-4"},
+        )
+        self.assertEqual(Product.objects.archived().count(), 2)
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE, BASIC_AUTH_USERS=BASIC_AUTH_USERS
+)
+class ProductArchiveTests(TestCase):
+    """商品の削除（アーカイブ）と、残ったカートの明細の掃除のテスト。"""
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            sku="SKU-1", name="人気商品", price=1000, stock=10
+        )
+        self.other = Product.objects.create(
+            sku="SKU-2", name="商品", price=500, stock=10
+        )
+        self.client.post(reverse("products:add_to_cart", args=[self.product.pk]))
+        self.client.post(reverse("products:add_to_cart", args=[self.other.pk]))
+        session_key = self.client.session.session_key
+        StockHold.objects.create(
+            session_key=session_key,
+            product=self.product,
+            quantity=1,
+            expires_at=timezone.now() + timedelta(minutes=10),
+        )
+        order = Order.objects.create(
+            name="山田太郎",
+            phone="09012345678",
+            email="test@example.com",
+            postal_code="1000001",
+            address="東京都千代田区",
+            total_amount=1000,
+        )
+        self.order_item = OrderItem.objects.create(
+            order=order,
+            product=self.product,
+            product_name=self.product.name,
+            price=1000,
+            quantity=1,
+        )
+
+    def test_delete_archives_without_touching_carts_or_orders(self):
+        with self.assertNumQueries(4):
+            # SAVEPOINT・ID の取得・UPDATE・RELEASE（カート・注文明細の行は触らない）
+            archive_products(Product.objects.filter(pk=self.product.pk))
+
+        self.assertEqual(CartItem.objects.count(), 2)
+        self.order_item.refresh_from_db()
+        self.assertEqual(self.order_item.product_id, self.product.pk)
+
+        # 削除済みの商品は、カート・販売・管理画面から見えない
+        lines = get_cart_store().get_lines(self.client.session.session_key)
+        self.assertEqual([line.product_id for line in lines], [self.other.pk])
+        response = self.client.get(
+            reverse("products:product_detail", args=[self.product.pk])
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("products:manage_product_edit", args=[self.product.pk]),
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(get_available_stock([self.product.pk]), {})
+
+    def test_reimport_revives_archived_product(self):
+        archive_products(Product.objects.filter(pk=self.product.pk))
+
+        # 品番は削除後も残るため、商品の作成フォームでは使えず、一括登録で元に戻す
+        form = ProductForm({"sku": "SKU-1", "name": "新商品", "price": 100, "stock": 1})
+        self.assertIn("削除済みの商品の品番です", form.errors["sku"][0])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "products.csv"
+            path.write_text(
+                "sku,name,price,stock\nSKU-1,再販商品,1200,3\nSKU-3,新商品,100,1\n",
+                encoding="utf-8",
+            )
+            stdout = StringIO()
+            call_command("import_products", str(path), stdout=stdout)
+
+        self.assertIn("うち削除済みから元に戻した商品 1件", stdout.getvalue())
+        revived = Product.objects.live().get(sku="SKU-1")
+        self.assertEqual(
+            (revived.pk, revived.name, revived.stock), (self.product.pk, "再販商品", 3)
+        )
+
+    def test_manage_delete_view_and_purge(self):
+        response = self.client.post(
+            reverse("products:manage_product_delete", args=[self.product.pk]),
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+        )
+        self.assertRedirects(
+            response,
+            reverse("products:manage_product_list"),
+            fetch_redirect_response=False,
+        )
+        self.assertTrue(Product.objects.archived().filter(pk=self.product.pk).exists())
+
+        stdout = StringIO()
+        call_command("purge_archived_products", "--batch-size", "1", stdout=stdout)
+        self.assertIn(
+            "カートの明細を 1 件、在庫の確保を 1 件削除しました", stdout.getvalue()
+        )
+        self.assertEqual(
+            list(CartItem.objects.values_list("product_id", flat=True)), [self.other.pk]
+        )
+        self.assertFalse(StockHold.objects.exists())
+        # 商品の行と注文履歴の参照は残る
+        self.order_item.refresh_from_db()
+        self.assertEqual(self.order_item.product_id, self.product.pk)
+
+    def test_reimport_restores_archived_sku(self):
+        archive_products(Product.objects.filter(pk=self.product.pk))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "products.csv"
+            path.write_text(
+                "sku,name,price,stock\nSKU-1,再販,900,3\n", encoding="utf-8"
+            )
+            call_command("import_products", str(path), stdout=StringIO())
+
+        self.assertTrue(Product.objects.live().filter(pk=self.product.pk).exists())
+
+
+@override_settings(BASIC_AUTH_USERS=BASIC_AUTH_USERS)
+class OrderStatusTransitionTests(TestCase):
+    """注文のステータスの一括変更のテスト。"""
+
+    def _create_orders(self, status: str, count: int = 1) -> list[Order]:
+        return Order.objects.bulk_create(
+            Order(
+                name="購入者",
+                phone="09012345678",
+                email="buyer@example.com",
+                postal_code="1234567",
+                address="東京都千代田区1-1-1",
+                total_amount=1000,
+                card_number="4111111111111111",
+                card_expire="12/99",
+                card_cvv="123",
+                card_holder="TARO YAMADA",
+                status=status,
+            )
+            for _ in range(count)
+        )
+
+    def test_bulk_transition_is_one_update_per_source(self):
+        paid = self._create_orders(Order.Status.PAID, 50)
+        ids = [order.pk for order in paid]
+
+        # SAVEPOINT・UPDATE（支払い済み → 発送済み）・履歴の INSERT・RELEASE
+        with self.assertNumQueries(4):
+            result = transition_orders(ids, Order.Status.SHIPPED)
+
+        self.assertEqual((result.updated, result.errors), (50, []))
+        self.assertEqual(Order.objects.filter(status=Order.Status.SHIPPED).count(), 50)
+        self.assertEqual(
+            set(OrderStatusChange.objects.values_list("from_status", "to_status")),
+            {(Order.Status.PAID, Order.Status.SHIPPED)},
+        )
+
+    def test_invalid_transitions_are_reported(self):
+        (pending,) = self._create_orders(Order.Status.PENDING)
+        (paid,) = self._create_orders(Order.Status.PAID)
+        (delivered,) = self._create_orders(Order.Status.DELIVERED)
+
+        result = transition_orders(
+            [pending.pk, paid.pk, delivered.pk, 999999], Order.Status.CANCELLED
+        )
+
+        self.assertEqual(result.updated, 2)
+        self.assertEqual(
+            result.errors,
+            [
+                (
+                    delivered.pk,
+                    "ステータスが「配達済み」の注文は「キャンセル」にできません。",
+                ),
+                (999999, "注文が存在しません。"),
+            ],
+        )
+        self.assertEqual(
+            dict(OrderStatusChange.objects.values_list("order_id", "from_status")),
+            {pending.pk: Order.Status.PENDING, paid.pk: Order.Status.PAID},
+        )
+        # 2回目は遷移済みのため、二重に変更・記録しない
+        self.assertEqual(
+            transition_orders([pending.pk], Order.Status.CANCELLED).updated, 0
+        )
+        self.assertEqual(OrderStatusChange.objects.count(), 2)
+
+    def test_api(self):
+        (paid,) = self._create_orders(Order.Status.PAID)
+        (pending,) = self._create_orders(Order.Status.PENDING)
+        url = reverse("products:manage_order_status")
+
+        response = self.client.post(
+            url,
+            json.dumps({"order_ids": [paid.pk, pending.pk], "status": "shipped"}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+        )
+        body = response.json()
+        self.assertEqual((body["ok"], body["updated"]), (False, 1))
+        self.assertEqual([error["order_id"] for error in body["errors"]], [pending.pk])
+
+        response = self.client.post(
+            url,
+            json.dumps({"order_ids": [paid.pk], "status": "lost"}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        orders = self._create_orders(Order.Status.SHIPPED, 3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "ids.txt"
+            path.write_text(
+                "\n".join(str(order.pk) for order in orders[1:]) + "\n",
+                encoding="utf-8",
+            )
+            stdout = StringIO()
+            call_command(
+                "transition_orders",
+                "delivered",
+                str(orders[0].pk),
+                "--ids-file",
+                str(path),
+                stdout=stdout,
+            )
+
+        self.assertIn(
+            "3件中 3件のステータスを「配達済み」に変更しました", stdout.getvalue()
+        )
+        self.assertEqual(Order.objects.filter(status=Order.Status.DELIVERED).count(), 3)
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE, BASIC_AUTH_USERS=BASIC_AUTH_USERS
+)
+class OrderCancellationTests(TestCase):
+    """注文のキャンセル（在庫の戻し・プロモーションコードの解放）のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = Product.objects.create(
+            sku="SKU-1", name="商品1", price=1000, stock=5
+        )
+        cls.second = Product.objects.create(
+            sku="SKU-2", name="商品2", price=500, stock=0
+        )
+        cls.promotion = PromotionCode.objects.create(
+            code="PROMO01",
+            discount_amount=300,
+            times_used=1,
+            is_used=True,
+            used_at=timezone.now(),
+        )
+
+    def _create_order(self, status: str, lines, promotion=None) -> Order:
+        order = Order.objects.create(
+            name="購入者",
+            phone="09012345678",
+            email="buyer@example.com",
+            postal_code="1234567",
+            address="東京都千代田区1-1-1",
+            total_amount=1000,
+            card_number="4111111111111111",
+            card_expire="12/99",
+            card_cvv="123",
+            card_holder="TARO YAMADA",
+            status=status,
+            promotion_code=promotion,
+        )
+        if promotion:
+            PromotionRedemption.objects.create(promotion=promotion, order=order)
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product=product,
+                product_name="商品",
+                price=100,
+                quantity=quantity,
+            )
+            for product, quantity in lines
+        )
+        return order
+
+    def _stock(self) -> dict[str, int]:
+        return dict(Product.objects.values_list("sku", "stock"))
+
+    def test_bulk_cancel_restores_stock_once(self):
+        pending = self._create_order(
+            Order.Status.PENDING, [(self.first, 2), (self.second, 1)]
+        )
+        paid = self._create_order(
+            Order.Status.PAID, [(self.first, 3), (None, 4)], promotion=self.promotion
+        )
+        shipped = self._create_order(Order.Status.SHIPPED, [(self.first, 10)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = transition_orders(
+                [pending.pk, paid.pk, shipped.pk],
+                Order.Status.CANCELLED,
+                release_promotions=True,
+            )
+
+        self.assertEqual((result.updated, result.restocked_units), (2, 6))
+        self.assertEqual([pk for pk, _ in result.errors], [shipped.pk])
+        self.assertEqual(self._stock(), {"SKU-1": 10, "SKU-2": 1})
+        self.assertEqual(get_stock_levels([self.first.pk]), {self.first.pk: 10})
+        self.promotion.refresh_from_db()
+        self.assertEqual(
+            (self.promotion.times_used, self.promotion.is_used, self.promotion.used_at),
+            (0, False, None),
+        )
+        self.assertFalse(PromotionRedemption.objects.exists())
+
+        # キャンセル済みの注文は遷移しないため、在庫を二重に戻さない
+        result = transition_orders([pending.pk, paid.pk], Order.Status.CANCELLED)
+        self.assertEqual((result.updated, result.restocked_units), (0, 0))
+        self.assertEqual(self._stock(), {"SKU-1": 10, "SKU-2": 1})
+
+    def test_cancel_subtracts_rolled_up_sales(self):
+        kept = self._create_order(Order.Status.PAID, [(self.first, 1)])
+        cancelled = self._create_order(Order.Status.PAID, [(self.first, 2)])
+        rollup_new_orders(settle_seconds=0)
+
+        transition_orders([cancelled.pk], Order.Status.CANCELLED)
+        # 集計前にキャンセルした注文は、集計に含めない
+        unrolled = self._create_order(Order.Status.PENDING, [(self.first, 3)])
+        transition_orders([unrolled.pk], Order.Status.CANCELLED)
+        rollup_new_orders(settle_seconds=0)
+
+        daily = DailySalesRollup.objects.get()
+        self.assertEqual(
+            (daily.order_count, daily.units_sold, daily.revenue),
+            (1, 1, kept.total_amount),
+        )
+        product = ProductSalesRollup.objects.get(product=self.first)
+        self.assertEqual(
+            (product.order_count, product.units_sold, product.revenue), (1, 1, 100)
+        )
+
+    def test_cancel_view(self):
+        order = self._create_order(
+            Order.Status.PAID, [(self.first, 2)], promotion=self.promotion
+        )
+        url = reverse("products:manage_order_detail", args=[order.pk])
+        self.assertContains(
+            self.client.get(url, HTTP_AUTHORIZATION=BASIC_AUTH_HEADER),
+            "注文をキャンセルして在庫を戻す",
+        )
+
+        response = self.client.post(
+            reverse("products:manage_order_cancel", args=[order.pk]),
+            HTTP_AUTHORIZATION=BASIC_AUTH_HEADER,
+            follow=True,
+        )
+
+        self.assertContains(response, "在庫を 2 個戻しました")
+        self.assertNotContains(response, "注文をキャンセルして在庫を戻す")
+        self.assertEqual(self._stock()["SKU-1"], 7)
+        # チェックしない場合、プロモーションコードは使用済みのまま
+        self.promotion.refresh_from_db()
+        self.assertTrue(self.promotion.is_used)
+
+
+@override_settings(
+    STATICFILES_STORAGE=TEST_STATICFILES_STORAGE,
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+)
+class PromotionUsageLimitTests(TestCase):
+    """複数回使えるプロモーションコード（利用上限・利用の記録）のテスト。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            sku="SKU-1", name="キャンペーン商品", price=2000, stock=10
+        )
+        cls.promotion = PromotionCode.objects.create(
+            code="CAMPAIN", discount_amount=500, usage_limit=2
+        )
+
+    def _checkout_with_code(self, client: Client):
+        client.post(
+            reverse("products:add_to_cart", args=[self.product.pk]), {"quantity": 1}
+        )
+        response = client.post(
+            reverse("products:cart_promotion_apply"),
+            {"promotion_code": self.promotion.code},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+        )
+        if not response.json()["ok"]:
+            return response
+        return client.post(reverse("products:order_create"), ORDER_FORM_DATA)
+
+    def test_code_is_shared_until_limit(self):
+        for _ in range(2):
+            response = self._checkout_with_code(Client())
+            self.assertEqual(response.status_code, 302)
+
+        self.promotion.refresh_from_db()
+        self.assertEqual((self.promotion.times_used, self.promotion.is_used), (2, True))
+        self.assertEqual(
+            sorted(
+                PromotionRedemption.objects.values_list(
+                    "order__total_amount", flat=True
+                )
+            ),
+            [1500, 1500],
+        )
+        # 上限に達したコードは適用できない
+        response = self._checkout_with_code(Client())
+        self.assertFalse(response.json()["ok"])
+
+        # 上限を引き上げると、使用済みを判定し直して再び使える
+        PromotionCode.objects.filter(pk=self.promotion.pk).update(usage_limit=3)
+        refresh_exhausted(self.promotion.pk)
+        self.assertEqual(self._checkout_with_code(Client()).status_code, 302)
+
+    def test_order_rolled_back_when_limit_reached_concurrently(self):
+        self.client.post(
+            reverse("products:add_to_cart", args=[self.product.pk]), {"quantity": 1}
+        )
+        self.client.post(
+            reverse("products:cart_promotion_apply"),
+            {"promotion_code": self.promotion.code},
+        )
+        # コードを読んだ後に、他の注文が上限まで使った（条件付きの加算が失敗する）
+        PromotionCode.objects.filter(pk=self.promotion.pk).update(times_used=2)
+
+        response = self.client.post(
+            reverse("products:order_create"), ORDER_FORM_DATA, follow=True
+        )
+
+        self.assertContains(response, "プロモーションコードの利用上限に達したため")
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(PromotionRedemption.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 10)
+        self.assertNotIn("promotion_code_id", self.client.session)
+        # カートは残り、コードなしでそのまま注文できる
+        response = self.client.post(reverse("products:order_create"), ORDER_FORM_DATA)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.get().total_amount, 2000)
+
+
+class CheckoutBenchmarkTests(TestCase):
+    """負荷計測コマンドのデータ投入・削除のテスト。"""
+
+    def test_cleanup_keeps_real_promotion_codes(self):
+        customer_code = PromotionCode.objects.create(
+            code="Z234567", discount_amount=100
+        )
+        order = Order.objects.create(
+            name="購入者",
+            phone="09012345678",
+            email="buyer@example.com",
+            postal_code="1234567",
+            address="東京都千代田区1-1-1",
+            total_amount=900,
+            card_number="4111111111111111",
+            card_expire="12/99",
+            card_cvv="123",
+            card_holder="TARO YAMADA",
+            promotion_code=customer_code,
+        )
+
+        # 投入の前に前回分を削除するが、ベンチマーク用の形式のコードだけが対象
+        for _ in range(2):
+            call_command(
+                "checkout_benchmark",
+                "--seed-only",
+                "--users",
+                "3",
+                "--products",
+                "3",
+                stdout=StringIO(),
+            )
+        self.assertEqual(
+            sorted(PromotionCode.objects.values_list("code", flat=True)),
+            ["0000000", "0000001", "0000002", "Z234567"],
+        )
+
+        BenchmarkCommand()._cleanup()
+        self.assertEqual(list(PromotionCode.objects.all()), [customer_code])
+        order.refresh_from_db()
+        self.assertEqual(order.promotion_code, customer_code)
+        self.assertFalse(Product.objects.exists())
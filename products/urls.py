@@ -1,12 +1,16 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = "products"
 
+# ASGI で動かす場合は、商品一覧・詳細・カート関連を非同期ビューに切り替える
+storefront = async_views if settings.ASYNC_VIEWS_ENABLED else views
+
 urlpatterns = [
     # --- 一般ユーザー向け ---
-    path("", views.product_list, name="product_list"),
-    path("products/<int:pk>/", views.product_detail, name="product_detail"),
+    path("", storefront.product_list, name="product_list"),
+    path("products/<int:pk>/", storefront.product_detail, name="product_detail"),
     # --- 管理者向け ---
     path("manage/products/", views.manage_product_list, name="manage_product_list"),
     path(
@@ -14,6 +18,16 @@ urlpatterns = [
         views.manage_product_create,
         name="manage_product_create",
     ),
+    path(
+        "manage/products/import/",
+        views.manage_product_import,
+        name="manage_product_import",
+    ),
+    path(
+        "manage/products/bulk/",
+        views.manage_product_bulk_action,
+        name="manage_product_bulk_action",
+    ),
     path(
         "manage/products/<int:pk>/edit/",
         views.manage_product_edit,
@@ -24,28 +38,53 @@ urlpatterns = [
         views.manage_product_delete,
         name="manage_product_delete",
     ),
+    path("manage/api/stock/", views.manage_stock_sync, name="manage_stock_sync"),
+    path(
+        "manage/api/orders/status/",
+        views.manage_order_status,
+        name="manage_order_status",
+    ),
     path("manage/orders/", views.manage_order_list, name="manage_order_list"),
     path(
         "manage/orders/<int:pk>/",
         views.manage_order_detail,
         name="manage_order_detail",
     ),
+    path(
+        "manage/orders/<int:pk>/cancel/",
+        views.manage_order_cancel,
+        name="manage_order_cancel",
+    ),
+    path(
+        "manage/sales/",
+        views.manage_sales_dashboard,
+        name="manage_sales_dashboard",
+    ),
     # --- カート関連 ---
-    path("cart/", views.cart_detail, name="cart_detail"),
+    path("cart/", storefront.cart_detail, name="cart_detail"),
     path("cart/add/<int:product_id>/", views.add_to_cart, name="add_to_cart"),
-    path("cart/update/<int:item_id>/", views.cart_item_update, name="cart_item_update"),
-    path("cart/delete/<int:item_id>/", views.cart_item_delete, name="cart_item_delete"),
+    path(
+        "cart/update/<int:item_id>/",
+        storefront.cart_item_update,
+        name="cart_item_update",
+    ),
+    path(
+        "cart/delete/<int:item_id>/",
+        storefront.cart_item_delete,
+        name="cart_item_delete",
+    ),
     path(
         "cart/promotion/apply/",
-        views.cart_promotion_apply,
+        storefront.cart_promotion_apply,
         name="cart_promotion_apply",
     ),
     path(
         "cart/promotion/remove/",
-        views.cart_promotion_remove,
+        storefront.cart_promotion_remove,
         name="cart_promotion_remove",
     ),
     # --- 注文関連 ---
+    path("order/hold/", views.checkout_hold, name="checkout_hold"),
     path("order/create/", views.order_create, name="order_create"),
     path("order/complete/", views.order_complete, name="order_complete"),
 ]
@@ -1,23 +1,88 @@
+import json
 import logging
+import time
 
-from django.http import JsonResponse, HttpRequest, HttpResponse
+from django.http import Http404, JsonResponse, HttpRequest, HttpResponse
 from django.contrib import messages
 from django.template.loader import render_to_string
+from django.core.paginator import Paginator
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.db import transaction
 from django.core.mail import send_mail
 from django.conf import settings
-from django.utils import timezone
-from products.services.cart import get_or_create_cart
-
-from .models import Product, Cart, CartItem, Order, OrderItem, PromotionCode
-from config.decorators import basic_auth_required as auth
-from .forms import ProductForm, OrderCreateForm, PromotionCodeApplyForm
+from products.services.cart import CartStore, ensure_session_key, get_cart_store
+from products.services.admission import AdmissionController, get_admission_controller
+from products.services.bulk_products import apply_bulk_action
+from products.services.catalog_import import detect_format, import_products
+from products.services.checkout_locks import (
+    LockBusy,
+    acquiring_locks,
+    apply_lock_timeout,
+    lock_nowait,
+)
+from products.services.idempotency import (
+    claim_idempotency_key,
+    find_order_id,
+    get_idempotency_key,
+    new_idempotency_key,
+)
+from products.services.product_archive import archive_products
+from products.services.promotions import redeem_promotion
+from products.services.holds import (
+    get_available_stock,
+    hold_cart_stock,
+    lock_available_products,
+    release_holds,
+)
+from products.services.order_status import can_transition, transition_orders
+from products.services.rollups import WATERMARK_NAME
+from products.services.stock import set_stock_levels
+from products.services.stock_sync import sync_stock
+
+from .models import (
+    Product,
+    CartItem,
+    Order,
+    OrderItem,
+    PromotionCode,
+    DailySalesRollup,
+    ProductSalesRollup,
+    SalesRollupWatermark,
+)
+from config.decorators import basic_auth_required as auth, read_from_replica
+from config.metrics import (
+    CART_MUTATIONS,
+    CHECKOUTS,
+    LOCK_WAIT,
+    ORDER_MAIL_DURATION,
+    PROMOTION_APPLY,
+)
+from .forms import (
+    ProductBulkActionForm,
+    ProductForm,
+    ProductImportUploadForm,
+    ProductListFilterForm,
+    OrderCreateForm,
+    PromotionCodeApplyForm,
+)
 from .utils import get_quantity_range
 
 logger = logging.getLogger(__name__)
 
+# 商品管理画面（一覧）のテーブルに表示する列（説明・画像は読み込まない）
+MANAGE_PRODUCT_LIST_FIELDS = (
+    "sku",
+    "name",
+    "price",
+    "stock",
+    "is_active",
+    "created_at",
+    "updated_at",
+)
+
 
 def _resolve_promotion(
     request: HttpRequest, cart_total: int
@@ -43,16 +108,32 @@ def _resolve_promotion(
         request.session.pop("promotion_code_id", None)
         return None, 0, cart_total
 
+    return _apply_promotion_discount(promotion, cart_total)
+
+
+def _apply_promotion_discount(
+    promotion: PromotionCode, cart_total: int
+) -> tuple[PromotionCode, int, int]:
+    """割引額を注文金額を上限として計算し、(promotion, 割引額, 割引後の合計) を返す。"""
     discount_amount = min(promotion.discount_amount, cart_total)
     discounted_total = max(cart_total - discount_amount, 0)
 
     return promotion, discount_amount, discounted_total
 
 
+def _calc_cart_totals(items: list[CartItem] | tuple[CartItem, ...]) -> tuple[int, int]:
+    """在庫がある明細のみを対象に (小計合計, 合計数量) を返す。"""
+    available_items = [item for item in items if item.product.stock > 0]
+    cart_total = sum(item.product.price * item.quantity for item in available_items)
+    total_quantity = sum(item.quantity for item in available_items)
+    return cart_total, total_quantity
+
+
 def _build_cart_summary_context(
     request: HttpRequest,
     items: list[CartItem] | tuple[CartItem, ...],
     promotion_form: PromotionCodeApplyForm | None = None,
+    resolved_promotion: tuple[PromotionCode | None, int, int] | None = None,
 ) -> dict:
     """カートの集計値とプロモーション情報をテンプレート用にまとめる。
 
@@ -60,6 +141,8 @@ def _build_cart_summary_context(
         request: プロモーション適用状況の解決に利用するリクエスト。
         items: カート内の明細。在庫なしの商品が含まれる場合がある。
         promotion_form: 画面に表示するクーポン入力フォーム。省略時は初期値を設定する。
+        resolved_promotion: 解決済みの `_resolve_promotion` の戻り値。
+            省略時はこの関数内で解決する（非同期ビューは事前に解決して渡す）。
 
     Returns:
         テンプレートへ渡す集計情報の辞書。以下のキーを含む。
@@ -71,17 +154,18 @@ def _build_cart_summary_context(
         - promotion_discount_amount: 割引額
         - payable_total: 割引適用後（未適用時は同額）の支払合計
         - promotion_form: プロモーション入力フォーム
+        - idempotency_key: 購入手続きのフォームに埋め込む冪等性キー
     """
-    available_items = [item for item in items if item.product.stock > 0]
-    cart_total = sum(item.product.price * item.quantity for item in available_items)
-    total_quantity = sum(item.quantity for item in available_items)
+    cart_total, total_quantity = _calc_cart_totals(items)
+    # 明細を読み込み済みなので、カートバッジも商品の在庫数から集計した値を使う
+    request.cart_total_quantity = total_quantity
     item_quantity_ranges = {
         item.product.id: get_quantity_range(item.product) for item in items
     }
 
-    promotion, promotion_discount_amount, payable_total = _resolve_promotion(
-        request, cart_total
-    )
+    if resolved_promotion is None:
+        resolved_promotion = _resolve_promotion(request, cart_total)
+    promotion, promotion_discount_amount, payable_total = resolved_promotion
 
     if promotion_form is None:
         initial = {"promotion_code": promotion.code} if promotion else None
@@ -96,32 +180,51 @@ def _build_cart_summary_context(
         "promotion_discount_amount": promotion_discount_amount,
         "payable_total": payable_total,
         "promotion_form": promotion_form,
+        "idempotency_key": new_idempotency_key(),
     }
 
 
 def _get_cart_items_from_session(session_key: str | None) -> list[CartItem]:
-    """セッションキーからカート明細を取得する。"""
-    if not session_key:
-        return []
+    """セッションキーからカート明細を取得する（保存先は CART_STORE_BACKEND による）。"""
+    return get_cart_store().get_lines(session_key)
 
-    cart = Cart.objects.filter(session_key=session_key).first()
-    if cart is None:
-        return []
 
-    return list(
-        CartItem.objects.select_related("product")
-        .filter(cart=cart)
-        .order_by("created_at")
-    )
+def _wants_cart_delta(request: HttpRequest) -> bool:
+    """カート操作の結果を差分 JSON で返すかどうか（`X-Cart-Response: delta`）。"""
+    return request.headers.get("x-cart-response") == "delta"
+
+
+def _build_cart_delta(
+    totals: dict, resolved_promotion: tuple[PromotionCode | None, int, int]
+) -> dict:
+    """ストアの集計値と `_resolve_promotion` の戻り値から、差分 JSON のカート部分を作る。"""
+    promotion, promotion_discount_amount, payable_total = resolved_promotion
+    return {
+        "item_count": totals["item_count"],
+        "total_quantity": totals["total_quantity"],
+        "cart_total": totals["cart_total"],
+        "promotion_code": promotion.code if promotion else None,
+        "promotion_discount_amount": promotion_discount_amount,
+        "payable_total": payable_total,
+    }
+
 
+def _get_cart_delta(request: HttpRequest, session_key: str | None) -> dict:
+    """明細を描画せずに、ストアの集計値だけでカートの合計・割引・バッジ数を求める。"""
+    totals = get_cart_store().totals(session_key)
+    resolved_promotion = _resolve_promotion(request, totals["cart_total"])
+    return _build_cart_delta(totals, resolved_promotion)
 
+
+@read_from_replica
 def product_list(request: HttpRequest) -> HttpResponse:
     """公開中の商品一覧ページを表示するビュー。"""
-    products = Product.objects.filter(is_active=True).order_by("-created_at")
+    products = Product.objects.live().filter(is_active=True).order_by("-created_at")
 
     return render(request, "products/product_list.html", {"products": products})
 
 
+@read_from_replica
 def product_detail(request: HttpRequest, pk: int) -> HttpResponse:
     """商品詳細ページを表示するビュー。
 
@@ -130,11 +233,12 @@ def product_detail(request: HttpRequest, pk: int) -> HttpResponse:
     - 在庫数に応じて数量選択肢（quantity_range）を生成する
     - 上記をテンプレートに渡し、商品詳細ページを描画する
     """
-    product = get_object_or_404(Product, pk=pk, is_active=True)
+    product = get_object_or_404(Product.objects.live(), pk=pk, is_active=True)
 
     # 自分自身（pk）が含まれないように除外し、新しい順に4件取得
     related_products = (
-        Product.objects.filter(is_active=True)
+        Product.objects.live()
+        .filter(is_active=True)
         .exclude(pk=pk)
         .order_by("-created_at")[:4]
     )
@@ -152,20 +256,228 @@ def product_detail(request: HttpRequest, pk: int) -> HttpResponse:
 
 
 @auth
+@read_from_replica
 def manage_product_list(request: HttpRequest) -> HttpResponse:
     """
     商品管理画面（一覧）を表示するビュー。
 
-    - Product を新しい順に全部取得する
-    - manage_product_list.html に渡してテーブルで一覧表示する
+    - 絞り込み（非公開・在庫切れ・在庫わずか・品番/商品名）と並び替えを GET パラメータで受け取る
+    - MANAGE_PRODUCTS_PER_PAGE 件ずつページに分け、表示する列だけを取得する
+    - 一括操作のフォームは manage_product_bulk_action に送信する
     """
-    products = Product.objects.all().order_by("-created_at")
+    filter_form = ProductListFilterForm(request.GET)
+    products = filter_form.filter(
+        Product.objects.live().only(*MANAGE_PRODUCT_LIST_FIELDS)
+    )
+    page = Paginator(products, settings.MANAGE_PRODUCTS_PER_PAGE).get_page(
+        request.GET.get("page")
+    )
     context = {
-        "products": products,
+        "filter_form": filter_form,
+        "querystring": filter_form.querystring(),
+        "page": page,
+        "products": page.object_list,
+        "bulk_actions": ProductBulkActionForm.ACTION_CHOICES,
     }
     return render(request, "manage/products/product_list.html", context)
 
 
+@auth
+@require_POST
+def manage_product_bulk_action(request: HttpRequest) -> HttpResponse:
+    """
+    商品管理画面：選んだ商品（または絞り込み結果のすべて）に一括操作を行うビュー。
+
+    - 公開・非公開・在庫数の設定・削除を、商品ごとではなくまとめて1回の UPDATE / DELETE で行う
+    - 削除は確認画面を表示し、確認後の POST（confirmed）で実行する
+    - 実行後は同じ絞り込み条件の一覧へリダイレクトする
+    """
+    form = ProductBulkActionForm(request.POST)
+    filter_form = ProductListFilterForm(request.POST)
+    querystring = filter_form.querystring()
+    list_url = reverse("products:manage_product_list")
+    if querystring:
+        list_url = f"{list_url}?{querystring}"
+
+    if not form.is_valid():
+        for errors in form.errors.values():
+            messages.error(request, " ".join(errors))
+        return redirect(list_url)
+
+    data = form.cleaned_data
+    if data["all_matching"]:
+        products = filter_form.filter(Product.objects.live())
+    else:
+        products = Product.objects.live().filter(pk__in=data["product_ids"])
+
+    if data["action"] == "delete" and not request.POST.get("confirmed"):
+        context = {
+            "form": form,
+            "filter_form": filter_form,
+            "count": products.count(),
+            "list_url": list_url,
+        }
+        return render(request, "manage/products/product_bulk_delete.html", context)
+
+    count = apply_bulk_action(products, data["action"], stock=data["stock"])
+    label = dict(ProductBulkActionForm.ACTION_CHOICES)[data["action"]]
+    messages.success(
+        request, f"{count}件の商品を{label.removesuffix('する')}しました。"
+    )
+    return redirect(list_url)
+
+
+@auth
+def manage_product_import(request: HttpRequest) -> HttpResponse:
+    """
+    商品をファイル（CSV / JSONL）から一括登録・更新するビュー（管理者向け）。
+
+    品番が既存の商品は更新し、ない商品は作成する。行ごとのエラーと処理速度を表示する。
+    """
+    result = None
+    if request.method == "POST":
+        form = ProductImportUploadForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data["file"]
+            try:
+                result = import_products(upload.file, detect_format(upload.name))
+            except ValueError as e:
+                form.add_error("file", str(e))
+    else:
+        form = ProductImportUploadForm()
+
+    context = {
+        "form": form,
+        "result": result,
+        "errors": result.errors[: settings.PRODUCT_IMPORT_MAX_ERRORS] if result else [],
+    }
+    return render(request, "manage/products/product_import.html", context)
+
+
+def _read_json_payload(request: HttpRequest) -> tuple[dict | None, JsonResponse | None]:
+    """
+    管理者向け JSON API のリクエスト本文を読み込み、(本文, エラーレスポンス) を返す。
+
+    JSON API は CSRF トークンを使わない代わりに Content-Type を application/json に
+    限定する（ブラウザのフォームからのクロスサイト送信を受け付けない）。
+    """
+    if request.content_type != "application/json":
+        return None, JsonResponse(
+            {
+                "ok": False,
+                "error": "Content-Type は application/json で送信してください。",
+            },
+            status=415,
+        )
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        return None, JsonResponse(
+            {"ok": False, "error": "JSON のオブジェクトを送信してください。"},
+            status=400,
+        )
+    return payload, None
+
+
+def _too_many_items(limit: int) -> JsonResponse:
+    return JsonResponse(
+        {"ok": False, "error": f"1回に送信できるのは {limit} 件までです。"},
+        status=413,
+    )
+
+
+@csrf_exempt
+@auth
+@require_POST
+def manage_stock_sync(request: HttpRequest) -> JsonResponse:
+    """
+    在庫数を一括で反映する JSON API（倉庫システムとの連携用、管理者向け）。
+
+    リクエスト: {"items": [{"sku": "SKU-1", "stock": 10}, {"sku": "SKU-2", "delta": -2}]}
+    レスポンス: {"ok", "total", "updated", "errors": [{"index", "error"}], "elapsed_ms"}
+    """
+    payload, error_response = _read_json_payload(request)
+    if error_response is not None:
+        return error_response
+    items = payload.get("items")
+    if not isinstance(items, list):
+        return JsonResponse(
+            {"ok": False, "error": "items に配列を指定してください。"}, status=400
+        )
+    if len(items) > settings.STOCK_SYNC_MAX_ITEMS:
+        return _too_many_items(settings.STOCK_SYNC_MAX_ITEMS)
+
+    result = sync_stock(enumerate(items), batch_size=settings.STOCK_SYNC_BATCH_SIZE)
+    return JsonResponse(
+        {
+            "ok": not result.errors,
+            "total": result.total_rows,
+            "updated": result.updated,
+            "errors": [
+                {"index": index, "error": error} for index, error in result.errors
+            ],
+            "elapsed_ms": round(result.elapsed * 1000, 1),
+        }
+    )
+
+
+@csrf_exempt
+@auth
+@require_POST
+def manage_order_status(request: HttpRequest) -> JsonResponse:
+    """
+    注文のステータスを一括で変更する JSON API（発送処理などの連携用、管理者向け）。
+
+    リクエスト: {"order_ids": [1, 2, 3], "status": "shipped"}
+        キャンセルでは "release_promotions": true でプロモーションコードを未使用に戻す
+    レスポンス: {"ok", "total", "updated", "errors": [{"order_id", "error"}],
+        "restocked_units", "released_promotions", "elapsed_ms"}
+
+    遷移のルール・キャンセル時の在庫の戻しは products.services.order_status を参照。
+    """
+    payload, error_response = _read_json_payload(request)
+    if error_response is not None:
+        return error_response
+    order_ids = payload.get("order_ids")
+    status = payload.get("status")
+    if not isinstance(order_ids, list) or not all(
+        isinstance(pk, int) and not isinstance(pk, bool) for pk in order_ids
+    ):
+        return JsonResponse(
+            {"ok": False, "error": "order_ids に注文IDの配列を指定してください。"},
+            status=400,
+        )
+    if status not in Order.Status.values:
+        return JsonResponse(
+            {"ok": False, "error": "status に変更後のステータスを指定してください。"},
+            status=400,
+        )
+    if len(order_ids) > settings.ORDER_STATUS_MAX_ITEMS:
+        return _too_many_items(settings.ORDER_STATUS_MAX_ITEMS)
+
+    result = transition_orders(
+        order_ids,
+        status,
+        release_promotions=payload.get("release_promotions") is True,
+    )
+    return JsonResponse(
+        {
+            "ok": not result.errors,
+            "total": result.total,
+            "updated": result.updated,
+            "errors": [
+                {"order_id": order_id, "error": error}
+                for order_id, error in result.errors
+            ],
+            "restocked_units": result.restocked_units,
+            "released_promotions": result.released_promotions,
+            "elapsed_ms": round(result.elapsed * 1000, 1),
+        }
+    )
+
+
 @auth
 def manage_product_create(request: HttpRequest) -> HttpResponse:
     """
@@ -177,7 +489,8 @@ def manage_product_create(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
         form = ProductForm(request.POST, request.FILES)
         if form.is_valid():
-            form.save()
+            product = form.save()
+            set_stock_levels({product.id: product.stock})
             return redirect("products:manage_product_list")
     else:
         # 初回アクセス時（GET）は空のフォームを表示
@@ -206,12 +519,14 @@ def manage_product_edit(request: HttpRequest, pk: int) -> HttpResponse:
         - POST の場合はフォーム入力内容をバリデーションし、問題なければ既存の Product インスタンスを更新する。
         - 更新後は管理用の商品一覧ページへリダイレクトする。
     """
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(Product.objects.live(), pk=pk)
 
     if request.method == "POST":
         form = ProductForm(request.POST, request.FILES, instance=product)
         if form.is_valid():
-            form.save()
+            product = form.save()
+            # 在庫数のキャッシュも DB と同じ値に更新する（write-through）
+            set_stock_levels({product.id: product.stock})
             return redirect("products:manage_product_list")
     else:
         form = ProductForm(instance=product)
@@ -230,12 +545,13 @@ def manage_product_delete(request: HttpRequest, pk: int) -> HttpResponse:
     商品管理画面：商品を削除するビュー。
 
     - GET: 対象商品の情報を表示し、「本当に削除してよいか」確認画面を出す
-    - POST: 実際に Product を削除して一覧へリダイレクト
+    - POST: Product を削除済み（アーカイブ）にして一覧へリダイレクト
+      （行は DELETE しないため、カートの明細・注文履歴への波及でチェックアウトを待たせない）
     """
-    product = get_object_or_404(Product, pk=pk)
+    product = get_object_or_404(Product.objects.live(), pk=pk)
 
     if request.method == "POST":
-        product.delete()
+        archive_products(Product.objects.filter(pk=pk))
         return redirect("products:manage_product_list")
 
     # 初回アクセス時（GET）は確認画面用テンプレートを表示
@@ -246,16 +562,25 @@ def manage_product_delete(request: HttpRequest, pk: int) -> HttpResponse:
 
 
 @auth
+@read_from_replica
 def manage_order_list(request: HttpRequest) -> HttpResponse:
-    """購入明細一覧を表示するビュー（管理者向け）。"""
-    orders = Order.objects.order_by("-created_at")
+    """購入明細一覧を表示するビュー（管理者向け）。MANAGE_ORDERS_PER_PAGE 件ずつページに分ける。"""
+    # 一覧でプロモーションコードを参照するため、N+1 にならないよう JOIN で取得する
+    orders = Order.objects.select_related("promotion_code").order_by(
+        "-created_at", "-pk"
+    )
+    page = Paginator(orders, settings.MANAGE_ORDERS_PER_PAGE).get_page(
+        request.GET.get("page")
+    )
     context = {
-        "orders": orders,
+        "page": page,
+        "orders": page.object_list,
     }
     return render(request, "manage/orders/order_list.html", context)
 
 
 @auth
+@read_from_replica
 def manage_order_detail(request: HttpRequest, pk: int) -> HttpResponse:
     """購入明細詳細を表示するビュー（管理者向け）。"""
     order = get_object_or_404(
@@ -265,10 +590,69 @@ def manage_order_detail(request: HttpRequest, pk: int) -> HttpResponse:
     context = {
         "order": order,
         "items": order.items.order_by("created_at"),
+        "status_changes": order.status_changes.order_by("changed_at", "pk"),
+        "can_cancel": can_transition(order.status, Order.Status.CANCELLED),
     }
     return render(request, "manage/orders/order_detail.html", context)
 
 
+@auth
+@require_POST
+def manage_order_cancel(request: HttpRequest, pk: int) -> HttpResponse:
+    """
+    注文をキャンセルするビュー（管理者向け）。
+
+    注文明細の数量を在庫に戻し、チェックした場合はプロモーションコードを未使用に戻す。
+    """
+    result = transition_orders(
+        [pk],
+        Order.Status.CANCELLED,
+        release_promotions=request.POST.get("release_promotions") == "1",
+    )
+    if result.errors:
+        for _, error in result.errors:
+            messages.error(request, error)
+    else:
+        message = f"注文をキャンセルし、在庫を {result.restocked_units} 個戻しました。"
+        if result.released_promotions:
+            message += "プロモーションコードを未使用に戻しました。"
+        messages.success(request, message)
+    return redirect("products:manage_order_detail", pk=pk)
+
+
+@auth
+@read_from_replica
+def manage_sales_dashboard(request: HttpRequest) -> HttpResponse:
+    """
+    売上ダッシュボードを表示するビュー（管理者向け）。
+
+    注文・注文明細は読まず、rollup_sales コマンドが更新する集計テーブルだけを読むため、
+    注文の件数によらず一定の時間で表示できる。
+    """
+    days = list(
+        DailySalesRollup.objects.order_by("-date")[: settings.SALES_DASHBOARD_DAYS]
+    )
+    period = {
+        field: sum(getattr(day, field) for day in days)
+        for field in (
+            "order_count",
+            "units_sold",
+            "revenue",
+            "discount_total",
+            "promotion_redemptions",
+        )
+    }
+    context = {
+        "days": days,
+        "period": period,
+        "top_products": ProductSalesRollup.objects.select_related("product").order_by(
+            "-revenue"
+        )[: settings.SALES_DASHBOARD_TOP_PRODUCTS],
+        "watermark": SalesRollupWatermark.objects.filter(name=WATERMARK_NAME).first(),
+    }
+    return render(request, "manage/sales/dashboard.html", context)
+
+
 def cart_detail(request: HttpRequest) -> HttpResponse:
     """カートの中身を表示するビュー。"""
     session_key = request.session.session_key
@@ -286,8 +670,8 @@ def add_to_cart(request: HttpRequest, product_id: int) -> HttpResponse:
     - 一覧画面からの追加: 数量は常に 1
     - 詳細画面からの追加: フォームから送られてきた quantity を使う
     """
-    cart = get_or_create_cart(request)
-    product = get_object_or_404(Product, pk=product_id)
+    session_key = ensure_session_key(request)
+    product = get_object_or_404(Product.objects.live(), pk=product_id)
 
     # 詳細画面から quantity が送られてくる想定。
     # 一覧画面からの追加は常に 1
@@ -310,9 +694,8 @@ def add_to_cart(request: HttpRequest, product_id: int) -> HttpResponse:
             return redirect(redirect_url)
         return redirect("products:product_list")
 
-    existing_item = CartItem.objects.filter(cart=cart, product=product).first()
-    existing_quantity = existing_item.quantity if existing_item else 0
-    if existing_quantity + quantity > product.stock:
+    # 既存の数量との合計が在庫を超える場合は追加しない（1文で判定・追加する）
+    if get_cart_store().add(session_key, product, quantity) is None:
         messages.error(
             request,
             f"在庫数を超えるためカートに追加できません。（{product.name}）",
@@ -321,11 +704,7 @@ def add_to_cart(request: HttpRequest, product_id: int) -> HttpResponse:
             return redirect(redirect_url)
         return redirect("products:product_list")
 
-    if existing_item:
-        existing_item.quantity += quantity
-        existing_item.save()
-    else:
-        CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    CART_MUTATIONS.labels("add").inc()
 
     return redirect("products:cart_detail")
 
@@ -337,8 +716,10 @@ def cart_item_update(request: HttpRequest, item_id: int) -> HttpResponse:
     if session_key is None:
         return JsonResponse({"ok": False}, status=400)
 
-    cart = get_object_or_404(Cart, session_key=session_key)
-    item = get_object_or_404(CartItem, id=item_id, cart=cart)
+    store = get_cart_store()
+    item = store.get_line(session_key, item_id)
+    if item is None:
+        raise Http404
 
     raw_quantity = request.POST.get("quantity", "")
     try:
@@ -357,14 +738,23 @@ def cart_item_update(request: HttpRequest, item_id: int) -> HttpResponse:
     if quantity > max_quantity:
         quantity = max_quantity
 
-    item.quantity = quantity
-    item.save()
+    store.set_quantity(session_key, item, quantity)
+    CART_MUTATIONS.labels("update").inc()
 
-    items = list(
-        CartItem.objects.select_related("product")
-        .filter(cart=cart)
-        .order_by("created_at")
-    )
+    if _wants_cart_delta(request):
+        return JsonResponse(
+            {
+                "ok": True,
+                "item": {
+                    "id": item.id,
+                    "quantity": quantity,
+                    "line_total": item.product.price * quantity,
+                },
+                "cart": _get_cart_delta(request, session_key),
+            }
+        )
+
+    items = store.get_lines(session_key)
     context = _build_cart_summary_context(request, items)
 
     html = render_to_string("cart/_cart_summary.html", context, request=request)
@@ -387,7 +777,7 @@ def cart_item_delete(request: HttpRequest, item_id: int) -> HttpResponse:
 
     通常リクエストの場合はカート詳細ページへリダイレクトし、
     Ajax（XMLHttpRequest）の場合は、削除後のカートサマリーHTMLと
-    合計数量を JSON で返す。
+    合計数量を JSON で返す（差分モードの場合は削除した明細のIDと集計値のみ）。
     """
     session_key = request.session.session_key
     if session_key is None:
@@ -395,16 +785,22 @@ def cart_item_delete(request: HttpRequest, item_id: int) -> HttpResponse:
             return JsonResponse({"ok": False}, status=400)
         return redirect("products:cart_detail")
 
-    cart = get_object_or_404(Cart, session_key=session_key)
-    item = get_object_or_404(CartItem, id=item_id, cart=cart)
-    item.delete()
+    store = get_cart_store()
+    if not store.remove(session_key, item_id):
+        raise Http404
+    CART_MUTATIONS.labels("delete").inc()
 
-    if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        items = list(
-            CartItem.objects.select_related("product")
-            .filter(cart=cart)
-            .order_by("created_at")
+    if _wants_cart_delta(request):
+        return JsonResponse(
+            {
+                "ok": True,
+                "removed_item_id": item_id,
+                "cart": _get_cart_delta(request, session_key),
+            }
         )
+
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        items = store.get_lines(session_key)
         context = _build_cart_summary_context(request, items)
 
         html = render_to_string("cart/_cart_summary.html", context, request=request)
@@ -428,8 +824,21 @@ def cart_promotion_apply(request: HttpRequest) -> HttpResponse:
     form = PromotionCodeApplyForm(request.POST)
     if form.is_valid() and form.promotion is not None:
         request.session["promotion_code_id"] = form.promotion.id
+        PROMOTION_APPLY.labels("success").inc()
+    else:
+        PROMOTION_APPLY.labels("failure").inc()
 
     session_key = request.session.session_key
+    if _wants_cart_delta(request):
+        errors = form.errors.get("promotion_code")
+        return JsonResponse(
+            {
+                "ok": form.is_valid(),
+                "error": errors[0] if errors else None,
+                "cart": _get_cart_delta(request, session_key),
+            }
+        )
+
     items = _get_cart_items_from_session(session_key)
 
     context = _build_cart_summary_context(request, items, promotion_form=form)
@@ -456,6 +865,9 @@ def cart_promotion_remove(request: HttpRequest) -> HttpResponse:
         request.session.create()
 
     session_key = request.session.session_key
+    if _wants_cart_delta(request):
+        return JsonResponse({"ok": True, "cart": _get_cart_delta(request, session_key)})
+
     items = _get_cart_items_from_session(session_key)
 
     form = PromotionCodeApplyForm()
@@ -476,6 +888,8 @@ def cart_promotion_remove(request: HttpRequest) -> HttpResponse:
 
 def _send_mail_after_commit(order_id: int) -> None:
     """注文確認メールを送信するビュー。"""
+    started = time.perf_counter()
+    result = "success"
     try:
         order = Order.objects.prefetch_related("items").get(pk=order_id)
 
@@ -497,158 +911,350 @@ def _send_mail_after_commit(order_id: int) -> None:
         )
     except Exception:
         # 注文自体は確定済みなので、メール失敗で注文フローを壊さない（ログだけ残す）
+        result = "failure"
         logger.exception(
             "Failed to send order confirmation email (order_id=%s)", order_id
         )
+    finally:
+        ORDER_MAIL_DURATION.labels(result).observe(time.perf_counter() - started)
+
+
+def _reconcile_cart_stock(
+    request: HttpRequest,
+    store,
+    session_key: str,
+    items: list,
+    available: dict[int, int],
+) -> bool:
+    """
+    購入可能数と照らしてカートを確認し、注文を確定できない場合は True を返す。
+
+    - 商品が存在しない・購入可能数が0: エラーメッセージを表示する
+    - 購入可能数が数量より少ない: 数量を購入可能数に合わせ、警告メッセージを表示する
+    """
+    has_problems = False
+    for item in items:
+        if item.product_id not in available:
+            messages.error(
+                request,
+                f"商品が存在しないため購入できません。カートから削除してください。（{item.product.name}）",
+            )
+            has_problems = True
+            continue
+
+        if available[item.product_id] <= 0:
+            messages.error(
+                request,
+                f"在庫切れのためご注文を確定できません。カートから削除してください。（{item.product.name}）",
+            )
+            has_problems = True
+            continue
+
+        if available[item.product_id] < item.quantity:
+            store.set_quantity(session_key, item, available[item.product_id])
+            messages.warning(
+                request,
+                f"在庫数に合わせて数量を変更しました。（{item.product.name}）",
+            )
+            has_problems = True
+    return has_problems
+
+
+@require_POST
+def checkout_hold(request: HttpRequest) -> JsonResponse:
+    """
+    購入手続きの開始時に、カートの数量分の在庫を STOCK_HOLD_TTL 秒だけ確保するビュー。
+
+    確保できなかった商品は数量を購入可能数に合わせ、ok=False を返す
+    （画面側で再読み込みし、メッセージと調整後のカートを表示する）。
+    """
+    session_key = request.session.session_key
+    store = get_cart_store()
+    items = store.get_lines(session_key)
+    if not items:
+        return JsonResponse({"ok": True, "expires_in": 0})
+
+    shortages = hold_cart_stock(session_key, items)
+    available = {item.product_id: item.quantity for item in items} | shortages
+    _reconcile_cart_stock(request, store, session_key, items, available)
+    return JsonResponse({"ok": not shortages, "expires_in": settings.STOCK_HOLD_TTL})
+
+
+def _replay_order(request: HttpRequest, order_id: int) -> HttpResponse:
+    """冪等性キーで作成済みの注文の結果（注文完了ページへのリダイレクト）を返す。"""
+    CHECKOUTS.labels("replayed").inc()
+    request.session["last_order_id"] = order_id
+    return redirect("products:order_complete")
+
+
+# 待合室に入ってもセッションに預からない項目（待合室のページで入力し直してもらう）
+CHECKOUT_CARD_FIELDS = ("card_number", "card_expire", "card_cvv", "card_holder")
 
 
 @require_POST
 def order_create(request: HttpRequest) -> HttpResponse:
     """注文を作成するビュー。"""
-    form = OrderCreateForm(request.POST)
+    data = request.POST
+    if request.POST.get("resume"):
+        # 待合室からの再送信は、預かった入力内容（カード情報を除く）と、
+        # 待合室のページで入力し直したカード情報で処理する
+        data = {
+            **request.session.get("checkout_pending", {}),
+            **{name: request.POST.get(name, "") for name in CHECKOUT_CARD_FIELDS},
+        }
+    form = OrderCreateForm(data)
 
     session_key = request.session.session_key
     if not session_key:
         request.session.create()
         session_key = request.session.session_key
 
-    cart = Cart.objects.filter(session_key=session_key).first()
-    if not cart:
-        messages.warning(request, "カートに商品がありません。")
-        return redirect("products:product_list")
-
-    cart_items = (
-        CartItem.objects.select_related("product")
-        .filter(cart=cart)
-        .order_by("created_at")
-    )
-    if not cart_items.exists():
+    # 同じキーで作成済みの注文があれば、カート・在庫・ロックに触れずにその結果を返す
+    idempotency_key = get_idempotency_key(request)
+    if idempotency_key:
+        order_id = find_order_id(session_key, idempotency_key)
+        if order_id is not None:
+            return _replay_order(request, order_id)
+
+    store = get_cart_store()
+    items = store.get_lines(session_key)
+    if not items:
+        CHECKOUTS.labels("empty_cart").inc()
         messages.warning(request, "カートに商品がありません。")
         return redirect("products:product_list")
 
+    # 入力に誤りのある注文は、入場の枠を取らずに入力画面へ戻す
     if not form.is_valid():
-        items = list(cart_items)
-        product_ids = [item.product_id for item in items]
-        current_products = Product.objects.in_bulk(product_ids)
-        for item in items:
-            current_product = current_products.get(item.product_id)
-            if current_product:
-                item.product = current_product
-                if current_product.stock > 0 and item.quantity > current_product.stock:
-                    item.quantity = current_product.stock
-                    item.save(update_fields=["quantity"])
-                    messages.warning(
-                        request,
-                        f"在庫数に合わせて数量を変更しました。（{current_product.name}）",
-                    )
+        return _invalid_order_form_response(request, form, store, session_key, items)
+
+    # 同時に処理する注文の数を制限し、入れなかった注文は行ロックを待たずに待合室へ回す
+    admission_control = get_admission_controller()
+    admission = None
+    if admission_control.enabled:
+        admission = admission_control.acquire(item.product_id for item in items)
+        if admission is None:
+            return _checkout_queue_response(request, admission_control, items)
+        if request.session.pop("checkout_ticket", None) is not None:
+            admission_control.mark_admitted()
+        request.session.pop("checkout_pending", None)
 
-        context = _build_cart_summary_context(request, items)
-        context["form"] = form
-        return render(request, "cart/cart_detail.html", context)
+    try:
+        return _create_order(request, form, store, session_key, items, idempotency_key)
+    finally:
+        if admission is not None:
+            admission_control.release(admission)
 
-    order: Order | None = None
 
-    with transaction.atomic():
-        items = list(cart_items)
-        product_ids = [item.product_id for item in items]
-        locked_products = Product.objects.select_for_update().in_bulk(product_ids)
-
-        has_errors = False
-        has_adjustments = False
-        for item in items:
-            product = locked_products.get(item.product_id)
-            if product is None:
-                messages.error(
-                    request,
-                    f"商品が存在しないため購入できません。カートから削除してください。（{item.product.name}）",
-                )
-                has_errors = True
-                continue
+def _checkout_queue_response(
+    request: HttpRequest,
+    admission_control: AdmissionController,
+    items: list[CartItem],
+) -> HttpResponse:
+    """注文確定に入れなかった場合の待合室のページを返す（商品・在庫は読み込まない）。"""
+    CHECKOUTS.labels("queued").inc()
+    ticket = request.session.get("checkout_ticket")
+    if ticket is None:
+        ticket = admission_control.take_ticket()
+        request.session["checkout_ticket"] = ticket
+    if not request.POST.get("resume"):
+        # 入力内容はページに埋め込まず、セッションに預かる。カード情報はセッション（DB）にも
+        # 残さず、待合室のページで入力し直してもらう
+        request.session["checkout_pending"] = {
+            name: value
+            for name, value in request.POST.items()
+            if name not in CHECKOUT_CARD_FIELDS and name != "csrfmiddlewaretoken"
+        }
+    # SessionMiddleware は 5xx のレスポンスではセッションを保存しないため、ここで保存する
+    request.session.save()
+    # カートバッジは読み込み済みの明細から数える
+    request.cart_total_quantity = sum(item.quantity for item in items)
 
-            item.product = product
+    response = render(
+        request,
+        "orders/checkout_queue.html",
+        {
+            "position": admission_control.position(ticket),
+            "retry_after": settings.CHECKOUT_RETRY_AFTER,
+            # 再送信するのは冪等性キーだけ（入力内容はセッションから読み直す）
+            "idempotency_key": get_idempotency_key(request) or "",
+        },
+        status=503,
+    )
+    response["Retry-After"] = str(settings.CHECKOUT_RETRY_AFTER)
+    return response
 
-            if product.stock <= 0:
-                messages.error(
-                    request,
-                    f"在庫切れのためご注文を確定できません。カートから削除してください。（{product.name}）",
-                )
-                has_errors = True
-                continue
 
-            if product.stock < item.quantity:
-                item.quantity = product.stock
-                item.save(update_fields=["quantity"])
+def _invalid_order_form_response(
+    request: HttpRequest,
+    form: OrderCreateForm,
+    store: CartStore,
+    session_key: str,
+    items: list[CartItem],
+) -> HttpResponse:
+    """入力に誤りがある場合に、エラーを付けたカートのページを返す。"""
+    CHECKOUTS.labels("invalid_form").inc()
+    product_ids = [item.product_id for item in items]
+    current_products = Product.objects.live().in_bulk(product_ids)
+    for item in items:
+        current_product = current_products.get(item.product_id)
+        if current_product:
+            item.product = current_product
+            if current_product.stock > 0 and item.quantity > current_product.stock:
+                store.set_quantity(session_key, item, current_product.stock)
                 messages.warning(
                     request,
-                    f"在庫数に合わせて数量を変更しました。（{product.name}）",
-                )
-                has_adjustments = True
-
-        if has_errors or has_adjustments:
-            context = _build_cart_summary_context(request, items)
-            context["form"] = form
-            return render(request, "cart/cart_detail.html", context)
-
-        # 在庫を更新
-        for item in items:
-            product = locked_products[item.product_id]
-            product.stock -= item.quantity
-            product.save(update_fields=["stock"])
-
-        # 注文を作成
-        order = form.save(commit=False)
-
-        total_amount = 0
-        # OrderItemをまとめてINSERTしてDB往復回数を減らす
-        order_items: list[OrderItem] = []
-
-        for item in items:
-            product = locked_products[item.product_id]
-            total_amount += product.price * item.quantity
-            order_items.append(
-                OrderItem(
-                    order=order,
-                    product=product,
-                    product_name=product.name,  # 注文時点の商品名
-                    price=product.price,  # 注文時点の単価
-                    quantity=item.quantity,
+                    f"在庫数に合わせて数量を変更しました。（{current_product.name}）",
                 )
-            )
 
-        promotion = None
-        promotion_discount_amount = 0
-        promo_id = request.session.get("promotion_code_id")
-        if promo_id:
-            promotion = (
-                PromotionCode.objects.select_for_update()
-                .filter(id=promo_id, is_used=False)
-                .first()
-            )
-            if not promotion:
-                request.session.pop("promotion_code_id", None)
-        if promotion:
-            promotion_discount_amount = min(promotion.discount_amount, total_amount)
+    context = _build_cart_summary_context(request, items)
+    context["form"] = form
+    return render(request, "cart/cart_detail.html", context)
+
 
-        order.total_amount = max(total_amount - promotion_discount_amount, 0)
-        order.promotion_code = promotion
-        if promotion:
-            # 注文時点のプロモーション割引額
-            order.promotion_discount_amount = promotion_discount_amount
-        order.save()
+def _create_order(
+    request: HttpRequest,
+    form: OrderCreateForm,
+    store: CartStore,
+    session_key: str,
+    items: list[CartItem],
+    idempotency_key: str | None,
+) -> HttpResponse:
+    """検証済みの入力内容で、在庫の行ロックを取って注文を作成する。"""
+    product_ids = [item.product_id for item in items]
+
+    # 他のカートが確保中の在庫を除いた購入可能数で、ロックを取る前に判定する
+    # （在庫の取り合いに負けたリクエストは、ここで行ロックを待たずに戻る）
+    available = get_available_stock(product_ids, exclude_session_key=session_key)
+    if _reconcile_cart_stock(request, store, session_key, items, available):
+        CHECKOUTS.labels("stock_rejected").inc()
+        context = _build_cart_summary_context(request, items)
+        context["form"] = form
+        return render(request, "cart/cart_detail.html", context)
 
-        OrderItem.objects.bulk_create(order_items)
-        cart.delete()
+    order: Order | None = None
 
-        if promotion:
-            promotion.is_used = True
-            promotion.used_at = timezone.now()
-            promotion.save(update_fields=["is_used", "used_at"])
-            request.session.pop("promotion_code_id", None)
+    try:
+        with transaction.atomic():
+            apply_lock_timeout()
+            # 商品 → プロモーションコードの順に、商品は主キーの順にロックを取る
+            with LOCK_WAIT.labels("product").time(), acquiring_locks():
+                locked_products = lock_available_products(
+                    product_ids, exclude_session_key=session_key, nowait=lock_nowait()
+                )
 
-        order_id = order.id
-        transaction.on_commit(lambda: _send_mail_after_commit(order_id))
+            for item in items:
+                if item.product_id in locked_products:
+                    item.product = locked_products[item.product_id]
+            available = {
+                pk: max(product.available, 0) for pk, product in locked_products.items()
+            }
+
+            if _reconcile_cart_stock(request, store, session_key, items, available):
+                CHECKOUTS.labels("stock_rejected").inc()
+                context = _build_cart_summary_context(request, items)
+                context["form"] = form
+                return render(request, "cart/cart_detail.html", context)
+
+            # 在庫を更新（明細ごとに UPDATE せず、1回の bulk_update にまとめる）
+            for item in items:
+                locked_products[item.product_id].stock -= item.quantity
+            Product.objects.bulk_update(
+                [locked_products[item.product_id] for item in items], ["stock"]
+            )
+            # 在庫数のキャッシュは、コミットされた在庫数で更新する（write-through）
+            stock_levels = {
+                item.product_id: locked_products[item.product_id].stock
+                for item in items
+            }
+            transaction.on_commit(lambda: set_stock_levels(stock_levels))
+
+            # 注文を作成
+            order = form.save(commit=False)
+
+            total_amount = 0
+            # OrderItemをまとめてINSERTしてDB往復回数を減らす
+            order_items: list[OrderItem] = []
+
+            for item in items:
+                product = locked_products[item.product_id]
+                total_amount += product.price * item.quantity
+                order_items.append(
+                    OrderItem(
+                        order=order,
+                        product=product,
+                        product_name=product.name,  # 注文時点の商品名
+                        price=product.price,  # 注文時点の単価
+                        quantity=item.quantity,
+                    )
+                )
+
+            promotion = None
+            promotion_discount_amount = 0
+            promo_id = request.session.get("promotion_code_id")
+            if promo_id:
+                # コードの行はロックしない（利用上限は確定直前の条件付き UPDATE で判定する）
+                promotion = PromotionCode.objects.filter(
+                    id=promo_id, is_used=False
+                ).first()
+                if not promotion:
+                    request.session.pop("promotion_code_id", None)
+            if promotion:
+                promotion_discount_amount = min(promotion.discount_amount, total_amount)
+
+            order.total_amount = max(total_amount - promotion_discount_amount, 0)
+            order.promotion_code = promotion
+            if promotion:
+                # 注文時点のプロモーション割引額
+                order.promotion_discount_amount = promotion_discount_amount
+            order.save()
+            if idempotency_key and not claim_idempotency_key(
+                session_key, idempotency_key, order
+            ):
+                # 同じキーの送信が先に注文を確定した（この注文はロールバックして、先の注文を返す）
+                replayed_order_id = find_order_id(session_key, idempotency_key)
+                transaction.set_rollback(True)
+                return _replay_order(request, replayed_order_id)
+
+            OrderItem.objects.bulk_create(order_items)
+
+            if promotion:
+                # 利用回数の加算は行ロックを取るため、カートを空にする直前（コミットの直前）に行う
+                with LOCK_WAIT.labels("promotion_code").time(), acquiring_locks():
+                    redeemed = redeem_promotion(promotion, order)
+                request.session.pop("promotion_code_id", None)
+                if not redeemed:
+                    # 他の注文で利用上限に達した（この注文はロールバックし、コードを外して確認してもらう）
+                    transaction.set_rollback(True)
+                    CHECKOUTS.labels("promotion_exhausted").inc()
+                    messages.error(
+                        request,
+                        "プロモーションコードの利用上限に達したため、コードを外しました。"
+                        "金額をご確認のうえ、もう一度ご注文ください。",
+                    )
+                    return redirect("products:cart_detail")
+
+            # カートはここで初めて DB の注文になる（KV ストアの場合も注文確定時にだけ書き込む）
+            store.clear(session_key)
+            # 確保していた在庫は在庫数から差し引いたので、確保を解除する
+            release_holds(session_key)
+
+            order_id = order.id
+            transaction.on_commit(lambda: _send_mail_after_commit(order_id))
+    except LockBusy:
+        # 他の注文が同じ商品・コードをロックしている（カートはそのまま残し、再試行してもらう）
+        CHECKOUTS.labels("lock_busy").inc()
+        messages.warning(
+            request,
+            "ただいま注文が混み合っています。少し待ってからもう一度お試しください。",
+        )
+        context = _build_cart_summary_context(request, items)
+        context["form"] = form
+        response = render(request, "cart/cart_detail.html", context, status=503)
+        response["Retry-After"] = str(settings.CHECKOUT_RETRY_AFTER)
+        return response
 
     assert order is not None
+    CHECKOUTS.labels("completed").inc()
     request.session["last_order_id"] = order.id
     messages.success(request, "注文完了メールを送信しました。")
     return redirect("products:order_complete")
@@ -1,6 +1,12 @@
-// カート数量変更（右ペイン）を fetch 化して、右ペインだけ更新
+// カート操作（右ペイン）を fetch 化して、サーバーから受け取った差分だけ画面に反映する
+// （X-Cart-Response: delta を付けると、HTML ではなく集計値のみの JSON が返る）
+const CART_DELTA_HEADERS = {
+  "X-Requested-With": "XMLHttpRequest",
+  "X-Cart-Response": "delta",
+};
+
+// ① 右ペイン：カート数量変更フォームを fetch 化
 document.addEventListener("DOMContentLoaded", () => {
-  // ① 右ペイン：カート数量変更フォームを fetch 化
   const summary = document.getElementById("cart-summary");
   if (!summary) {
     return;
@@ -37,36 +43,15 @@ document.addEventListener("DOMContentLoaded", () => {
     formData.append("quantity", target.value);
     formData.append("csrfmiddlewaretoken", csrfToken);
 
-    try {
-      const res = await fetch(url, {
-        method: "POST",
-        body: formData,
-        headers: {
-          "X-Requested-With": "XMLHttpRequest",
-        },
-      });
-
-      if (!res.ok) {
-        window.location.reload();
-        return;
-      }
-
-      const data = await res.json();
-      if (!data.ok || !data.html) {
-        window.location.reload();
-        return;
-      }
-
-      summary.innerHTML = data.html;
-
-      // ナビゲーションバーのカートバッジを更新
-      const cartBadge = document.getElementById("cart-badge");
-      if (cartBadge && typeof data.total_quantity !== "undefined") {
-        cartBadge.textContent = data.total_quantity;
-      }
-    } catch (e) {
+    const data = await postCartDelta(url, formData);
+    if (!data?.ok || !data.item) {
       window.location.reload();
+      return;
     }
+
+    // 在庫数で丸められた場合に備えて、サーバーの数量に合わせる
+    target.value = String(data.item.quantity);
+    applyCartDelta(summary, data.cart);
   });
 });
 
@@ -104,35 +89,16 @@ document.addEventListener("DOMContentLoaded", () => {
     const formData = new FormData();
     formData.append("csrfmiddlewaretoken", csrfToken);
 
-    try {
-      const res = await fetch(url, {
-        method: "POST",
-        body: formData,
-        headers: {
-          "X-Requested-With": "XMLHttpRequest",
-        },
-      });
-
-      if (!res.ok) {
-        window.location.reload();
-        return;
-      }
-
-      const data = await res.json();
-      if (!data.ok || !data.html) {
-        window.location.reload();
-        return;
-      }
-
-      summary.innerHTML = data.html;
-
-      const cartBadge = document.getElementById("cart-badge");
-      if (cartBadge && typeof data.total_quantity !== "undefined") {
-        cartBadge.textContent = data.total_quantity;
-      }
-    } catch (e) {
+    const data = await postCartDelta(url, formData);
+    if (!data?.ok) {
       window.location.reload();
+      return;
     }
+
+    summary
+      .querySelector(`[data-cart-item-id="${data.removed_item_id}"]`)
+      ?.remove();
+    applyCartDelta(summary, data.cart);
   });
 });
 
@@ -174,35 +140,24 @@ document.addEventListener("DOMContentLoaded", () => {
       formData.append("csrfmiddlewaretoken", csrfToken);
     }
 
-    try {
-      const res = await fetch(url, {
-        method: "POST",
-        body: formData,
-        headers: {
-          "X-Requested-With": "XMLHttpRequest",
-        },
-      });
-
-      if (!res.ok) {
-        window.location.reload();
-        return;
-      }
-
-      const data = await res.json();
-      if (!data.html) {
-        window.location.reload();
-        return;
-      }
-
-      summary.innerHTML = data.html;
-
-      const cartBadge = document.getElementById("cart-badge");
-      if (cartBadge && typeof data.total_quantity !== "undefined") {
-        cartBadge.textContent = data.total_quantity;
-      }
-    } catch (e) {
+    const data = await postCartDelta(url, formData);
+    if (!data?.cart) {
       window.location.reload();
+      return;
+    }
+
+    const input = summary.querySelector("[data-promotion-input]");
+    const feedback = summary.querySelector("[data-promotion-error]");
+    if (input && isRemoveForm) {
+      input.value = "";
+    }
+    input?.classList.toggle("is-invalid", Boolean(data.error));
+    if (feedback) {
+      feedback.textContent = data.error || "";
+      feedback.classList.toggle("d-block", Boolean(data.error));
     }
+
+    applyCartDelta(summary, data.cart);
   });
 });
 
@@ -523,7 +478,116 @@ document.addEventListener("DOMContentLoaded", () => {
   });
 });
 
+// ⑥ 購入手続きの開始時（フォームに最初に入力しようとしたとき）に在庫を確保する
+document.addEventListener("DOMContentLoaded", () => {
+  const form = document.getElementById("checkout-form");
+  const url = form?.dataset.holdUrl;
+  if (!url) {
+    return;
+  }
+
+  const csrfToken = form.querySelector(
+    'input[name="csrfmiddlewaretoken"]',
+  )?.value;
+  if (!csrfToken) {
+    return;
+  }
+
+  form.addEventListener(
+    "focusin",
+    async () => {
+      const formData = new FormData();
+      formData.append("csrfmiddlewaretoken", csrfToken);
+
+      const data = await postCartDelta(url, formData);
+      // 在庫を確保できなかった場合は、調整後のカートとメッセージを表示する
+      if (data && !data.ok) {
+        window.location.reload();
+      }
+    },
+    { once: true },
+  );
+});
+
+// ⑦ 注文の待合室：Retry-After の秒数ごとに、カード情報の入力が済んでいれば再送信する
+//    （カード以外の入力内容はサーバーが預かっている）
+document.addEventListener("DOMContentLoaded", () => {
+  const form = document.getElementById("checkout-queue-form");
+  if (!form) {
+    return;
+  }
+
+  const seconds = Number(form.dataset.retryAfter) || 1;
+  const retry = () => {
+    if (form.checkValidity()) {
+      form.submit();
+    } else {
+      window.setTimeout(retry, seconds * 1000);
+    }
+  };
+  window.setTimeout(retry, seconds * 1000);
+});
+
 // 共通ユーティリティ
+// カート操作を POST し、差分 JSON を返す（失敗時は null）
+async function postCartDelta(url, formData) {
+  try {
+    const res = await fetch(url, {
+      method: "POST",
+      body: formData,
+      headers: CART_DELTA_HEADERS,
+    });
+    if (!res.ok) {
+      return null;
+    }
+    return await res.json();
+  } catch (e) {
+    return null;
+  }
+}
+
+// 金額を 3桁区切りで表示する（テンプレートの intcomma と同じ表記）
+function formatYen(value) {
+  return Number(value).toLocaleString("ja-JP");
+}
+
+// 差分 JSON のカート集計値を右ペインとナビゲーションバーに反映する
+function applyCartDelta(summary, cart) {
+  const setText = (field, text) => {
+    for (const el of summary.querySelectorAll(`[data-cart-field="${field}"]`)) {
+      el.textContent = text;
+    }
+  };
+
+  setText("badge", `総個数 ${cart.total_quantity}`);
+  setText("total_quantity", `支払合計 (${cart.total_quantity}点)`);
+  setText("payable_total", `(税込) ￥${formatYen(cart.payable_total)}`);
+
+  const hasPromotion = Boolean(
+    cart.promotion_code && cart.promotion_discount_amount,
+  );
+  summary
+    .querySelector("[data-cart-promotion]")
+    ?.classList.toggle("d-none", !hasPromotion);
+  if (hasPromotion) {
+    setText("promotion_code", `プロモーションコード (${cart.promotion_code})`);
+    setText(
+      "promotion_discount_amount",
+      `-￥${formatYen(cart.promotion_discount_amount)}`,
+    );
+  }
+
+  summary
+    .querySelector("[data-cart-empty]")
+    ?.classList.toggle("d-none", cart.item_count > 0);
+
+  // ナビゲーションバーのカートバッジを更新
+  const cartBadge = document.getElementById("cart-badge");
+  if (cartBadge) {
+    cartBadge.textContent = cart.total_quantity;
+  }
+}
+
 // 数字だけを抽出（ハイフン・スペース等を除去）
 function extractDigits(value) {
   return (value || "").replace(/\D/g, "");